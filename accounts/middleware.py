@@ -1,5 +1,5 @@
 from django.utils.deprecation import MiddlewareMixin
-from .utils import GUEST_ID_COOKIE_NAME, generate_guest_id
+from .utils import GUEST_ID_COOKIE_NAME, generate_guest_id, read_guest_id_cookie, sign_guest_id
 
 GUEST_ID_COOKIE_AGE = 365 * 24 * 60 * 60  # 1年間
 
@@ -7,7 +7,8 @@ GUEST_ID_COOKIE_AGE = 365 * 24 * 60 * 60  # 1年間
 class GuestIdMiddleware(MiddlewareMixin):
     """
     ゲストIDをクッキーで管理するミドルウェア
-    ゲストIDはクッキーにのみ保存し、Userテーブルには実際の操作時に保存される
+    ゲストIDは署名付きクッキーにのみ保存し、Userテーブルには実際の操作時に保存される
+    （このミドルウェアはDBにアクセスしない）
     """
     
     def process_request(self, request):
@@ -15,23 +16,15 @@ class GuestIdMiddleware(MiddlewareMixin):
         if request.user.is_authenticated:
             return None
         
-        # クッキーからゲストIDを取得
-        guest_id_str = request.COOKIES.get(GUEST_ID_COOKIE_NAME)
-        
-        # ゲストIDが存在しない場合は新しく生成
-        if not guest_id_str:
+        # クッキーからゲストIDを取得（署名を検証し、改ざん・無効な値は新しく発行し直す）
+        guest_id_str, needs_upgrade = read_guest_id_cookie(request.COOKIES.get(GUEST_ID_COOKIE_NAME))
+        if guest_id_str is None:
             guest_id_str = generate_guest_id()
             # クッキーを設定するためにrequestに保存
             request.set_guest_id_cookie = guest_id_str
-        else:
-            # ゲストIDの形式を検証（UUID形式かどうか）
-            try:
-                import uuid
-                uuid.UUID(guest_id_str)
-            except (ValueError, TypeError):
-                # 無効なUUIDの場合は新しく生成
-                guest_id_str = generate_guest_id()
-                request.set_guest_id_cookie = guest_id_str
+        elif needs_upgrade:
+            # 旧形式（署名なし）のクッキーは同じIDのまま署名付きに置き換える
+            request.set_guest_id_cookie = guest_id_str
         
         # requestにゲストIDを保存（後で使用可能にするため）
         request.guest_id = guest_id_str
@@ -48,7 +41,7 @@ class GuestIdMiddleware(MiddlewareMixin):
             )
             response.set_cookie(
                 GUEST_ID_COOKIE_NAME,
-                request.set_guest_id_cookie,
+                sign_guest_id(request.set_guest_id_cookie),
                 max_age=GUEST_ID_COOKIE_AGE,
                 httponly=True,
                 samesite='Lax',
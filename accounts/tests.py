@@ -1,3 +1,120 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+import uuid
 
-# Create your tests here.
+from userlists.models import UserList
+from userpost.models import ContentData, UserPost
+
+from .middleware import GuestIdMiddleware
+from .utils import GUEST_ID_COOKIE_NAME, get_actor, get_or_create_guest_user, sign_guest_id
+
+
+class TestGuestIdMiddleware(TestCase):
+    """署名付きゲストIDクッキーのテスト"""
+
+    def run_middleware(self, cookie=None):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        if cookie is not None:
+            request.COOKIES[GUEST_ID_COOKIE_NAME] = cookie
+        middleware = GuestIdMiddleware(lambda r: HttpResponse())
+        with self.assertNumQueries(0):
+            response = middleware(request)
+        return request, response.cookies.get(GUEST_ID_COOKIE_NAME)
+
+    def test_issues_signed_cookie_without_queries(self):
+        request, cookie = self.run_middleware()
+        self.assertEqual(cookie.value, sign_guest_id(request.guest_id))
+        uuid.UUID(request.guest_id)
+
+        # 署名付きのクッキーはそのまま使い、発行し直さない
+        again, cookie = self.run_middleware(sign_guest_id(request.guest_id))
+        self.assertEqual(again.guest_id, request.guest_id)
+        self.assertIsNone(cookie)
+
+    def test_tampered_cookie_is_replaced(self):
+        victim = str(uuid.uuid4())
+        forged = sign_guest_id(str(uuid.uuid4())).rsplit(':', 1)[1]
+        for value in [f'{victim}:{forged}', 'not-a-uuid', sign_guest_id('not-a-uuid')]:
+            request, cookie = self.run_middleware(value)
+            self.assertNotEqual(request.guest_id, victim)
+            self.assertEqual(cookie.value, sign_guest_id(request.guest_id))
+
+    def test_legacy_unsigned_cookie(self):
+        legacy = str(uuid.uuid4())
+        request, cookie = self.run_middleware(legacy)
+        # 同じIDのまま署名付きに置き換える
+        self.assertEqual(request.guest_id, legacy)
+        self.assertEqual(cookie.value, sign_guest_id(legacy))
+
+        with override_settings(GUEST_ID_ACCEPT_UNSIGNED=False):
+            request, cookie = self.run_middleware(legacy)
+        self.assertNotEqual(request.guest_id, legacy)
+
+    def test_anonymous_get_has_no_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('guest-info'))
+        guest_id = response.json()['guest_id']
+        self.assertEqual(response.cookies[GUEST_ID_COOKIE_NAME].value, sign_guest_id(guest_id))
+        # ゲストのユーザーは最初の書き込みまで作らない
+        user, created = get_or_create_guest_user(guest_id)
+        self.assertTrue(created)
+
+
+class TestActor(TestCase):
+    """操作主体（get_actor）の解決のテスト"""
+
+    def test_resolved_once(self):
+        guest_id = str(uuid.uuid4())
+        guest, _ = get_or_create_guest_user(guest_id)
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        request.COOKIES[GUEST_ID_COOKIE_NAME] = sign_guest_id(guest_id)
+        with self.assertNumQueries(0):
+            GuestIdMiddleware(lambda r: HttpResponse())(request)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_actor(request), (guest, f'u-{guest_id}'))
+        with self.assertNumQueries(0):
+            get_actor(request)
+        # 既存のゲストは作り直さない
+        self.assertEqual(get_or_create_guest_user(guest_id), (guest, False))
+
+    def test_guest_rename_only_renames_guest(self):
+        member = get_user_model().objects.create(username='member')
+        guest_id = str(uuid.uuid4())
+        client = APIClient()
+        client.force_authenticate(member)
+        client.cookies[GUEST_ID_COOKIE_NAME] = sign_guest_id(guest_id)
+        response = client.post(reverse('guest-rename'), {'username': 'renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        member.refresh_from_db()
+        self.assertEqual(member.username, 'member')
+        self.assertEqual(get_or_create_guest_user(guest_id)[0].username, 'renamed')
+
+    def test_guest_post_resolves_actor_once(self):
+        guest_id = str(uuid.uuid4())
+        guest, _ = get_or_create_guest_user(guest_id)
+        userlist = UserList.objects.create(owner=guest, name='list')
+        content = ContentData.objects.create(
+            content_url='https://www.dlsite.com/maniax/work/=/product_id/RJ01230861.html', title='T',
+        )
+        self.client.cookies[GUEST_ID_COOKIE_NAME] = sign_guest_id(guest_id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('userpost-list'),
+                {'content_url': content.content_url, 'list_id': userlist.id},
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(UserPost.objects.get().user, guest)
+        # ビューとシリアライザの両方が操作主体を使うが、ゲストの取得は1回だけ
+        table = get_user_model()._meta.db_table
+        lookups = [q['sql'] for q in queries if f'FROM "{table}"' in q['sql'] and 'guest_id' in q['sql']]
+        self.assertEqual(len(lookups), 1)
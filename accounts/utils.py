@@ -1,8 +1,11 @@
 import uuid
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core import signing
 
 User = get_user_model()
 GUEST_ID_COOKIE_NAME = 'guest_id'
+GUEST_ID_SALT = 'accounts.guest_id'
 
 
 def get_or_create_guest_user(guest_id_str):
@@ -19,40 +22,81 @@ def get_or_create_guest_user(guest_id_str):
         guest_id = uuid.UUID(guest_id_str)
     except (ValueError, TypeError):
         return None, False
-    
-    # 既存のゲストユーザーを取得
-    try:
-        user = User.objects.get(guest_id=guest_id)
-        return user, False
-    except User.DoesNotExist:
-        pass
-    
-    # 既存のusernameと競合しないように確認
+
+    # 同じゲストの同時リクエストでも1件だけ作成する（guest_id の unique 制約で競合を検出し、再取得する）
     # ゲストユーザーはusernameなしで作成
-    user = User.objects.create(
+    return User.objects.get_or_create(
         guest_id=guest_id,
-        username=None,
-        is_active=True,
+        defaults={'username': None, 'is_active': True},
     )
-    return user, True
+
+
+def get_actor(request):
+    """
+    リクエストの操作主体（認証済みユーザー、なければゲストユーザー）を返す
+    1リクエストにつき1回だけ解決し、結果をリクエストに保持する（ゲストユーザーはここで初めて作成される）
+
+    Args:
+        request: HttpRequest または DRF の Request
+
+    Returns:
+        (user, actor_name) タプル。操作主体がいなければ (None, None)
+        actor_name は username_legacy と照合する名前（ゲストは u-{guest_id}）
+    """
+    # DRF の Request と元の HttpRequest で同じ結果を共有する
+    http_request = getattr(request, '_request', request)
+    actor = getattr(http_request, '_actor', None)
+    if actor is not None:
+        return actor
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        actor = (user, user.username)
+    else:
+        guest_id = getattr(http_request, 'guest_id', None)
+        guest = get_or_create_guest_user(guest_id)[0] if guest_id else None
+        actor = (guest, f"u-{guest_id}") if guest else (None, None)
+    http_request._actor = actor
+    return actor
 
 
 def generate_guest_id():
     """
-    既存のUserと競合しないゲストIDを生成する
-    
+    新しいゲストIDを生成する（DBは参照しない）
+    UUID4 の衝突は事実上起きず、guest_id の unique 制約が最後の歯止めになる
+
     Returns:
         ゲストIDの文字列（UUID形式）
     """
-    max_attempts = 10
-    for _ in range(max_attempts):
-        guest_id = uuid.uuid4()
-        # guest_idが既存のUserと競合しないか確認
-        if not User.objects.filter(guest_id=guest_id).exists():
-            return str(guest_id)
-        # usernameがNoneでguest_idがNoneのユーザーとも競合しないようにする
-        # （実際にはguest_idでunique制約があるので、このチェックは不要だが念のため）
-    
-    # 万が一衝突した場合は新しいIDを返す（ほぼ起きない）
     return str(uuid.uuid4())
 
+
+def sign_guest_id(guest_id_str):
+    """ゲストIDをクッキーに保存する署名付きの値にする"""
+    return signing.Signer(salt=GUEST_ID_SALT).sign(guest_id_str)
+
+
+def read_guest_id_cookie(value):
+    """
+    クッキーの値からゲストIDを取り出す（DBは参照しない）
+
+    Args:
+        value: クッキーの値（署名付き、または GUEST_ID_ACCEPT_UNSIGNED 時は旧形式の UUID のみ）
+
+    Returns:
+        (guest_id, needs_upgrade) タプル。無効な値なら (None, False)
+        needs_upgrade は旧形式の値で、署名付きのクッキーに置き換えるべきかどうか
+    """
+    if not value:
+        return None, False
+    try:
+        guest_id = signing.Signer(salt=GUEST_ID_SALT).unsign(value)
+        needs_upgrade = False
+    except signing.BadSignature:
+        if not settings.GUEST_ID_ACCEPT_UNSIGNED:
+            return None, False
+        guest_id, needs_upgrade = value, True
+    try:
+        return str(uuid.UUID(guest_id)), needs_upgrade
+    except (ValueError, TypeError):
+        return None, False
+
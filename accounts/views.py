@@ -78,7 +78,8 @@ class GuestRenameUsernameView(APIView):
         if not guest_id:
             return Response({'error': 'ゲストIDが見つかりません'}, status=status.HTTP_400_BAD_REQUEST)
         
-        user, created = get_or_create_guest_user(guest_id)
+        # ログイン中でもゲストIDのユーザーだけを対象にする（本登録のユーザー名は rename/ で変更する）
+        user, _ = get_or_create_guest_user(guest_id)
         if not user:
             return Response({'error': 'ユーザーの取得に失敗しました'}, status=status.HTTP_400_BAD_REQUEST)
         
@@ -0,0 +1,122 @@
+"""
+キーセット（カーソル）ページネーション
+
+(created_at, id) の組で位置を表し、「前のページの最後の行より後」を WHERE 条件で取り出すので
+深いページでも最初のページと同じコストで取得でき、COUNT(*) も発行しない。
+カーソルは位置を base64 にした不透明な文字列で、next/previous のURLに含めて返す。
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    ordering の2列（1列目: 日時、2列目: 一意なID）でのキーセットページネーション
+    ?page_size= で件数を指定でき、max_page_size を上限とする
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = '無効なカーソルです'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = ordering
+        self.page_size = api_settings.PAGE_SIZE
+        self.max_page_size = settings.API_MAX_PAGE_SIZE
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, row, reverse):
+        value_field, id_field = (f.lstrip('-') for f in self.ordering)
+        position = {'v': getattr(row, value_field).isoformat(), 'id': getattr(row, id_field), 'r': reverse}
+        token = base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token.rstrip('='))
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            return datetime.fromisoformat(position['v']), int(position['id']), bool(position['r'])
+        except (TypeError, ValueError, KeyError, json.JSONDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, value, pk, descending):
+        """ordering の順で (value, pk) より後ろの行の条件"""
+        value_field, id_field = (f.lstrip('-') for f in self.ordering)
+        op = 'lt' if descending else 'gt'
+        return Q(**{f'{value_field}__{op}': value}) | Q(**{value_field: value, f'{id_field}__{op}': pk})
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        descending = self.ordering[0].startswith('-')
+
+        reverse = bool(cursor and cursor[2])
+        if reverse:
+            # 前のページは逆順に取り出してから並べ直す
+            ordering = [f[1:] if f.startswith('-') else '-' + f for f in self.ordering]
+            queryset = queryset.order_by(*ordering).filter(self.after(cursor[0], cursor[1], not descending))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+            if cursor:
+                queryset = queryset.filter(self.after(cursor[0], cursor[1], descending))
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
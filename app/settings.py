@@ -112,9 +112,26 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # 複数ワーカー・スレッドからの同時書き込みでロック待ちできるようにする
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+            # 並行実行のテストがあるため、テストDBも共有キャッシュのメモリDBではなくファイルにする
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
         }
     }
 
+# キャッシュ（既定はプロセスごとのメモリ。ワーカー間で共有するなら Redis や DatabaseCache を指定する）
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', ''),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -174,7 +191,12 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
     'EXCEPTION_HANDLER': 'app.views.custom_exception_handler',
+    # 一覧は (created_at, id) のキーセットページネーション（app.pagination）
+    'DEFAULT_PAGINATION_CLASS': 'app.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', '30')),
 }
+# ?page_size= で指定できる件数の上限
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', '100'))
 
 # CORS settings for local React dev server
 cors_origins = os.getenv('DJANGO_CORS_ALLOWED_ORIGINS', '')
@@ -204,6 +226,56 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
 }
+# dlsite OGPキャッシュの有効期間（秒）。失敗結果は短めに保持する
+OGP_CACHE_TTL = int(os.getenv('OGP_CACHE_TTL', str(7 * 24 * 60 * 60)))
+OGP_CACHE_NEGATIVE_TTL = int(os.getenv('OGP_CACHE_NEGATIVE_TTL', str(10 * 60)))
+# OGPキャッシュのヒット数はプロセス内で数え、この回数ごとにまとめてDBに書き込む（参照のたびに書き込まない）
+OGP_CACHE_HIT_FLUSH_EVERY = int(os.getenv('OGP_CACHE_HIT_FLUSH_EVERY', '100'))
+# OGP取得時に読み込む最大バイト数（通常は </head> で打ち切られる）
+OGP_MAX_HEAD_BYTES = int(os.getenv('OGP_MAX_HEAD_BYTES', str(256 * 1024)))
+# dlsite HTTPクライアント（接続プール・再試行・同時実行数・サーキットブレーカー）
+DLSITE_HTTP_TIMEOUT = float(os.getenv('DLSITE_HTTP_TIMEOUT', '5'))
+DLSITE_HTTP_POOL_SIZE = int(os.getenv('DLSITE_HTTP_POOL_SIZE', '10'))
+DLSITE_HTTP_MAX_RETRIES = int(os.getenv('DLSITE_HTTP_MAX_RETRIES', '2'))
+DLSITE_HTTP_BACKOFF = float(os.getenv('DLSITE_HTTP_BACKOFF', '0.3'))
+DLSITE_HTTP_MAX_CONCURRENCY = int(os.getenv('DLSITE_HTTP_MAX_CONCURRENCY', '8'))
+# 途中で読むのをやめたレスポンスの残りがこのバイト数以下なら読み捨てて接続を再利用する（超える場合は切断する）
+# 作品ページは </head> 以降が大きく、読み捨てると先頭だけ読む意味がなくなるので、短いエラーページ程度に留める
+DLSITE_HTTP_DRAIN_MAX_BYTES = int(os.getenv('DLSITE_HTTP_DRAIN_MAX_BYTES', str(8 * 1024)))
+DLSITE_BREAKER_THRESHOLD = int(os.getenv('DLSITE_BREAKER_THRESHOLD', '5'))
+DLSITE_BREAKER_COOLDOWN = float(os.getenv('DLSITE_BREAKER_COOLDOWN', '30'))
+# dlsite へのリクエストを別の origin に向ける（例: http://127.0.0.1:8765 で dlsite_replay を使う。本番では空）
+DLSITE_ORIGIN_OVERRIDE = os.getenv('DLSITE_ORIGIN_OVERRIDE', '')
+# 同じ作品を同時に登録したとき、OGP取得を1プロセスに絞るためのリース期間と待ち時間（秒）
+SINGLE_FLIGHT_LEASE_SECONDS = float(os.getenv('SINGLE_FLIGHT_LEASE_SECONDS', '30'))
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv('SINGLE_FLIGHT_WAIT_SECONDS', '15'))
+# 一括登録（posts/bulk_create）の上限URL数と、OGPの同時取得数
+BULK_IMPORT_MAX_URLS = int(os.getenv('BULK_IMPORT_MAX_URLS', '500'))
+OGP_BULK_FETCH_WORKERS = int(os.getenv('OGP_BULK_FETCH_WORKERS', '8'))
+# 1にすると投稿作成時のOGP取得をジョブキューに回し、202を即時に返す（run_jobs ワーカーが必要）
+OGP_ASYNC_CREATE = os.getenv('OGP_ASYNC_CREATE', '0') == '1'
+# 1にすると登録数の加減算を CounterDelta に追記し、flush_counters でまとめて反映する（人気作品の行ロック待ち対策）
+COUNTER_WRITE_BEHIND = os.getenv('COUNTER_WRITE_BEHIND', '0') == '1'
+# 公開ユーザー一覧のスナップショットの保持秒数（内容が変わればバージョンで無効化される）
+PUBLIC_USERS_CACHE_TTL = int(os.getenv('PUBLIC_USERS_CACHE_TTL', '600'))
+# 公開一覧・リストの応答キャッシュの保持秒数（内容が変わればバージョンでキーが変わる）
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '300'))
+# 署名なしの旧形式のゲストIDクッキーを受け付け、署名付きに置き換える（移行期間が過ぎたら 0 にする）
+GUEST_ID_ACCEPT_UNSIGNED = os.getenv('GUEST_ID_ACCEPT_UNSIGNED', '1') == '1'
+# 作品データの読み取りキャッシュ: ワーカー内 LRU の件数・保持秒数と、共有キャッシュ（CACHES）の保持秒数
+CONTENT_CACHE_LOCAL_SIZE = int(os.getenv('CONTENT_CACHE_LOCAL_SIZE', '2048'))
+CONTENT_CACHE_LOCAL_TTL = int(os.getenv('CONTENT_CACHE_LOCAL_TTL', '10'))
+CONTENT_CACHE_TTL = int(os.getenv('CONTENT_CACHE_TTL', '600'))
+# refresh_content_data: この日数より前に取得した作品を再取得する／1分あたりの最大リクエスト数
+OGP_REFRESH_MAX_AGE_DAYS = int(os.getenv('OGP_REFRESH_MAX_AGE_DAYS', '30'))
+OGP_REFRESH_RPM = int(os.getenv('OGP_REFRESH_RPM', '30'))
+# 投稿がこの件数を超えるリストは削除をジョブキュー（delete_list）に回し、202を即時に返す
+LIST_DELETE_SYNC_LIMIT = int(os.getenv('LIST_DELETE_SYNC_LIMIT', '500'))
+# バックグラウンド削除で1トランザクションに削除する投稿数
+LIST_DELETE_CHUNK_SIZE = int(os.getenv('LIST_DELETE_CHUNK_SIZE', '200'))
+# purge_guests: この日数より長く操作のないゲストユーザーとそのデータを削除する
+GUEST_PURGE_AFTER_DAYS = int(os.getenv('GUEST_PURGE_AFTER_DAYS', '180'))
+
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
 SESSION_COOKIE_SECURE = not DEBUG
 CSRF_COOKIE_SECURE = not DEBUG
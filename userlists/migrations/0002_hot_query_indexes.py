@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userlists', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userlist',
+            index=models.Index(fields=['owner', '-updated_at'], name='userlist_owner_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userlists', '0002_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userlist',
+            name='deleting',
+            field=models.BooleanField(default=False),
+        ),
+    ]
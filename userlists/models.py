@@ -14,11 +14,17 @@ class UserList(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     goot_count = models.IntegerField(default=0)
+    # 投稿の多いリストをバックグラウンドで削除している間は True（一覧・取得の対象外）
+    deleting = models.BooleanField(default=False)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['owner', 'name'], name='uniq_owner_list_name'),
         ]
+        indexes = [
+            # ユーザーのリスト一覧（更新順）
+            models.Index(fields=['owner', '-updated_at'], name='userlist_owner_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.owner_id}:{self.name}"
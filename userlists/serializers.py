@@ -1,24 +1,46 @@
 from rest_framework import serializers
 from .models import UserList, GootList
+from userpost import counters
 
 
 class UserListSerializer(serializers.ModelSerializer):
     owner_id = serializers.IntegerField(source='owner.id', read_only=True)
     is_goot = serializers.SerializerMethodField()
+    is_owner = serializers.SerializerMethodField()
     owner_username = serializers.CharField(source='owner.username', read_only=True)
+    goot_count = serializers.SerializerMethodField()
 
     class Meta:
         model = UserList
-        fields = ['id', 'owner_id', 'owner_username', 'name', 'description', 'is_public', 'goot_count', 'created_at', 'updated_at', 'is_goot']
-        read_only_fields = ['id', 'owner_id', 'owner_username', 'goot_count', 'created_at', 'updated_at', 'is_goot']
+        fields = ['id', 'owner_id', 'owner_username', 'name', 'description', 'is_public', 'goot_count', 'created_at', 'updated_at', 'is_goot', 'is_owner']
+        read_only_fields = ['id', 'owner_id', 'owner_username', 'goot_count', 'created_at', 'updated_at', 'is_goot', 'is_owner']
 
-    def get_is_goot(self, obj):
+    def get_goot_count(self, obj):
+        # COUNTER_WRITE_BEHIND 時は未反映の増減を足す
+        return counters.effective(obj, 'goot_count')
+
+    def _viewer(self):
         request = self.context.get('request')
         user = getattr(request, 'user', None)
         if not user or not getattr(user, 'is_authenticated', False):
+            return None
+        return user
+
+    def get_is_goot(self, obj):
+        # 一覧ではビューで注釈済み（viewer_is_goot）。単体で渡されたときだけ個別に問い合わせる
+        if hasattr(obj, 'viewer_is_goot'):
+            return obj.viewer_is_goot
+        user = self._viewer()
+        if user is None:
             return False
         return GootList.objects.filter(user=user, userlist=obj).exists()
 
+    def get_is_owner(self, obj):
+        if hasattr(obj, 'viewer_is_owner'):
+            return obj.viewer_is_owner
+        user = self._viewer()
+        return user is not None and obj.owner_id == user.id
+
 
 class UserListCreateUpdateSerializer(serializers.ModelSerializer):
     class Meta:
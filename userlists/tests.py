@@ -1,3 +1,147 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from unittest.mock import patch
+import uuid
 
-# Create your tests here.
+from userpost import jobs
+from userpost.models import ContentData, Good, UserPost
+
+from .models import GootList, UserList
+
+
+class TestViewerFlags(APITestCase):
+    """一覧の is_goot / is_owner を注釈で返すテスト"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.owner = User.objects.create(username='owner')
+        self.viewer = User.objects.create(username='viewer')
+        self.client.cookies['guest_id'] = str(uuid.uuid4())
+        self.client.force_authenticate(self.viewer)
+
+    def add_lists(self, start, n):
+        for i in range(start, start + n):
+            userlist = UserList.objects.create(owner=self.owner, name=f'list{i}')
+            GootList.objects.create(user=self.viewer, userlist=userlist)
+
+    def count_queries(self, name, username):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name), {'username': username})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(queries.captured_queries)
+
+    def test_flags(self):
+        self.add_lists(0, 2)
+        UserList.objects.create(owner=self.viewer, name='mine')
+        response, _ = self.count_queries('userlist-by-user', 'owner')
+        # 作成時に 'Home' リストも作られる
+        flags = {r['name']: (r['is_goot'], r['is_owner']) for r in response.data['results']}
+        self.assertEqual(flags, {'list0': (True, False), 'list1': (True, False), 'Home': (False, False)})
+
+        response = self.client.get(reverse('userlist-list'))
+        self.assertEqual({(r['is_goot'], r['is_owner']) for r in response.data['results']}, {(False, True)})
+
+        self.client.force_authenticate(None)
+        response, _ = self.count_queries('userlist-by-user', 'owner')
+        self.assertFalse(any(r['is_goot'] or r['is_owner'] for r in response.data['results']))
+
+    def test_query_count_is_constant(self):
+        for name, username in [('userlist-by-user', 'owner'), ('userlist-favorites-by-user', 'viewer'), ('userlist-favorites', '')]:
+            UserList.objects.all().delete()
+            self.add_lists(0, 2)
+            _, few = self.count_queries(name, username)
+            self.add_lists(2, 6)
+            response, many = self.count_queries(name, username)
+            self.assertEqual(len(response.data['results']), 8)
+            self.assertEqual(few, many, name)
+
+
+class TestListDestroy(APITestCase):
+    """リスト削除（投稿・Good・登録数のまとめて削除）のテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def setUp(self):
+        User = get_user_model()
+        self.owner = User.objects.create(username='owner')
+        self.other = User.objects.create(username='other')
+        self.client.cookies['guest_id'] = str(uuid.uuid4())
+        self.client.force_authenticate(self.owner)
+
+    def make_list(self, name, n):
+        userlist = UserList.objects.create(owner=self.owner, name=name)
+        for i in range(n):
+            url = self.base + f'RJ{name}{i:04d}.html'
+            content = ContentData.objects.create(content_url=url, good_count=1)
+            UserPost.objects.create(user=self.owner, username_legacy='owner', content_url=url, content=content, list=userlist)
+            Good.objects.create(user=self.owner, username_legacy='owner', content_url=url, content=content)
+        return userlist
+
+    def test_destroy_updates_counts(self):
+        userlist = self.make_list('1000', 3)
+        shared = ContentData.objects.get(content_url=self.base + 'RJ10000000.html')
+        Good.objects.create(user=self.other, username_legacy='other', content_url=shared.content_url, content=shared)
+        ContentData.objects.filter(pk=shared.pk).update(good_count=2)
+
+        response = self.client.delete(reverse('userlist-detail', args=[userlist.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(UserList.objects.filter(id=userlist.id).exists())
+        self.assertFalse(UserPost.objects.exists())
+        # 他のユーザーも登録している作品だけが残る
+        self.assertEqual(list(ContentData.objects.values_list('id', 'good_count')), [(shared.id, 1)])
+        self.assertEqual(list(Good.objects.values_list('user__username', flat=True)), ['other'])
+
+    def test_query_count_does_not_grow_with_posts(self):
+        counts = []
+        for name, n in [('2000', 2), ('3000', 20)]:
+            userlist = self.make_list(name, n)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.delete(reverse('userlist-detail', args=[userlist.id]))
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    @override_settings(LIST_DELETE_SYNC_LIMIT=2, LIST_DELETE_CHUNK_SIZE=2)
+    def test_large_list_is_deleted_in_background(self):
+        userlist = self.make_list('4000', 5)
+        response = self.client.delete(reverse('userlist-detail', args=[userlist.id]))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        # 削除が終わるまで一覧には出さない
+        response = self.client.get(reverse('userlist-by-user'), {'username': 'owner'})
+        self.assertNotIn(userlist.id, [r['id'] for r in response.data['results']])
+        self.assertEqual(UserPost.objects.count(), 5)
+
+        jobs.run_pending()
+        self.assertFalse(UserList.objects.filter(id=userlist.id).exists())
+        self.assertFalse(UserPost.objects.exists() or Good.objects.exists() or ContentData.objects.exists())
+
+
+class TestGoot(APITestCase):
+    """お気に入り登録・解除のテスト"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.owner = User.objects.create(username='goot_owner')
+        self.viewer = User.objects.create(username='goot_viewer')
+        self.userlist = UserList.objects.create(owner=self.owner, name='公開', is_public=True)
+        self.client.cookies['guest_id'] = str(uuid.uuid4())
+        self.client.force_authenticate(self.viewer)
+
+    def goot(self):
+        response = self.client.post(reverse('userlist-goot', args=[self.userlist.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_toggle(self):
+        self.assertEqual(self.goot(), {'is_goot': True, 'goot_count': 1})
+        self.assertEqual(self.goot(), {'is_goot': False, 'goot_count': 0})
+
+    def test_count_falls_back_when_row_is_gone(self):
+        # 加減算の対象行が消えていた場合も件数を null にしない
+        with patch('userlists.views.adjust', return_value=None):
+            self.assertEqual(self.goot(), {'is_goot': True, 'goot_count': 0})
+            self.assertEqual(self.goot(), {'is_goot': False, 'goot_count': 0})
@@ -8,13 +8,21 @@ from rest_framework.decorators import action, authentication_classes
 from rest_framework.response import Response
 from .models import UserList, GootList
 from .serializers import UserListSerializer, UserListCreateUpdateSerializer
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.db import transaction
-from userpost.models import UserPost, Good, ContentData
-from accounts.utils import get_or_create_guest_user
+from django.db.models import Exists, OuterRef, Q, Value
+from userpost import jobs, versions
+from userpost.conditional import Validators, list_scope
+from userpost.models import UserPost
+from userpost.counters import adjust, effective, with_pending
+from userpost.services import delete_posts
+from accounts.utils import get_actor
+from app.pagination import KeysetPagination
 
 
 class UserListViewSet(viewsets.ModelViewSet):
-    queryset = UserList.objects.all().order_by('-created_at')
+    queryset = UserList.objects.filter(deleting=False).select_related('owner').order_by('-created_at')
     
     def get_permissions(self):
         # ゲストユーザーもリスト管理できるようにAllowAnyに変更
@@ -23,7 +31,7 @@ class UserListViewSet(viewsets.ModelViewSet):
         return [IsAuthenticated()]
 
     def get_queryset(self):
-        qs = super().get_queryset()
+        qs = self._with_viewer_flags(with_pending(super().get_queryset(), 'goot_count'))
         if self.action in ['retrieve_public', 'retrieve', 'goot']:
             return qs
         # ゲストユーザーも含めて、現在のユーザーのリストを取得
@@ -34,14 +42,27 @@ class UserListViewSet(viewsets.ModelViewSet):
     
     def _get_current_user(self):
         """認証済みユーザーまたはゲストユーザーを取得"""
-        if self.request.user.is_authenticated:
-            return self.request.user
-        # ゲストユーザーの場合
-        guest_id = getattr(self.request, 'guest_id', None)
-        if guest_id:
-            user, _ = get_or_create_guest_user(guest_id)
-            return user
-        return None
+        return get_actor(self.request)[0]
+
+    def _with_viewer_flags(self, qs):
+        """
+        閲覧者から見たフラグ（is_goot / is_owner）を注釈する
+        シリアライザがリストごとに EXISTS を発行しないよう、一覧の取得クエリにまとめる
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return qs.annotate(viewer_is_goot=Value(False), viewer_is_owner=Value(False))
+        return qs.annotate(
+            viewer_is_goot=Exists(GootList.objects.filter(user=user, userlist=OuterRef('pk'))),
+            viewer_is_owner=Q(owner=user),
+        )
+
+    def _paginated_by_updated(self, qs, request):
+        """更新順（updated_at, id）のキーセットページネーションで返す"""
+        paginator = KeysetPagination(ordering=('-updated_at', '-id'))
+        page = paginator.paginate_queryset(qs, request, view=self)
+        serializer = UserListSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -90,18 +111,23 @@ class UserListViewSet(viewsets.ModelViewSet):
         if not user:
             return Response({'detail': '認証が必要です'}, status=403)
         gl = GootList.objects.filter(user=user, userlist=userlist).first()
+        # 加減算できなかった場合（同時に解除済み・リストが削除済み）は読み込み時の値を返す
+        goot_count = None
         if gl:
-            gl.delete()
-            userlist.goot_count = max(0, userlist.goot_count - 1)
-            userlist.save(update_fields=['goot_count'])
-            return Response({'is_goot': False, 'goot_count': userlist.goot_count})
+            deleted, _ = GootList.objects.filter(pk=gl.pk).delete()
+            if deleted:
+                goot_count = adjust(UserList, userlist.pk, 'goot_count', -deleted)
+            if goot_count is None:
+                goot_count = effective(userlist, 'goot_count')
+            return Response({'is_goot': False, 'goot_count': goot_count})
         # 新規のお気に入り登録は公開リストに限り再開
         if userlist.is_public:
             GootList.objects.create(user=user, userlist=userlist)
-            userlist.goot_count += 1
-            userlist.save(update_fields=['goot_count'])
-            return Response({'is_goot': True, 'goot_count': userlist.goot_count})
-        return Response({'detail': 'new_favorite_disabled', 'is_goot': False, 'goot_count': userlist.goot_count}, status=status.HTTP_403_FORBIDDEN)
+            goot_count = adjust(UserList, userlist.pk, 'goot_count', 1)
+            if goot_count is None:
+                goot_count = effective(userlist, 'goot_count')
+            return Response({'is_goot': True, 'goot_count': goot_count})
+        return Response({'detail': 'new_favorite_disabled', 'is_goot': False, 'goot_count': effective(userlist, 'goot_count')}, status=status.HTTP_403_FORBIDDEN)
 
     @action(detail=True, methods=['get'], permission_classes=[AllowAny])
     @authentication_classes([])
@@ -113,8 +139,12 @@ class UserListViewSet(viewsets.ModelViewSet):
             if not user or not getattr(user, 'is_authenticated', False) or (user != userlist.owner and not GootList.objects.filter(user=user, userlist=userlist).exists()):
                 # 非公開: オーナーとGootList登録者以外は閲覧不可。フロントで申請UIを出せるよう最小情報を返す
                 return Response({'detail': 'forbidden', 'id': userlist.id, 'name': userlist.name, 'is_public': userlist.is_public}, status=403)
-        serializer = UserListSerializer(userlist, context={'request': request})
-        return Response(serializer.data)
+        scope = list_scope(request, userlist.owner_id, userlist.id)
+        # オーナー名も応答に含むので、オーナーの改名でも無効にする
+        validators = Validators(request, [versions.userlist(userlist.id), versions.user(userlist.owner_id)], scope=scope)
+        if validators.not_modified():
+            return validators.not_modified()
+        return validators.cached(lambda: Response(UserListSerializer(userlist, context={'request': request}).data))
 
     def destroy(self, request, *args, **kwargs):
         userlist = self.get_object()
@@ -122,29 +152,18 @@ class UserListViewSet(viewsets.ModelViewSet):
         user = self._get_current_user()
         if not user or user != userlist.owner:
             return Response({'detail': '権限がありません'}, status=403)
+        posts = UserPost.objects.filter(list=userlist)
         try:
+            if posts.count() > settings.LIST_DELETE_SYNC_LIMIT:
+                # 大きいリストは一覧から外してからジョブで少しずつ削除する
+                with transaction.atomic():
+                    UserList.objects.filter(pk=userlist.pk).update(deleting=True)
+                    versions.bump_many([versions.userlist(userlist.id), versions.user(userlist.owner_id)])
+                    jobs.enqueue('delete_list', list_id=userlist.id)
+                return Response({'detail': 'deleting', 'id': userlist.id}, status=status.HTTP_202_ACCEPTED)
             with transaction.atomic():
-                # 紐づく投稿を削除し、ContentDataのカウントを整合
-                posts = list(UserPost.objects.filter(list=userlist))
-                for p in posts:
-                    content_url = p.content_url
-                    # Goodの削除（user優先、なければusername_legacy）
-                    good_qs = Good.objects.filter(user=p.user, content_url=content_url)
-                    if not good_qs.exists():
-                        good_qs = Good.objects.filter(username_legacy=p.username_legacy, content_url=content_url)
-                    cnt = good_qs.count()
-                    if cnt:
-                        cd = ContentData.objects.filter(content_url=content_url).first()
-                        if cd:
-                            cd.good_count -= cnt
-                            if cd.good_count <= 0:
-                                cd.delete()
-                            else:
-                                cd.save(update_fields=['good_count'])
-                        good_qs.delete()
-                    # 投稿本体を削除
-                    p.delete()
-                # リストを削除
+                # 紐づく投稿と Good をまとめて削除し、ContentDataのカウントを整合
+                delete_posts(posts)
                 self.perform_destroy(userlist)
                 return Response(status=204)
         except Exception:
@@ -155,32 +174,37 @@ class UserListViewSet(viewsets.ModelViewSet):
         user = self._get_current_user()
         if not user:
             return Response({'detail': '認証が必要です'}, status=403)
-        qs = UserList.objects.filter(goots__user=user).select_related('owner').distinct().order_by('-updated_at')
-        serializer = UserListSerializer(qs, many=True, context={'request': request})
-        return Response(serializer.data)
+        qs = UserList.objects.filter(goots__user=user, deleting=False).select_related('owner').distinct()
+        qs = self._with_viewer_flags(with_pending(qs, 'goot_count'))
+        return self._paginated_by_updated(qs, request)
 
     @action(detail=False, methods=['get'], permission_classes=[AllowAny])
     def by_user(self, request):
         username = request.query_params.get('username')
         if not username:
             return Response({'detail': 'username is required'}, status=400)
-        qs = UserList.objects.filter(owner__username=username)
+        owner_id = get_user_model().objects.filter(username=username).values_list('id', flat=True).first()
+        if owner_id is None:
+            return self._paginated_by_updated(UserList.objects.none(), request)
+        # リストの作成・変更・お気に入りでバージョンが上がる（userpost.signals）
+        validators = Validators(request, [versions.user(owner_id)])
+        if validators.not_modified():
+            return validators.not_modified()
+        qs = UserList.objects.filter(owner_id=owner_id, deleting=False)
         # 非オーナーは公開のみ
         if not request.user.is_authenticated or request.user.username != username:
             qs = qs.filter(is_public=True)
-        qs = qs.select_related('owner').order_by('-updated_at')
-        serializer = UserListSerializer(qs, many=True, context={'request': request})
-        return Response(serializer.data)
+        qs = self._with_viewer_flags(with_pending(qs.select_related('owner'), 'goot_count'))
+        return validators.cached(lambda: self._paginated_by_updated(qs, request))
 
     @action(detail=False, methods=['get'], permission_classes=[AllowAny])
     def favorites_by_user(self, request):
         username = request.query_params.get('username')
         if not username:
             return Response({'detail': 'username is required'}, status=400)
-        qs = UserList.objects.filter(goots__user__username=username).select_related('owner').distinct()
+        qs = UserList.objects.filter(goots__user__username=username, deleting=False).select_related('owner').distinct()
         # ビューアが当人でなければ公開のみ
         if not request.user.is_authenticated or request.user.username != username:
             qs = qs.filter(is_public=True)
-        qs = qs.order_by('-updated_at')
-        serializer = UserListSerializer(qs, many=True, context={'request': request})
-        return Response(serializer.data)
+        qs = self._with_viewer_flags(with_pending(qs, 'goot_count'))
+        return self._paginated_by_updated(qs, request)
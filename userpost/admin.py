@@ -1,3 +1,16 @@
 from django.contrib import admin
+from .models import OgpCache, Job
+
 
 # Register your models here.
+@admin.register(OgpCache)
+class OgpCacheAdmin(admin.ModelAdmin):
+    list_display = ('id', 'url', 'status', 'fetched_at', 'expires_at', 'hit_count', 'fetch_count')
+    search_fields = ('url',)
+    list_filter = ('status',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'run_after', 'created_at')
+    list_filter = ('kind', 'status')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class UserpostConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'userpost'
+
+    def ready(self):
+        # Register background job handlers and cache invalidation signals
+        from . import signals, tasks  # noqa: F401
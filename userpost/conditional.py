@@ -0,0 +1,119 @@
+"""
+条件付きGET（ETag / Last-Modified / 304）とレスポンスキャッシュ
+
+ETag はリソースのバージョン（userpost.versions）・閲覧者の区分・リクエストのURLから作るので、
+本文をシリアライズせずに計算できる。一致すればクエリセットの評価やシリアライズの前に 304 を返す。
+同じ ETag の応答は内容も同じなので、ETag をキーにしてサーバー側でも応答をキャッシュする。
+データが変わるとバージョンが上がってキーが変わるため、古いエントリを探して消す必要はない。
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from userlists.models import GootList
+
+from . import versions
+
+SCOPE_OWNER = 'owner'
+SCOPE_GOOT = 'goot'
+SCOPE_OTHER = 'other'
+
+_stats = {'hits': 0, 'misses': 0}
+
+
+def list_scope(request, owner_id, list_id):
+    """
+    リストに対する閲覧者の区分（オーナー / お気に入り登録者 / その他）
+    閲覧できる範囲と is_goot / is_owner は区分で決まるので、同じ区分の閲覧者は同じ応答を共有できる
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return SCOPE_OTHER
+    if user.id == owner_id:
+        return SCOPE_OWNER
+    if GootList.objects.filter(user=user, userlist_id=list_id).exists():
+        return SCOPE_GOOT
+    return SCOPE_OTHER
+
+
+def stats():
+    """レスポンスキャッシュのヒット数（このワーカープロセスの値）"""
+    return dict(_stats)
+
+
+class Validators:
+    """
+    names のバージョンから作る検証子
+    使い方:
+        validators = Validators(request, [versions.user(user_id)])
+        if validators.not_modified():
+            return validators.not_modified()
+        return validators.apply(Response(...))  # または validators.cached(build)
+    Args:
+        scope: 閲覧者の区分。省略時は閲覧者ごと（未ログインは共通）
+    """
+
+    def __init__(self, request, names, scope=None):
+        self.request = request
+        names = sorted(set(names))
+        current = versions.get_many(names)
+        self.versions = {name: current.get(name, (0, None))[0] for name in names}
+        if scope is None:
+            # is_goot / is_owner など閲覧者で内容が変わる
+            scope = f'viewer:{request.user.pk}' if request.user.is_authenticated else SCOPE_OTHER
+        parts = []
+        for name in names:
+            version, updated_at = current.get(name, (0, None))
+            # DBを作り直してバージョンが巻き戻っても古いキャッシュと衝突しないよう、更新日時も含める
+            parts.append(f'{name}={version}@{updated_at.isoformat() if updated_at else ""}')
+        parts += [f'scope={scope}', request.build_absolute_uri()]
+        self.etag = quote_etag(hashlib.sha1('|'.join(parts).encode()).hexdigest())
+        updated = [updated_at for _, updated_at in current.values()]
+        # HTTP の日時は秒単位なので切り捨てる（同じ秒の更新は ETag で区別する）
+        self.last_modified = int(max(updated).timestamp()) if updated else None
+        self._response = None
+
+    def not_modified(self):
+        """If-None-Match / If-Modified-Since に一致すれば 304 レスポンス、しなければ None"""
+        if self._response is None:
+            response = get_conditional_response(
+                self.request, etag=self.etag, last_modified=self.last_modified,
+            )
+            self._response = self._set_headers(response) if response is not None else False
+        return self._response or None
+
+    def apply(self, response):
+        """200 のレスポンスに検証子を付ける"""
+        if response.status_code == 200:
+            self._set_headers(response)
+        return response
+
+    def cached(self, build):
+        """
+        同じ ETag の応答をキャッシュから返し、なければ build() で作って保存する
+        Args:
+            build: Response を返す関数（200 以外は保存しない）
+        """
+        key = 'response:' + self.etag.strip('"')
+        data = cache.get(key)
+        if data is not None:
+            _stats['hits'] += 1
+            return self.apply(Response(data))
+        _stats['misses'] += 1
+        response = build()
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TTL)
+        return self.apply(response)
+
+    def _set_headers(self, response):
+        response['ETag'] = self.etag
+        if self.last_modified is not None:
+            response['Last-Modified'] = http_date(self.last_modified)
+        # 閲覧者ごとに内容が違うので、共有キャッシュには保存させず毎回検証させる
+        response['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(response, ['Cookie', 'Authorization'])
+        return response
@@ -0,0 +1,159 @@
+"""
+作品データ（ContentData）の読み取りキャッシュ
+
+1段目はワーカープロセス内の件数上限つき LRU、2段目は設定された Django のキャッシュ（CACHES）。
+作品IDをキーにし、ContentData の保存・削除時に userpost.signals から invalidate() される
+（トランザクション内ではコミット後に消す）。
+他のワーカーの LRU は消せないので、1段目は CONTENT_CACHE_LOCAL_TTL 秒で期限切れにする。
+登録数（good_count）は F() の UPDATE で変わるため少し古い値を返すことがある。
+正確な値が必要な処理は exact=True で DB から読むこと。
+削除済みの作品を返すこともあるので、外部キーの参照先に使う場合は行が残っているか確かめること。
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ContentData
+from .work_url import extract_product_id
+
+_lock = threading.Lock()
+_local = OrderedDict()
+_stats = {'local_hit': 0, 'shared_hit': 0, 'miss': 0}
+
+
+def _key(product_id):
+    return f'content_data:{product_id}'
+
+
+def _count(key, n=1):
+    with _lock:
+        _stats[key] += n
+
+
+def _local_get(product_id):
+    with _lock:
+        entry = _local.get(product_id)
+        if entry is None:
+            return None
+        expires, content = entry
+        if expires <= time.monotonic():
+            del _local[product_id]
+            return None
+        _local.move_to_end(product_id)
+        return content
+
+
+def _local_set(product_id, content):
+    with _lock:
+        _local[product_id] = (time.monotonic() + settings.CONTENT_CACHE_LOCAL_TTL, content)
+        _local.move_to_end(product_id)
+        while len(_local) > settings.CONTENT_CACHE_LOCAL_SIZE:
+            _local.popitem(last=False)
+
+
+def get(product_id, exact=False):
+    """
+    作品IDの ContentData を返す（なければ None）
+    Args:
+        exact: True ならキャッシュを使わず DB から読む（登録数を更新する処理など）
+    """
+    return get_many([product_id], exact=exact).get(product_id)
+
+
+def get_many(product_ids, exact=False):
+    """
+    複数の作品IDの ContentData をまとめて返す。LRU → 共有キャッシュ → DB（1クエリ）の順に引く
+    Returns:
+        {product_id: ContentData}（存在する作品のみ。呼び出し側で変更してよいコピー）
+    """
+    product_ids = {pid for pid in product_ids if pid}
+    if exact:
+        return {cd.product_id: cd for cd in ContentData.objects.filter(product_id__in=product_ids)}
+    found = {}
+    for pid in product_ids:
+        content = _local_get(pid)
+        if content is not None:
+            found[pid] = content
+    _count('local_hit', len(found))
+
+    missing = product_ids - found.keys()
+    if missing:
+        shared = cache.get_many([_key(pid) for pid in missing])
+        for pid in missing:
+            content = shared.get(_key(pid))
+            if content is not None:
+                found[pid] = content
+                _local_set(pid, content)
+                _count('shared_hit')
+
+    missing = product_ids - found.keys()
+    if missing:
+        _count('miss', len(missing))
+        loaded = {cd.product_id: cd for cd in ContentData.objects.filter(product_id__in=missing)}
+        # トランザクション内で読んだ行はロールバックされうるので保存しない
+        if loaded and not transaction.get_connection().in_atomic_block:
+            cache.set_many({_key(pid): cd for pid, cd in loaded.items()}, settings.CONTENT_CACHE_TTL)
+            for pid, cd in loaded.items():
+                _local_set(pid, cd)
+        found.update(loaded)
+    return {pid: copy.copy(cd) for pid, cd in found.items()}
+
+
+def get_for_url(url, exact=False):
+    """作品URL（表記ゆれ可）の ContentData を返す"""
+    product_id = extract_product_id(url)
+    if product_id is None:
+        return None
+    return get(product_id, exact=exact)
+
+
+def get_many_for_urls(urls, exact=False):
+    """
+    複数の作品URLの ContentData をまとめて返す
+    Returns:
+        {url: ContentData}（作品が存在するURLのみ）
+    """
+    ids = {url: extract_product_id(url) for url in urls}
+    contents = get_many(ids.values(), exact=exact)
+    return {url: contents[pid] for url, pid in ids.items() if pid in contents}
+
+
+def invalidate(product_id):
+    """
+    作品のキャッシュを消す（他のワーカーの LRU は CONTENT_CACHE_LOCAL_TTL で切れる）
+    トランザクション内ではコミット後に消す。先に消すと、コミット前に他のリクエストが
+    古い行を読んで CONTENT_CACHE_TTL の間キャッシュに戻してしまう
+    """
+    if not product_id:
+        return
+
+    def delete():
+        with _lock:
+            _local.pop(product_id, None)
+        cache.delete(_key(product_id))
+    transaction.on_commit(delete)
+
+
+def clear_local():
+    """このプロセスの LRU を空にする（テスト用）"""
+    with _lock:
+        _local.clear()
+
+
+def stats():
+    """段ごとのヒット数とヒット率（このワーカープロセスの値）"""
+    with _lock:
+        counts = dict(_stats)
+        size = len(_local)
+    total = sum(counts.values())
+    return {
+        **counts,
+        'local_size': size,
+        'local_hit_rate': counts['local_hit'] / total if total else 0.0,
+        'shared_hit_rate': counts['shared_hit'] / total if total else 0.0,
+    }
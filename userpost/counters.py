@@ -0,0 +1,172 @@
+"""
+登録数（good_count / goot_count）の更新
+
+Python 側で読んで足して save() すると同時更新で値が失われるため、
+加減算は F() を使った1本の UPDATE で行い、同じトランザクション内で新しい値を読み直す。
+UPDATE した行はトランザクション終了までロックされるので、読み直した値は自分の更新結果になる。
+
+COUNTER_WRITE_BEHIND を有効にすると、BUFFERED の列への加減算は CounterDelta に追記するだけにして
+人気作品の行ロック待ちを避ける。追記分は flush() が本体の行にまとめて反映し、
+それまでの間は読み取り時に未反映分を足して正確な値を返す。
+"""
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import ContentData, CounterDelta
+
+# 追記方式に対応している列（'{app_label.Model}.{field}'）
+BUFFERED = {'userpost.ContentData.good_count', 'userlists.UserList.goot_count'}
+FLUSH_BATCH_SIZE = 1000
+
+
+def _target(model, field):
+    return f'{model._meta.label}.{field}'
+
+
+def is_buffered(model, field):
+    return settings.COUNTER_WRITE_BEHIND and _target(model, field) in BUFFERED
+
+
+def pending(model, pk, field):
+    """未反映の増減の合計"""
+    total = CounterDelta.objects.filter(target=_target(model, field), object_id=pk).aggregate(n=Sum('delta'))['n']
+    return total or 0
+
+
+def adjust(model, pk, field, delta):
+    """
+    model の pk 行の field に delta を加える（0未満にはしない）
+    Returns:
+        更新後の値（未反映の増減を含む）。行が存在しなければ None
+    """
+    if is_buffered(model, field):
+        # 行ロックを取らずに追記し、本体の値と未反映分を1クエリで読む
+        CounterDelta.objects.create(target=_target(model, field), object_id=pk, delta=delta)
+        row = with_pending(model.objects.filter(pk=pk), field).values_list(field, f'pending_{field}').first()
+        if row is None:
+            return None
+        return max(0, row[0] + row[1])
+    with transaction.atomic():
+        updated = model.objects.filter(pk=pk).update(**{field: Greatest(F(field) + delta, Value(0))})
+        if not updated:
+            return None
+        return model.objects.filter(pk=pk).values_list(field, flat=True).get()
+
+
+def adjust_many(model, pks, field, delta):
+    """複数行の field に同じ delta を加える（新しい値は返さない）"""
+    pks = list(pks)
+    if not pks:
+        return
+    if is_buffered(model, field):
+        CounterDelta.objects.bulk_create([
+            CounterDelta(target=_target(model, field), object_id=pk, delta=delta) for pk in pks
+        ])
+        return
+    model.objects.filter(pk__in=pks).update(**{field: Greatest(F(field) + delta, Value(0))})
+
+
+def adjust_each(model, deltas, field):
+    """
+    行ごとに異なる増減 {pk: delta} を反映する（新しい値は返さない）
+    同じ delta の行は1本の UPDATE にまとめるので、文の数は delta の種類数になる
+    """
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        adjust_many(model, pks, field, delta)
+
+
+def adjust_good_count(content_id, delta):
+    """
+    作品の登録数に delta を加える。減らした結果 0 になった作品は削除する
+    （追記方式では削除は flush() で行う）
+    Returns:
+        更新後の登録数（削除した場合は 0、作品が存在しなければ None）
+    """
+    with transaction.atomic():
+        count = adjust(ContentData, content_id, 'good_count', delta)
+        if count == 0 and delta < 0 and not is_buffered(ContentData, 'good_count'):
+            # 条件付きで削除するので、直前に他の登録で増えていれば消さない
+            ContentData.objects.filter(pk=content_id, good_count__lte=0).delete()
+        return count
+
+
+def with_pending(queryset, field):
+    """追記方式のとき、未反映の増減を pending_{field} として注釈する（一覧の N+1 を避ける）"""
+    if not is_buffered(queryset.model, field):
+        return queryset
+    deltas = (
+        CounterDelta.objects.filter(target=_target(queryset.model, field), object_id=OuterRef('pk'))
+        .order_by().values('object_id').annotate(n=Sum('delta')).values('n')
+    )
+    return queryset.annotate(**{
+        f'pending_{field}': Coalesce(Subquery(deltas, output_field=IntegerField()), Value(0)),
+    })
+
+
+def attach_pending(objs, field):
+    """取得済みの行に未反映の増減を1クエリでまとめて付ける（with_pending を使えない場合用）"""
+    objs = [obj for obj in objs if obj is not None]
+    if not objs or not is_buffered(type(objs[0]), field):
+        return
+    totals = dict(
+        CounterDelta.objects.filter(target=_target(type(objs[0]), field), object_id__in={obj.pk for obj in objs})
+        .values('object_id').annotate(n=Sum('delta')).values_list('object_id', 'n')
+    )
+    for obj in objs:
+        setattr(obj, f'pending_{field}', totals.get(obj.pk, 0))
+
+
+def effective(obj, field):
+    """表示用の値（本体の値 + 未反映の増減）"""
+    value = getattr(obj, field)
+    if not is_buffered(type(obj), field):
+        return value
+    extra = getattr(obj, f'pending_{field}', None)
+    if extra is None:
+        extra = pending(type(obj), obj.pk, field)
+    return max(0, value + extra)
+
+
+def flush(batch_size=FLUSH_BATCH_SIZE):
+    """
+    未反映の増減を古い順に batch_size 件ずつ本体の行へ反映する
+    読んだ行だけを id 指定で消すので、反映中に追記された分は次回に回る
+    Returns:
+        反映した CounterDelta の件数
+    """
+    flushed = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                CounterDelta.objects.order_by('id').values_list('id', 'target', 'object_id', 'delta')[:batch_size]
+            )
+            if not rows:
+                return flushed
+            totals = defaultdict(int)
+            for _, target, object_id, delta in rows:
+                totals[(target, object_id)] += delta
+            for (target, object_id), total in totals.items():
+                if total:
+                    label, field = target.rsplit('.', 1)
+                    apps.get_model(label).objects.filter(pk=object_id).update(
+                        **{field: Greatest(F(field) + total, Value(0))}
+                    )
+            CounterDelta.objects.filter(id__in=[r[0] for r in rows]).delete()
+            # 登録数が 0 になった作品は、まだ反映待ちの増減がなければ削除する
+            emptied = [
+                object_id for (target, object_id), total in totals.items()
+                if target == _target(ContentData, 'good_count') and total < 0
+            ]
+            ContentData.objects.filter(pk__in=emptied, good_count__lte=0).exclude(
+                pk__in=CounterDelta.objects.filter(target=_target(ContentData, 'good_count')).values('object_id')
+            ).delete()
+            flushed += len(rows)
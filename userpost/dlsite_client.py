@@ -0,0 +1,273 @@
+"""
+dlsite 向けのHTTPクライアント
+
+- ワーカープロセスごとに1つの requests.Session を使い回し、接続（TCP+TLS）を再利用する
+- 本文を途中まで読んだレスポンス（OGP の </head> 打ち切り）も残りを上限まで読み捨て、接続をプールに戻す
+- 5xx と接続エラーはジッター付きの指数バックオフで数回まで再試行する（読み取りタイムアウトは再試行しない）
+- ホストごとの同時リクエスト数を制限する
+- 失敗が続いたらサーキットブレーカーを開き、クールダウンの間は即座に失敗させる
+- DLSITE_ORIGIN_OVERRIDE があれば dlsite 宛てのリクエストをその origin に向ける（リプレイサーバー用）
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse, urlunparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+from .work_url import WORK_HOSTS
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """サーキットブレーカーが開いているため送信しなかった"""
+
+
+class ConcurrencyLimitError(requests.exceptions.RequestException):
+    """ホストごとの同時リクエスト数の上限に達し、待ち時間内に空かなかった"""
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, cooldown=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.cooldown:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """リクエストを送ってよいか。半開状態では試行リクエストを1件だけ通す"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if self._clock() - self._opened_at < self.cooldown:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+    def stats(self) -> dict:
+        state = self.state
+        with self._lock:
+            return {'state': state, 'consecutive_failures': self._failures}
+
+
+class DlsiteClient:
+    USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+
+    def __init__(self, *, pool_size=10, max_retries=2, backoff=0.3, max_concurrency=8, timeout=5.0,
+                 breaker=None, origin_override='', drain_max_bytes=8 * 1024):
+        self.pool_size = pool_size
+        self.drain_max_bytes = drain_max_bytes
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.origin_override = urlparse(origin_override) if origin_override else None
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = self.USER_AGENT
+        # 再試行は自前で行うので urllib3 側の再試行は無効にする
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._in_flight = 0
+        self._counters = {'requests': 0, 'retries': 0, 'failures': 0, 'short_circuited': 0, 'throttled': 0}
+
+    def _slots(self, host):
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_concurrency)
+            return self._host_slots[host]
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._counters[key] += delta
+
+    def _resolve(self, url):
+        if self.origin_override is None:
+            return url
+        parsed = urlparse(url)
+        if parsed.netloc.lower() not in WORK_HOSTS:
+            return url
+        return urlunparse(parsed._replace(scheme=self.origin_override.scheme, netloc=self.origin_override.netloc))
+
+    def _sleep_before_retry(self, attempt):
+        # full jitter: 0〜backoff*2^attempt の一様乱数
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    @contextmanager
+    def get(self, url, headers=None, stream=False):
+        """
+        GETリクエストを送る（with 文で使い、抜けるとレスポンスを閉じる）
+        with 文の中で本文を読み切らなくても、残りが drain_max_bytes 以下なら読み捨てて接続をプールに返す
+        （例外で抜けた場合と、残りが上限を超える場合は接続を切る）
+        Raises:
+            CircuitOpenError, ConcurrencyLimitError, requests.exceptions.RequestException
+        """
+        url = self._resolve(url)
+        slots = self._slots(urlparse(url).netloc)
+        if not slots.acquire(timeout=self.timeout):
+            self._count('throttled')
+            raise ConcurrencyLimitError(f'too many concurrent requests: {url}')
+        response = None
+        try:
+            if not self.breaker.allow():
+                self._count('short_circuited')
+                raise CircuitOpenError(f'circuit open: {url}')
+            self._count('requests')
+            with self._lock:
+                self._in_flight += 1
+            try:
+                response = self._send(url, headers, stream)
+                try:
+                    yield response
+                except requests.exceptions.HTTPError:
+                    raise
+                except requests.exceptions.RequestException:
+                    # 本文の読み込み中の切断・タイムアウト
+                    self.breaker.record_failure()
+                    raise
+                self._drain(response)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+        finally:
+            if response is not None:
+                response.close()
+            slots.release()
+
+    def _drain(self, response):
+        """
+        読み残した本文を drain_max_bytes まで読み捨てる
+        urllib3 は本文を最後まで読んだ接続だけをプールに戻し、読み残しのある接続は close() で切断する
+        """
+        remaining = self.drain_max_bytes
+        try:
+            while remaining >= 0:
+                # 上限を1バイト超えて読めたら打ち切る（上限より大きく読み進めない）
+                chunk = response.raw.read(min(remaining + 1, 64 * 1024), decode_content=False)
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+        except (Urllib3Error, OSError):
+            # 読み捨てに失敗した接続は close() で切断される
+            pass
+
+    def _send(self, url, headers, stream):
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout, stream=stream)
+            except requests.exceptions.ReadTimeout:
+                self._count('failures')
+                self.breaker.record_failure()
+                raise
+            except requests.exceptions.ConnectionError:
+                self._count('failures')
+                if last:
+                    self.breaker.record_failure()
+                    raise
+            except requests.exceptions.RequestException:
+                # リダイレクトの上限・不正なURLなど。再試行はしないが、半開状態の試行を終わらせるため失敗として記録する
+                self._count('failures')
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                self._count('failures')
+                if last:
+                    self.breaker.record_failure()
+                    return response
+                response.close()
+            self._count('retries')
+            self._sleep_before_retry(attempt)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._counters)
+            data['in_flight'] = self._in_flight
+        data['pool_maxsize'] = self.pool_size
+        data['max_concurrency_per_host'] = self.max_concurrency
+        data['breaker'] = self.breaker.stats()
+        return data
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> DlsiteClient:
+    """このワーカープロセス用のクライアント（初回呼び出し時に settings から生成）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = DlsiteClient(
+                    pool_size=settings.DLSITE_HTTP_POOL_SIZE,
+                    max_retries=settings.DLSITE_HTTP_MAX_RETRIES,
+                    backoff=settings.DLSITE_HTTP_BACKOFF,
+                    max_concurrency=settings.DLSITE_HTTP_MAX_CONCURRENCY,
+                    timeout=settings.DLSITE_HTTP_TIMEOUT,
+                    breaker=CircuitBreaker(
+                        failure_threshold=settings.DLSITE_BREAKER_THRESHOLD,
+                        cooldown=settings.DLSITE_BREAKER_COOLDOWN,
+                    ),
+                    origin_override=settings.DLSITE_ORIGIN_OVERRIDE,
+                    drain_max_bytes=settings.DLSITE_HTTP_DRAIN_MAX_BYTES,
+                )
+    return _client
+
+
+def reset_client():
+    """クライアントを破棄する（fork 後の子プロセスやテストで使用）"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.session.close()
+        _client = None
+
+
+if hasattr(os, 'register_at_fork'):
+    # gunicorn --preload などで fork された場合も、接続やロックを親と共有しない
+    os.register_at_fork(after_in_child=lambda: globals().update(_client=None, _client_lock=threading.Lock()))
@@ -0,0 +1,138 @@
+"""
+dlsite 作品ページのリプレイサーバー（オフラインのテスト・ベンチマーク用）
+
+保存済みのページ（userpost/testdata/dlsite/{作品ID}.html）を、指定した遅延・ゆらぎ・
+エラー率で返すローカルHTTPサーバー。DLSITE_ORIGIN_OVERRIDE にこのサーバーの origin を
+設定すると、dlsite クライアントの www.dlsite.com 宛てのリクエストがここに向く。
+"""
+import hashlib
+import random
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from .work_url import PRODUCT_ID_RE
+
+DEFAULT_PAGES_DIR = Path(__file__).resolve().parent / 'testdata' / 'dlsite'
+
+
+class _Page:
+    def __init__(self, path: Path):
+        self.body = path.read_bytes()
+        self.etag = '"%s"' % hashlib.sha1(self.body).hexdigest()[:16]
+        self.last_modified = formatdate(path.stat().st_mtime, usegmt=True)
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        replay = self.server.replay
+        status_code, page = replay.pick(self.path)
+        replay.wait()
+        if status_code == 200 and page.etag == self.headers.get('If-None-Match'):
+            status_code = 304
+        self.send_response(status_code)
+        body = page.body if status_code == 200 and page is not None else b''
+        if page is not None:
+            self.send_header('ETag', page.etag)
+            self.send_header('Last-Modified', page.last_modified)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ReplayHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # クライアントは <head> を読んだ時点で接続を閉じるので、切断は正常系として扱う
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class ReplayServer:
+    """
+    保存済みページを返すdlsiteの代役
+    Args:
+        pages_dir: {作品ID}.html を置いたディレクトリ
+        latency: 応答までの遅延（秒）
+        jitter: 遅延に加える 0〜jitter 秒の一様乱数
+        error_rate: 503 を返す確率（0〜1）
+        fallback: 保存されていない作品IDにも保存済みページのどれかを返す（ベンチマーク用）。False なら 404
+        seed: 乱数のシード（再現性が必要な場合）
+    """
+
+    def __init__(self, pages_dir=DEFAULT_PAGES_DIR, *, latency=0.0, jitter=0.0, error_rate=0.0,
+                 fallback=False, host='127.0.0.1', port=0, seed=None):
+        self.pages = {p.stem.upper(): _Page(p) for p in sorted(Path(pages_dir).glob('*.html'))}
+        if not self.pages:
+            raise ValueError(f'no pages in {pages_dir}')
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fallback = fallback
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {'requests': 0, 'errors': 0, 'not_found': 0}
+        self.httpd = _ReplayHTTPServer((host, port), _ReplayHandler)
+        self.httpd.replay = self
+        self._thread = None
+
+    @property
+    def origin(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def pick(self, path):
+        """リクエストパスから (ステータス, ページ) を決める"""
+        match = PRODUCT_ID_RE.search(path)
+        product_id = match.group(1).upper() if match else None
+        with self._lock:
+            self.counts['requests'] += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.counts['errors'] += 1
+                return 503, None
+            page = self.pages.get(product_id)
+            if page is None and product_id and self.fallback:
+                keys = sorted(self.pages)
+                page = self.pages[keys[int(product_id[2:]) % len(keys)]]
+            if page is None:
+                self.counts['not_found'] += 1
+                return 404, None
+        return 200, page
+
+    def wait(self):
+        if not (self.latency or self.jitter):
+            return
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        time.sleep(delay)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread = None
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,105 @@
+"""
+DBベースのジョブキュー
+
+ジョブの取得は「候補を選んで status/locked_until を条件に UPDATE する」方式で行うため、
+SQLite/PostgreSQL のどちらでも複数ワーカーから安全に取り出せる。
+ロック期限（locked_until）を過ぎた実行中ジョブはワーカー停止とみなして再取得する。
+"""
+import traceback
+from datetime import timedelta
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+MAX_ATTEMPTS = 3
+LOCK_SECONDS = 60
+RETRY_DELAY_SECONDS = 30
+
+_handlers = {}
+_failure_handlers = {}
+
+
+def handler(kind: str, on_failure=None):
+    """
+    ジョブ種別に対応する処理関数を登録するデコレータ。関数は payload をキーワード引数で受け取る
+    例外を送出すると再試行される
+    Args:
+        on_failure: 再試行を使い切って失敗にしたときに payload を渡して呼ぶ関数
+    """
+    def register(func):
+        _handlers[kind] = func
+        if on_failure is not None:
+            _failure_handlers[kind] = on_failure
+        return func
+    return register
+
+
+def enqueue(kind: str, **payload) -> Job:
+    """ジョブを登録する。呼び出し元のトランザクションがコミットされた時点で実行対象になる"""
+    return Job.objects.create(kind=kind, payload=payload)
+
+
+def _runnable(now):
+    return Job.objects.filter(
+        Q(status=Job.STATUS_QUEUED, run_after__lte=now)
+        | Q(status=Job.STATUS_RUNNING, locked_until__lt=now)
+    )
+
+
+def claim_next(lock_seconds: int = LOCK_SECONDS):
+    """実行可能なジョブを1件確保して返す。なければ None"""
+    now = timezone.now()
+    candidates = _runnable(now).order_by('run_after', 'id').values('id', 'status', 'locked_until')[:10]
+    for c in candidates:
+        claimed = Job.objects.filter(id=c['id'], status=c['status'], locked_until=c['locked_until']).update(
+            status=Job.STATUS_RUNNING,
+            locked_until=now + timedelta(seconds=lock_seconds),
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return Job.objects.get(id=c['id'])
+    return None
+
+
+def run_job(job: Job):
+    """ジョブを実行し、結果に応じて完了・再試行・失敗に遷移させる"""
+    func = _handlers.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f'未登録のジョブ種別です: {job.kind}')
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc(limit=5)
+        if func is not None and job.attempts < MAX_ATTEMPTS:
+            Job.objects.filter(id=job.id).update(
+                status=Job.STATUS_QUEUED,
+                run_after=timezone.now() + timedelta(seconds=RETRY_DELAY_SECONDS * job.attempts),
+                locked_until=None,
+                last_error=error,
+                updated_at=timezone.now(),
+            )
+        else:
+            Job.objects.filter(id=job.id).update(
+                status=Job.STATUS_FAILED, locked_until=None, last_error=error, updated_at=timezone.now(),
+            )
+            on_failure = _failure_handlers.get(job.kind)
+            if on_failure is not None:
+                on_failure(**job.payload)
+        return False
+    Job.objects.filter(id=job.id).update(status=Job.STATUS_DONE, locked_until=None, updated_at=timezone.now())
+    return True
+
+
+def run_pending(limit: int = 100) -> int:
+    """実行可能なジョブを最大 limit 件処理し、処理件数を返す"""
+    processed = 0
+    while processed < limit:
+        job = claim_next()
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from userpost import counters
+from userpost.models import ContentData, CounterDelta
+
+from .bench_ogp_pipeline import percentile, run_workers
+
+HOT_PRODUCT_ID = 'RJ99999999'
+
+
+class Command(BaseCommand):
+    help = '1つの作品に登録が集中したときの登録数更新のスループットを、追記方式（write-behind）の有無で比較する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='加算の回数')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--mode', choices=['off', 'on', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests と --concurrency は1以上を指定してください')
+        if ContentData.objects.filter(product_id=HOT_PRODUCT_ID).exists():
+            raise CommandError(f'{HOT_PRODUCT_ID} の作品が既に存在します')
+        modes = ['off', 'on'] if options['mode'] == 'both' else [options['mode']]
+        self.stdout.write(f"{'write-behind':<14}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'failed':>8}{'final':>8}")
+        for mode in modes:
+            self.run(mode, options['requests'], options['concurrency'])
+
+    def run(self, mode, requests, concurrency):
+        content = ContentData.objects.create(
+            content_url=f'https://www.dlsite.com/maniax/work/=/product_id/{HOT_PRODUCT_ID}.html',
+            title='bench',
+        )
+        target = f'{ContentData._meta.label}.good_count'
+        try:
+            with override_settings(COUNTER_WRITE_BEHIND=(mode == 'on')):
+                def operation(state, _):
+                    return counters.adjust_good_count(content.id, 1) is not None
+
+                started = time.perf_counter()
+                results = run_workers(operation, range(requests), concurrency)
+                wall = time.perf_counter() - started
+                # 反映後の値が加算回数と一致することを確認する
+                counters.flush()
+            content.refresh_from_db()
+            latencies = sorted(elapsed * 1000 for _, elapsed in results)
+            failed = sum(1 for ok, _ in results if not ok)
+            self.stdout.write(
+                f'{mode:<14}{len(results) / wall:>10.1f}{percentile(latencies, 50):>10.2f}'
+                f'{percentile(latencies, 99):>10.2f}{latencies[-1]:>10.2f}{failed:>8}{content.good_count:>8}'
+            )
+        finally:
+            CounterDelta.objects.filter(target=target, object_id=content.id).delete()
+            ContentData.objects.filter(pk=content.pk).delete()
@@ -0,0 +1,64 @@
+import time
+import tracemalloc
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand, CommandError
+
+from userpost.ogp_parser import DEFAULT_MAX_BYTES, OGP_PROPERTIES, extract_ogp, iter_bytes
+
+DEFAULT_PAGES_DIR = Path(__file__).resolve().parents[2] / 'testdata' / 'dlsite'
+
+
+def parse_with_soup(data: bytes):
+    """従来の方式（ページ全体をデコードして BeautifulSoup で解析）"""
+    soup = BeautifulSoup(data.decode('utf-8', errors='replace'), 'html.parser')
+    values = {}
+    for tag in soup.find_all('meta'):
+        if tag.get('property') in OGP_PROPERTIES:
+            values[tag.get('property').replace('og:', '')] = tag.get('content', '')
+    return values, len(data)
+
+
+def parse_streaming(data: bytes):
+    return extract_ogp(iter_bytes(data), encoding='utf-8', max_bytes=DEFAULT_MAX_BYTES)
+
+
+def measure(func, data: bytes, iterations: int):
+    values, bytes_read = func(data)
+    start = time.process_time()
+    for _ in range(iterations):
+        func(data)
+    cpu_ms = (time.process_time() - start) * 1000 / iterations
+    tracemalloc.start()
+    func(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return values, bytes_read, cpu_ms, peak
+
+
+class Command(BaseCommand):
+    help = '保存済みのdlsiteページで BeautifulSoup 解析とストリーミング抽出を比較する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='HTMLファイルまたはディレクトリ（省略時は userpost/testdata/dlsite）')
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        files = []
+        for p in (options['paths'] or [DEFAULT_PAGES_DIR]):
+            p = Path(p)
+            files.extend(sorted(p.glob('*.html')) if p.is_dir() else [p])
+        if not files:
+            raise CommandError('HTMLファイルが見つかりません')
+
+        self.stdout.write(f"{'page':<24}{'method':<10}{'bytes':>10}{'cpu ms':>10}{'peak KiB':>10}")
+        for path in files:
+            data = path.read_bytes()
+            results = {}
+            for name, func in (('soup', parse_with_soup), ('stream', parse_streaming)):
+                values, bytes_read, cpu_ms, peak = measure(func, data, options['iterations'])
+                results[name] = values
+                self.stdout.write(f'{path.name:<24}{name:<10}{bytes_read:>10}{cpu_ms:>10.2f}{peak / 1024:>10.1f}')
+            if results['soup'] != results['stream']:
+                self.stderr.write(f'{path.name}: 抽出結果が一致しません {results}')
@@ -0,0 +1,150 @@
+import math
+import random
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from accounts.utils import sign_guest_id
+from userpost import dlsite_client, ogp_cache
+from userpost.dlsite_replay import ReplayServer
+from userpost.models import ContentData, OgpCache
+from userpost.utils import dlsite_get_ogp_data
+
+
+def percentile(sorted_values, q):
+    """最近傍順位法によるパーセンタイル（sorted_values は昇順）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_workers(operation, items, concurrency):
+    """
+    items を concurrency 個のスレッドで operation に渡し、1件ごとの (成功したか, 秒数) を返す
+    operation(worker_state, item) は成功なら True を返す。worker_state はスレッドごとの dict
+    """
+    results = []
+    lock = threading.Lock()
+    pending = iter(items)
+
+    def worker():
+        state = {}
+        try:
+            while True:
+                with lock:
+                    item = next(pending, None)
+                if item is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    ok = operation(state, item)
+                except Exception:
+                    ok = False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    results.append((ok, elapsed))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+class Command(BaseCommand):
+    help = 'リプレイサーバーを相手にOGP取得（fetch）または投稿作成API（create）を並列に実行し、スループットとレイテンシを測る'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['fetch', 'create'], default='fetch',
+                            help='fetch: dlsite_get_ogp_data / create: POST /api/posts/')
+        parser.add_argument('--requests', type=int, default=200, help='実行する件数（作品はすべて未登録のIDを使う）')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--origin', default='', help='起動済みのリプレイサーバー（省略時はこのプロセス内で起動）')
+        parser.add_argument('--latency', type=float, default=0.05, help='内蔵リプレイサーバーの遅延（秒）')
+        parser.add_argument('--jitter', type=float, default=0.05)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--keep', action='store_true', help='作成したデータを削除しない')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests と --concurrency は1以上を指定してください')
+        server = None
+        origin = options['origin']
+        if not origin:
+            server = ReplayServer(
+                latency=options['latency'],
+                jitter=options['jitter'],
+                error_rate=options['error_rate'],
+                fallback=True,
+                seed=options['seed'],
+            ).start()
+            origin = server.origin
+
+        # 実データと衝突しにくい作品ID（RJ9 + 実行ごとの2桁 + 連番）
+        run = random.randint(10, 99)
+        product_ids = [f'RJ9{run}{i:05d}' for i in range(options['requests'])]
+        existing = set(ContentData.objects.filter(product_id__in=product_ids).values_list('product_id', flat=True))
+        product_ids = [pid for pid in product_ids if pid not in existing]
+        urls = [f'https://www.dlsite.com/maniax/work/=/product_id/{pid}.html' for pid in product_ids]
+        guest_ids = []
+
+        if options['mode'] == 'fetch':
+            def operation(state, url):
+                return dlsite_get_ogp_data(url) is not None
+        else:
+            path = reverse('userpost-list')
+
+            def operation(state, url):
+                if 'client' not in state:
+                    state['client'] = Client(SERVER_NAME='localhost')
+                    guest_id = str(uuid.uuid4())
+                    state['client'].cookies['guest_id'] = sign_guest_id(guest_id)
+                    guest_ids.append(guest_id)
+                response = state['client'].post(path, {'content_url': url}, content_type='application/json')
+                return response.status_code in (201, 202)
+
+        try:
+            with override_settings(DLSITE_ORIGIN_OVERRIDE=origin):
+                dlsite_client.reset_client()
+                started = time.perf_counter()
+                results = run_workers(operation, urls, options['concurrency'])
+                wall = time.perf_counter() - started
+                client_stats = dlsite_client.get_client().stats()
+        finally:
+            dlsite_client.reset_client()
+            if server is not None:
+                server.stop()
+            if not options['keep']:
+                self.cleanup(product_ids, urls, guest_ids)
+
+        latencies = sorted(elapsed * 1000 for _, elapsed in results)
+        ok = sum(1 for success, _ in results if success)
+        self.stdout.write(f"mode: {options['mode']}  concurrency: {options['concurrency']}  origin: {origin}")
+        self.stdout.write(f'requests: {len(results)}  ok: {ok}  failed: {len(results) - ok}  wall: {wall:.2f}s')
+        self.stdout.write(f'throughput: {len(results) / wall:.1f} req/s')
+        self.stdout.write(
+            'latency ms: p50={:.1f} p90={:.1f} p99={:.1f} max={:.1f}'.format(
+                percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99),
+                latencies[-1] if latencies else 0.0,
+            )
+        )
+        self.stdout.write(f'upstream: {client_stats}')
+        if server is not None:
+            self.stdout.write(f'replay: {server.counts}')
+
+    def cleanup(self, product_ids, urls, guest_ids):
+        User.objects.filter(guest_id__in=guest_ids).delete()
+        ContentData.objects.filter(product_id__in=product_ids).delete()
+        # 保存時と同じキーで消す
+        OgpCache.objects.filter(url__in={ogp_cache.cache_key(url) for url in urls}).delete()
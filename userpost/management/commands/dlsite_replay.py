@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from userpost.dlsite_replay import DEFAULT_PAGES_DIR, ReplayServer
+
+
+class Command(BaseCommand):
+    help = '保存済みのdlsiteページを返すリプレイサーバーを起動する（DLSITE_ORIGIN_OVERRIDE に表示される origin を設定して使う）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--pages', default=str(DEFAULT_PAGES_DIR), help='{作品ID}.html を置いたディレクトリ')
+        parser.add_argument('--latency', type=float, default=0.0, help='応答までの遅延（秒）')
+        parser.add_argument('--jitter', type=float, default=0.0, help='遅延に加える最大の揺らぎ（秒）')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='503 を返す確率（0〜1）')
+        parser.add_argument('--fallback', action='store_true', help='保存されていない作品IDにも保存済みページを返す')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        server = ReplayServer(
+            options['pages'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            fallback=options['fallback'],
+            host=options['host'],
+            port=options['port'],
+            seed=options['seed'],
+        )
+        self.stdout.write(f'serving {len(server.pages)} pages at {server.origin}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+            self.stdout.write(f'requests: {server.counts}')
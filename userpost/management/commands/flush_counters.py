@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from userpost import counters
+
+
+class Command(BaseCommand):
+    help = 'CounterDelta に溜まった登録数の増減を本体の行に反映する（COUNTER_WRITE_BEHIND 用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='溜まっている分を反映したら終了する')
+        parser.add_argument('--interval', type=float, default=2.0, help='反映の間隔（秒）')
+        parser.add_argument('--batch', type=int, default=counters.FLUSH_BATCH_SIZE, help='1トランザクションで反映する件数')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            flushed = counters.flush(batch_size=options['batch'])
+            if flushed:
+                self.stdout.write(f'flushed: {flushed}')
+            if options['once']:
+                break
+            time.sleep(options['interval'])
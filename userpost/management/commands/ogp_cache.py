@@ -0,0 +1,18 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from userpost import ogp_cache
+
+
+class Command(BaseCommand):
+    help = 'OGPキャッシュの統計を表示する（--purge で期限切れエントリを削除）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--purge', action='store_true', help='期限切れのエントリを削除する')
+
+    def handle(self, *args, **options):
+        if options['purge']:
+            deleted = ogp_cache.purge_expired()
+            self.stdout.write(f'purged: {deleted}')
+        self.stdout.write(json.dumps(ogp_cache.stats()['total'], ensure_ascii=False))
@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from userlists.models import GootList, UserList
+from userpost.models import Good, UserPost
+from userpost.services import delete_guests, guest_rows
+
+
+def inactive_guests(cutoff):
+    """cutoff 以降にログイン・投稿・登録・リスト更新・お気に入りのどれもしていないゲストユーザー"""
+    recent = [
+        (UserPost, 'user', 'created_at'),
+        (Good, 'user', 'created_at'),
+        (UserList, 'owner', 'updated_at'),
+        (GootList, 'user', 'created_at'),
+    ]
+    qs = get_user_model().objects.filter(
+        guest_id__isnull=False, is_staff=False, is_superuser=False, updated_at__lt=cutoff,
+    ).exclude(last_login__gte=cutoff)
+    for model, fk, field in recent:
+        qs = qs.exclude(Exists(model.objects.filter(**{fk: OuterRef('pk'), f'{field}__gte': cutoff})))
+    return qs
+
+
+class Command(BaseCommand):
+    help = '長期間操作のないゲストユーザーと、その投稿・Good・リスト・お気に入りを削除する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.GUEST_PURGE_AFTER_DAYS, help='この日数より長く操作のないゲストを削除する')
+        parser.add_argument('--chunk-size', type=int, default=100, help='1回に削除するゲストの数（投稿・Good もこの件数ずつ削除する）')
+        parser.add_argument('--sleep', type=float, default=0.0, help='チャンクの間に待つ秒数（稼働中のDBの負荷を抑える）')
+        parser.add_argument('--dry-run', action='store_true', help='削除対象の行数を表示するだけで削除しない')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        chunk_size = options['chunk_size']
+        candidates = inactive_guests(cutoff)
+        removed = {}
+        last_id = 0
+        while True:
+            ids = list(candidates.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                break
+            first_id, last_id = ids[0], ids[-1]
+            if options['dry_run']:
+                counts = {qs.model._meta.label: qs.count() for qs in guest_rows(ids).values()}
+            else:
+                # 選んでから削除するまでに操作したゲストは残す
+                ids = list(candidates.filter(pk__in=ids).values_list('pk', flat=True))
+                counts = delete_guests(ids, chunk_size=chunk_size)
+            for label, n in counts.items():
+                removed[label] = removed.get(label, 0) + n
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  guests {first_id}..{last_id}: ' + ' '.join(f'{k}={v}' for k, v in sorted(counts.items())))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        prefix = '[dry-run] ' if options['dry_run'] else ''
+        self.stdout.write(f'{prefix}guests inactive since {cutoff:%Y-%m-%d}')
+        for label, n in sorted(removed.items()):
+            self.stdout.write(f'{prefix}{label}: removed={n}')
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from userlists.models import GootList, UserList
+from userpost import counters
+from userpost.models import ContentData, Good
+
+
+def counted(model, fk):
+    """集計元 model を fk ごとに数えるサブクエリ（該当なしは 0）"""
+    subquery = (
+        model.objects.filter(**{fk: OuterRef('pk')})
+        .order_by().values(fk).annotate(n=Count('pk')).values('n')
+    )
+    return Coalesce(Subquery(subquery, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = '作品の登録数（Good）とリストのお気に入り数（GootList）を集計し直し、ずれを修正する'
+
+    targets = [
+        # (対象モデル, カウント列, 集計元モデル, 集計元の外部キー)
+        (ContentData, 'good_count', Good, 'content'),
+        (UserList, 'goot_count', GootList, 'userlist'),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='1トランザクションで処理する行数')
+        parser.add_argument('--dry-run', action='store_true', help='ずれを表示するだけで修正しない')
+
+    def handle(self, *args, **options):
+        self.verbose = options['verbosity'] > 1
+        if not options['dry_run']:
+            # 未反映の増減が残っていると、集計し直した値に二重に足されてしまう
+            flushed = counters.flush()
+            if flushed:
+                self.stdout.write(f'flushed pending deltas: {flushed}')
+        for model, field, source, fk in self.targets:
+            checked, fixed, drift, net = self.reconcile(
+                model, field, source, fk, options['chunk_size'], options['dry_run']
+            )
+            label = f'{model._meta.label}.{field}'
+            self.stdout.write(f'{label}: checked={checked} fixed={fixed} drift={drift} net={net:+d}')
+
+    def reconcile(self, model, field, source, fk, chunk_size, dry_run):
+        """
+        id順にチャンクで集計し、ずれている行だけを1本の UPDATE で直す
+        Returns:
+            (確認した行数, 修正した行数, ずれの絶対値の合計, ずれの合計)
+        """
+        checked = fixed = drift = net = 0
+        last_id = 0
+        while True:
+            ids = list(
+                model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            checked += len(ids)
+            with transaction.atomic():
+                wrong = list(
+                    model.objects.filter(pk__in=ids)
+                    .annotate(actual=counted(source, fk))
+                    .exclude(**{field: F('actual')})
+                    .values_list('pk', field, 'actual')
+                )
+                if not wrong:
+                    continue
+                for pk, current, actual in wrong:
+                    drift += abs(actual - current)
+                    net += actual - current
+                    if self.verbose:
+                        self.stdout.write(f'  {model._meta.label} id={pk}: {current} -> {actual}')
+                fixed += len(wrong)
+                if not dry_run:
+                    model.objects.filter(pk__in=[pk for pk, _, _ in wrong]).update(**{field: counted(source, fk)})
+        return checked, fixed, drift, net
@@ -0,0 +1,61 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils import timezone
+
+from userpost.dlsite_client import CircuitOpenError
+from userpost.models import ContentData
+from userpost.services import refresh_content_data
+
+
+class Command(BaseCommand):
+    help = '古くなった作品データを条件付きGETで再取得する（登録数が多く、取得が古いものから。cron で定期実行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=int, default=settings.OGP_REFRESH_MAX_AGE_DAYS,
+                            help='この日数より前に取得した作品を対象にする')
+        parser.add_argument('--rpm', type=int, default=settings.OGP_REFRESH_RPM,
+                            help='1分あたりの最大リクエスト数（0で無制限）')
+        parser.add_argument('--limit', type=int, default=None, help='今回処理する最大件数')
+
+    def stale_queryset(self, threshold):
+        return ContentData.objects.filter(
+            Q(last_fetched_at__isnull=True) | Q(last_fetched_at__lt=threshold)
+        ).order_by('-good_count', F('last_fetched_at').asc(nulls_first=True), 'id')
+
+    def handle(self, *args, **options):
+        # 基準時刻は開始時に固定する（今回更新した行を再び拾わないように）
+        threshold = timezone.now() - timedelta(days=options['max_age_days'])
+        interval = 60.0 / options['rpm'] if options['rpm'] > 0 else 0.0
+        limit = options['limit']
+        results = Counter()
+        processed = 0
+        next_at = time.monotonic()
+        # 処理した行は last_fetched_at が更新されて対象外になるので、
+        # 中断しても次回の実行は続きから始まる
+        while limit is None or processed < limit:
+            batch_size = 100 if limit is None else min(100, limit - processed)
+            batch = list(self.stale_queryset(threshold)[:batch_size])
+            if not batch:
+                break
+            for content_data in batch:
+                wait = next_at - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                next_at = time.monotonic() + interval
+                try:
+                    results[refresh_content_data(content_data)] += 1
+                except CircuitOpenError:
+                    self.stderr.write('dlsite への接続が失敗し続けているため中断します')
+                    self.stdout.write(self.summary(processed, results))
+                    return
+                processed += 1
+        self.stdout.write(self.summary(processed, results))
+
+    def summary(self, processed, results):
+        detail = ' '.join(f'{key}={count}' for key, count in sorted(results.items()))
+        return f'refreshed: {processed} {detail}'.rstrip()
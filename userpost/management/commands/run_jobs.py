@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from userpost import jobs
+
+
+class Command(BaseCommand):
+    help = 'DBジョブキューのワーカー（OGPの非同期取得など）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='実行可能なジョブを処理したら終了する')
+        parser.add_argument('--batch', type=int, default=50, help='1回のポーリングで処理する最大件数')
+        parser.add_argument('--sleep', type=float, default=1.0, help='ジョブがないときの待機秒数')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            processed = jobs.run_pending(limit=options['batch'])
+            if processed:
+                self.stdout.write(f'processed: {processed}')
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['sleep'])
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userpost', '0009_backfill_userpost_list'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OgpCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=500, unique=True)),
+                ('status', models.CharField(choices=[('ok', '取得成功'), ('invalid', '対象外のURL'), ('not_found', '作品が存在しない'), ('error', '取得エラー')], max_length=20)),
+                ('data', models.JSONField(blank=True, null=True)),
+                ('fetched_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('hit_count', models.IntegerField(default=0)),
+                ('fetch_count', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
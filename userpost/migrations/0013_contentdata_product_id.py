@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userpost', '0012_fetchlease'),
+    ]
+
+    operations = [
+        # 一意制約はバックフィルで重複を統合した後（0015）に付ける
+        migrations.AddField(
+            model_name='contentdata',
+            name='product_id',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,135 @@
+"""
+ContentData.product_id のバックフィル
+
+- ContentData/UserPost/Good の content_url を正規URLに書き換え、ContentData に作品IDを入れる
+- 同じ作品IDの ContentData は1行に統合し、good_count を合算する
+- 同じユーザーの同じ作品IDの Good は（フロアが違っても）1件に減らし、その分 good_count を減らす
+  残す Good の content_url は統合後の ContentData と同じURLにそろえる
+テーブルを長時間ロックしないよう、id順に BATCH_SIZE 件ずつ別トランザクションで処理する。
+"""
+import re
+from urllib.parse import urlparse
+
+from django.db import migrations, transaction
+from django.db.models import Count, F
+
+BATCH_SIZE = 500
+
+# 実行時点のロジックを固定するため userpost.work_url の内容を複製している
+WORK_HOSTS = {'www.dlsite.com', 'dlsite.com', 'dlaf.jp'}
+PRODUCT_ID_RE = re.compile(r'(?<![A-Za-z0-9])([RBV][JE]\d{6,8})(?![0-9])', re.IGNORECASE)
+FLOORS = {
+    'home', 'maniax', 'books', 'pro', 'soft', 'girls', 'girls-pro', 'girls-drama',
+    'bl', 'bl-pro', 'bl-drama', 'comic', 'eng', 'ecchi-eng', 'aix', 'gay',
+}
+DEFAULT_FLOORS = {'R': 'maniax', 'B': 'books', 'V': 'pro'}
+
+
+def normalize(url):
+    try:
+        parsed = urlparse((url or '').strip())
+    except ValueError:
+        return None, None
+    if parsed.netloc.lower() not in WORK_HOSTS:
+        return None, None
+    match = PRODUCT_ID_RE.search(parsed.path)
+    if not match:
+        return None, None
+    product_id = match.group(1).upper()
+    segments = [s for s in parsed.path.split('/') if s]
+    floor = segments[0].lower() if segments and segments[0].lower() in FLOORS else DEFAULT_FLOORS[product_id[0]]
+    return product_id, f'https://www.dlsite.com/{floor}/work/=/product_id/{product_id}.html'
+
+
+def batches(queryset):
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id')[:BATCH_SIZE])
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+
+def forwards(apps, schema_editor):
+    ContentData = apps.get_model('userpost', 'ContentData')
+    UserPost = apps.get_model('userpost', 'UserPost')
+    Good = apps.get_model('userpost', 'Good')
+
+    for rows in batches(ContentData.objects.filter(product_id__isnull=True)):
+        changed = []
+        for cd in rows:
+            product_id, canonical = normalize(cd.content_url)
+            if product_id:
+                cd.product_id = product_id
+                cd.content_url = canonical
+                changed.append(cd)
+        with transaction.atomic():
+            ContentData.objects.bulk_update(changed, ['product_id', 'content_url'])
+
+    duplicated = (
+        ContentData.objects.filter(product_id__isnull=False)
+        .values('product_id').annotate(n=Count('id')).filter(n__gt=1)
+        .values_list('product_id', flat=True)
+    )
+    for product_id in list(duplicated):
+        with transaction.atomic():
+            rows = list(ContentData.objects.select_for_update().filter(product_id=product_id).order_by('id'))
+            # 取得済みの行を優先して残す
+            keep = next((cd for cd in rows if cd.status == 'ready' and cd.title), rows[0])
+            keep.good_count = sum(cd.good_count for cd in rows)
+            ContentData.objects.filter(id__in=[cd.id for cd in rows if cd.id != keep.id]).delete()
+            keep.save(update_fields=['good_count'])
+
+    for rows in batches(UserPost.objects.all()):
+        changed = []
+        for p in rows:
+            _, canonical = normalize(p.content_url)
+            if canonical and canonical != p.content_url:
+                p.content_url = canonical
+                changed.append(p)
+        with transaction.atomic():
+            UserPost.objects.bulk_update(changed, ['content_url'])
+
+    # (ユーザー, 作品ID) ごとに最初の1件だけを残す
+    seen = set()
+    for rows in batches(Good.objects.all()):
+        parsed = {g.id: normalize(g.content_url) for g in rows}
+        urls = dict(
+            ContentData.objects.filter(product_id__in={pid for pid, _ in parsed.values() if pid})
+            .values_list('product_id', 'content_url')
+        )
+        with transaction.atomic():
+            for g in rows:
+                product_id, canonical = parsed[g.id]
+                if not product_id:
+                    continue
+                key = (g.user_id or g.username_legacy, product_id)
+                url = urls.get(product_id, canonical)
+                conflict = url != g.content_url and Good.objects.filter(
+                    username_legacy=g.username_legacy, content_url=url,
+                ).exclude(id=g.id).exists()
+                if key in seen or conflict:
+                    # 表記ゆれ・フロア違いで二重登録されていた分を取り除く
+                    # （書き換え先と衝突する場合は、衝突相手の方を後で残す）
+                    g.delete()
+                    ContentData.objects.filter(product_id=product_id, good_count__gt=0).update(
+                        good_count=F('good_count') - 1,
+                    )
+                    continue
+                seen.add(key)
+                if url != g.content_url:
+                    g.content_url = url
+                    g.save(update_fields=['content_url'])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('userpost', '0013_contentdata_product_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
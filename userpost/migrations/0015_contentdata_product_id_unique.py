@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userpost', '0014_backfill_product_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contentdata',
+            name='product_id',
+            field=models.CharField(blank=True, max_length=32, null=True, unique=True),
+        ),
+    ]
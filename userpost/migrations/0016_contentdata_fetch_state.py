@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userpost', '0015_contentdata_product_id_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contentdata',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='contentdata',
+            name='last_fetch_status',
+            field=models.CharField(blank=True, choices=[('ok', '取得成功'), ('not_modified', '変更なし'), ('not_found', '作品なし'), ('error', '取得失敗')], default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='contentdata',
+            name='last_fetched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='contentdata',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
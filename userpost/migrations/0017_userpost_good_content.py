@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userpost', '0016_contentdata_fetch_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='good',
+            name='content',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='goods', to='userpost.contentdata'),
+        ),
+        migrations.AddField(
+            model_name='userpost',
+            name='content',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='posts', to='userpost.contentdata'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+"""
+UserPost.content / Good.content のバックフィル
+
+content_url から作品IDを取り出し、同じ作品IDの ContentData を参照させる。
+テーブルを長時間ロックしないよう、id順に BATCH_SIZE 件ずつ別トランザクションで処理する。
+"""
+import re
+from urllib.parse import urlparse
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 500
+
+# 実行時点のロジックを固定するため userpost.work_url の内容を複製している
+WORK_HOSTS = {'www.dlsite.com', 'dlsite.com', 'dlaf.jp'}
+PRODUCT_ID_RE = re.compile(r'(?<![A-Za-z0-9])([RBV][JE]\d{6,8})(?![0-9])', re.IGNORECASE)
+
+
+def extract_product_id(url):
+    try:
+        parsed = urlparse((url or '').strip())
+    except ValueError:
+        return None
+    if parsed.netloc.lower() not in WORK_HOSTS:
+        return None
+    match = PRODUCT_ID_RE.search(parsed.path)
+    return match.group(1).upper() if match else None
+
+
+def backfill(model, ContentData):
+    last_id = 0
+    while True:
+        rows = list(
+            model.objects.filter(id__gt=last_id, content__isnull=True)
+            .exclude(content_url__isnull=True).order_by('id')[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+        last_id = rows[-1].id
+        product_ids = {row.id: extract_product_id(row.content_url) for row in rows}
+        content_ids = dict(
+            ContentData.objects.filter(product_id__in={pid for pid in product_ids.values() if pid})
+            .values_list('product_id', 'id')
+        )
+        changed = []
+        for row in rows:
+            content_id = content_ids.get(product_ids[row.id])
+            if content_id:
+                row.content_id = content_id
+                changed.append(row)
+        with transaction.atomic():
+            model.objects.bulk_update(changed, ['content'])
+
+
+def forwards(apps, schema_editor):
+    ContentData = apps.get_model('userpost', 'ContentData')
+    backfill(apps.get_model('userpost', 'UserPost'), ContentData)
+    backfill(apps.get_model('userpost', 'Good'), ContentData)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('userpost', '0017_userpost_good_content'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userlists', '0002_hot_query_indexes'),
+        ('userpost', '0018_backfill_content_fk'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='good',
+            index=models.Index(fields=['user', 'content_url'], name='good_user_url_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpost',
+            index=models.Index(fields=['user', '-created_at'], name='userpost_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpost',
+            index=models.Index(fields=['list', '-created_at'], name='userpost_list_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpost',
+            index=models.Index(fields=['user', 'content_url'], name='userpost_user_url_idx'),
+        ),
+    ]
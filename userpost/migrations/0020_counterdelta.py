@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userpost', '0019_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.CharField(max_length=50)),
+                ('object_id', models.BigIntegerField()),
+                ('delta', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['target', 'object_id'], name='counterdelta_target_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userlists', '0003_userlist_deleting'),
+        ('userpost', '0021_resourceversion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='good',
+            index=models.Index(condition=models.Q(('content__isnull', True)), fields=['content_url'], name='good_orphan_url_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpost',
+            index=models.Index(condition=models.Q(('content__isnull', True)), fields=['content_url'], name='userpost_orphan_url_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+"""
+作品が削除されたあと作り直され、参照を失ったままの UserPost / Good をつなぎ直す
+
+0018 のバックフィルをもう一度実行する（content が NULL の行だけが対象）。
+つなぎ直した Good は登録数に含まれていないので、実行後に reconcile_counters で登録数を直すこと。
+"""
+from importlib import import_module
+
+from django.db import migrations
+
+backfill = import_module('userpost.migrations.0018_backfill_content_fk').backfill
+
+
+def forwards(apps, schema_editor):
+    ContentData = apps.get_model('userpost', 'ContentData')
+    backfill(apps.get_model('userpost', 'UserPost'), ContentData)
+    backfill(apps.get_model('userpost', 'Good'), ContentData)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('userpost', '0022_orphan_url_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.conf import settings
- 
+from django.utils import timezone
+from .work_url import extract_product_id
+
 
 # Create your models here.
 class UserPost(models.Model):
@@ -8,21 +10,76 @@ class UserPost(models.Model):
     username_legacy = models.CharField(max_length=200)
     description = models.TextField(max_length=1000, blank=True, null=True)
     content_url = models.URLField()
+    # 作品への参照（content_url は移行期間中の互換用に残している）
+    content = models.ForeignKey('ContentData', on_delete=models.SET_NULL, null=True, blank=True, related_name='posts')
     created_at = models.DateTimeField(auto_now_add=True)
     good_count = models.IntegerField(default=0)
     list = models.ForeignKey('userlists.UserList', on_delete=models.SET_NULL, null=True, blank=True, related_name='userposts')
 
+    class Meta:
+        indexes = [
+            # ユーザーごと・リストごとの新着順一覧
+            models.Index(fields=['user', '-created_at'], name='userpost_user_created_idx'),
+            models.Index(fields=['list', '-created_at'], name='userpost_list_created_idx'),
+            # 投稿作成時の重複チェック
+            models.Index(fields=['user', 'content_url'], name='userpost_user_url_idx'),
+            # 作品が作り直されたときに、参照を失った投稿を探す（該当行だけの部分インデックス）
+            models.Index(fields=['content_url'], condition=models.Q(content__isnull=True), name='userpost_orphan_url_idx'),
+        ]
+
     def __str__(self):
         return self.username_legacy
 
+class ContentDataQuerySet(models.QuerySet):
+    def for_url(self, url):
+        """URLの表記ゆれに関係なく、同じ作品IDのContentDataに絞り込む"""
+        product_id = extract_product_id(url)
+        if product_id is None:
+            return self.none()
+        return self.filter(product_id=product_id)
+
+
 class ContentData(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'OGP取得待ち'),
+        (STATUS_READY, '取得済み'),
+        (STATUS_FAILED, '取得失敗'),
+    ]
+    FETCH_OK = 'ok'
+    FETCH_NOT_MODIFIED = 'not_modified'
+    FETCH_NOT_FOUND = 'not_found'
+    FETCH_ERROR = 'error'
+    FETCH_STATUS_CHOICES = [
+        (FETCH_OK, '取得成功'),
+        (FETCH_NOT_MODIFIED, '変更なし'),
+        (FETCH_NOT_FOUND, '作品なし'),
+        (FETCH_ERROR, '取得失敗'),
+    ]
+
     content_url = models.URLField()
+    product_id = models.CharField(max_length=32, unique=True, null=True, blank=True)
     title = models.CharField(max_length=200)
     image = models.URLField()
     description = models.TextField(max_length=1000)
     created_at = models.DateTimeField(auto_now_add=True)
     content_type = models.CharField(max_length=200, default='')
     good_count = models.IntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_READY)
+    # 再取得（refresh_content_data）用の情報
+    last_fetched_at = models.DateTimeField(null=True, blank=True)
+    etag = models.CharField(max_length=255, blank=True, default='')
+    last_modified = models.CharField(max_length=64, blank=True, default='')
+    last_fetch_status = models.CharField(max_length=20, choices=FETCH_STATUS_CHOICES, blank=True, default='')
+
+    objects = ContentDataQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if not self.product_id:
+            self.product_id = extract_product_id(self.content_url)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.content_url
@@ -31,10 +88,113 @@ class Good(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,null=True, blank=True)
     username_legacy = models.CharField(max_length=200)
     content_url = models.URLField(blank=True, null=True)
+    content = models.ForeignKey('ContentData', on_delete=models.SET_NULL, null=True, blank=True, related_name='goods')
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('username_legacy', 'content_url')
+        indexes = [
+            models.Index(fields=['user', 'content_url'], name='good_user_url_idx'),
+            models.Index(fields=['content_url'], condition=models.Q(content__isnull=True), name='good_orphan_url_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.username_legacy} liked {self.content_url}"
+
+class OgpCache(models.Model):
+    """dlsiteのOGP取得結果のキャッシュ（失敗結果も短期間保持する）"""
+    STATUS_OK = 'ok'
+    STATUS_INVALID = 'invalid'
+    STATUS_NOT_FOUND = 'not_found'
+    STATUS_ERROR = 'error'
+    STATUS_CHOICES = [
+        (STATUS_OK, '取得成功'),
+        (STATUS_INVALID, '対象外のURL'),
+        (STATUS_NOT_FOUND, '作品が存在しない'),
+        (STATUS_ERROR, '取得エラー'),
+    ]
+
+    url = models.CharField(max_length=500, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    data = models.JSONField(null=True, blank=True)
+    fetched_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+    hit_count = models.IntegerField(default=0)
+    fetch_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.url} ({self.status})"
+
+
+class Job(models.Model):
+    """DBをキューとして使うバックグラウンドジョブ（run_jobs コマンドが処理する）"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, '待機中'),
+        (STATUS_RUNNING, '実行中'),
+        (STATUS_DONE, '完了'),
+        (STATUS_FAILED, '失敗'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}#{self.id} ({self.status})"
+
+
+class FetchLease(models.Model):
+    """同じ作品の取得を1プロセスだけが行うためのリース（single-flight）"""
+    key = models.CharField(max_length=500, unique=True)
+    token = models.CharField(max_length=32)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.key} until {self.expires_at}"
+
+
+class CounterDelta(models.Model):
+    """
+    登録数の未反映の増減（COUNTER_WRITE_BEHIND 時のみ使用）
+    人気作品の行ロック待ちを避けるため加減算はここに追記し、flush_counters が本体の行にまとめて反映する
+    """
+    target = models.CharField(max_length=50)  # '{app_label.Model}.{field}'
+    object_id = models.BigIntegerField()
+    delta = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['target', 'object_id'], name='counterdelta_target_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.target}#{self.object_id} {self.delta:+d}"
+
+
+class ResourceVersion(models.Model):
+    """
+    キャッシュ無効化用のバージョン番号（userpost.versions から操作する）
+    ワーカーごとのキャッシュでも、DBのバージョンが変われば古いスナップショットを使わなくなる
+    """
+    name = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"{self.username_legacy} liked {self.content_url}"
\ No newline at end of file
+        return f"{self.name}@{self.version}"
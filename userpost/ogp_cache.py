@@ -0,0 +1,162 @@
+"""
+dlsite OGPデータの永続キャッシュ
+
+成功結果は OGP_CACHE_TTL、失敗結果（404・タイムアウト・対象外URL）は
+OGP_CACHE_NEGATIVE_TTL の間保持し、同じ作品への上流アクセスを抑える。
+参照を書き込みにしないよう、ヒット数はプロセス内で数えて OGP_CACHE_HIT_FLUSH_EVERY 回ごとにまとめて反映する
+（プロセス終了時に未反映の分は失われるが、統計用の値なので許容する）。
+"""
+import threading
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlparse, urlunparse
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import OgpCache
+from .work_url import extract_product_id
+
+_stats_lock = threading.Lock()
+_stats = {'hit': 0, 'negative_hit': 0, 'miss': 0, 'stale': 0}
+# DBに未反映のヒット数 {OgpCache.pk: 回数}
+_pending_hits = Counter()
+
+
+def cache_key(url: str) -> str:
+    """キャッシュキー。作品URLなら作品ID、それ以外はクエリ・フラグメント・末尾スラッシュを除いたURL"""
+    product_id = extract_product_id(url)
+    if product_id:
+        return product_id
+    parsed = urlparse((url or '').strip())
+    return urlunparse((parsed.scheme, parsed.netloc.lower(), parsed.path.rstrip('/'), '', '', ''))
+
+
+def _count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def _record_hits(pks):
+    with _stats_lock:
+        _pending_hits.update(pks)
+        due = sum(_pending_hits.values()) >= settings.OGP_CACHE_HIT_FLUSH_EVERY
+    if due:
+        flush_hits()
+
+
+def flush_hits() -> int:
+    """プロセス内で数えたヒット数を hit_count に反映し、反映した行数を返す"""
+    global _pending_hits
+    with _stats_lock:
+        pending, _pending_hits = _pending_hits, Counter()
+    by_count = {}
+    for pk, n in pending.items():
+        by_count.setdefault(n, []).append(pk)
+    # 同じ回数の行は1クエリでまとめて加算する
+    for n, pks in by_count.items():
+        OgpCache.objects.filter(pk__in=pks).update(hit_count=F('hit_count') + n)
+    return len(pending)
+
+
+def lookup(url: str):
+    """
+    キャッシュを参照する
+    Returns:
+        有効なエントリがあれば OgpCache、なければ None（期限切れは stale として数える）
+    """
+    key = cache_key(url)
+    entry = OgpCache.objects.filter(url=key).first()
+    if entry is None:
+        _count('miss')
+        return None
+    if entry.expires_at <= timezone.now():
+        _count('stale')
+        return None
+    _count('hit' if entry.status == OgpCache.STATUS_OK else 'negative_hit')
+    _record_hits([entry.pk])
+    return entry
+
+
+def lookup_many(urls) -> dict:
+    """
+    複数URLのキャッシュを1クエリで参照する
+    Returns:
+        {url: OgpCache} 有効なエントリがあるURLのみ
+    """
+    keys = {url: cache_key(url) for url in urls}
+    entries = {e.url: e for e in OgpCache.objects.filter(url__in=set(keys.values()))}
+    now = timezone.now()
+    result = {}
+    hit_ids = []
+    for url, key in keys.items():
+        entry = entries.get(key)
+        if entry is None:
+            _count('miss')
+        elif entry.expires_at <= now:
+            _count('stale')
+        else:
+            _count('hit' if entry.status == OgpCache.STATUS_OK else 'negative_hit')
+            hit_ids.append(entry.pk)
+            result[url] = entry
+    if hit_ids:
+        _record_hits(hit_ids)
+    return result
+
+
+def store(url: str, status: str, data=None):
+    """取得結果を保存する。成功以外は短いTTLで保持する"""
+    key = cache_key(url)
+    now = timezone.now()
+    ttl = settings.OGP_CACHE_TTL if status == OgpCache.STATUS_OK else settings.OGP_CACHE_NEGATIVE_TTL
+    values = {
+        'status': status,
+        'data': data,
+        'fetched_at': now,
+        'expires_at': now + timedelta(seconds=ttl),
+    }
+    updated = OgpCache.objects.filter(url=key).update(fetch_count=F('fetch_count') + 1, **values)
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            OgpCache.objects.create(url=key, fetch_count=1, **values)
+    except IntegrityError:
+        # 他のワーカーが先に作成した場合は上書きする
+        OgpCache.objects.filter(url=key).update(fetch_count=F('fetch_count') + 1, **values)
+
+
+def purge_expired() -> int:
+    """期限切れのエントリを削除し、削除件数を返す"""
+    deleted, _ = OgpCache.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+def stats() -> dict:
+    """
+    キャッシュの統計情報
+    Returns:
+        process: このワーカープロセスでの hit/negative_hit/miss/stale 回数
+        total: 全ワーカー累計のヒット数と上流取得数（DB集計。このプロセスの未反映分は先に反映する）
+    """
+    flush_hits()
+    with _stats_lock:
+        process = dict(_stats)
+    agg = OgpCache.objects.aggregate(hits=Sum('hit_count'), fetches=Sum('fetch_count'))
+    return {
+        'process': process,
+        'total': {
+            'entries': OgpCache.objects.count(),
+            'hits': agg['hits'] or 0,
+            'fetches': agg['fetches'] or 0,
+        },
+    }
+
+
+def reset_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+        _pending_hits.clear()
@@ -0,0 +1,75 @@
+"""
+<head> だけを読むストリーミングOGP抽出
+
+レスポンスをチャンク単位でデコード・パースし、</head>（または <body>）に達するか
+max_bytes を読んだ時点で打ち切る。抽出結果は BeautifulSoup で全体を解析した場合と同じ
+（同じプロパティが複数あれば後勝ち、content 属性がなければ空文字）。
+"""
+import codecs
+from html.parser import HTMLParser
+
+OGP_PROPERTIES = ('og:title', 'og:description', 'og:image')
+DEFAULT_MAX_BYTES = 256 * 1024
+CHUNK_SIZE = 16 * 1024
+
+
+class _HeadFinished(Exception):
+    pass
+
+
+class OgpHeadParser(HTMLParser):
+    """<meta property="og:*"> を拾い、<head> の終わりで _HeadFinished を送出するパーサー"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.values = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta':
+            attr_map = dict(attrs)
+            prop = attr_map.get('property')
+            if prop in OGP_PROPERTIES:
+                self.values[prop.replace('og:', '')] = attr_map.get('content') or ''
+        elif tag == 'body':
+            raise _HeadFinished()
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            raise _HeadFinished()
+
+
+def extract_ogp(chunks, encoding=None, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    バイト列のチャンクからOGPの値を抽出する
+    Args:
+        chunks: bytes のイテラブル（response.iter_content など）
+        encoding: 文字コード。None の場合は UTF-8
+        max_bytes: 読み込む最大バイト数
+    Returns:
+        (values, bytes_read)
+        values: {'title': ..., 'description': ..., 'image': ...} のうち見つかったもの
+    """
+    decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    parser = OgpHeadParser()
+    bytes_read = 0
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            chunk = chunk[:max_bytes - bytes_read]
+            bytes_read += len(chunk)
+            parser.feed(decoder.decode(chunk))
+            if bytes_read >= max_bytes:
+                break
+        else:
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+    except _HeadFinished:
+        pass
+    return parser.values, bytes_read
+
+
+def iter_bytes(data: bytes, chunk_size=CHUNK_SIZE):
+    """保存済みページなどのバイト列をチャンクに分割する（ベンチマーク・テスト用）"""
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
@@ -1,8 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import UserPost, ContentData
+from . import counters
 from userlists.models import UserList
-from accounts.utils import get_or_create_guest_user
+from accounts.utils import get_actor
 
 User = get_user_model()
 
@@ -12,13 +13,40 @@ class SimpleUserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username']
 
 
+class PostContentSerializer(serializers.ModelSerializer):
+    """投稿に埋め込む作品情報（?expand=content）"""
+    good_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ContentData
+        fields = ['id', 'title', 'image', 'content_type', 'good_count']
+
+    def get_good_count(self, obj):
+        return counters.effective(obj, 'good_count')
+
+
+def expanded(request, name):
+    """?expand=a,b に name が含まれるか"""
+    if request is None:
+        return False
+    return name in request.query_params.get('expand', '').split(',')
+
+
 class UserPostSerializer(serializers.ModelSerializer):
     user = SimpleUserSerializer(read_only=True)
     list_id = serializers.IntegerField(source='list.id', read_only=True)
+    content_id = serializers.IntegerField(read_only=True)
+    content = PostContentSerializer(read_only=True)
     class Meta:
         model = UserPost
-        fields = ['id', 'user', 'description', 'content_url', 'created_at', 'good_count', 'list_id']
+        fields = ['id', 'user', 'description', 'content_url', 'content_id', 'created_at', 'good_count', 'list_id', 'content']
         read_only_fields = ['id', 'created_at']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 作品情報は ?expand=content のときだけ返す（クエリは select_related で JOIN 済み）
+        if not expanded(self.context.get('request'), 'content'):
+            self.fields.pop('content')
     
     def validate_content_url(self, value):
         """URLの検証"""
@@ -43,15 +71,7 @@ class UserPostCreateSerializer(serializers.ModelSerializer):
         self._list_instance = None
         request = self.context.get('request')
         # 現在の操作主体ユーザーを取得（認証済み or ゲスト）
-        user = None
-        if request is not None:
-            req_user = getattr(request, 'user', None)
-            if req_user is not None and getattr(req_user, 'is_authenticated', False):
-                user = req_user
-            else:
-                guest_id = getattr(request, 'guest_id', None)
-                if guest_id:
-                    user, _ = get_or_create_guest_user(guest_id)
+        user = get_actor(request)[0] if request is not None else None
         if list_id is not None:
             try:
                 lst = UserList.objects.get(id=list_id)
@@ -63,10 +83,16 @@ class UserPostCreateSerializer(serializers.ModelSerializer):
         return attrs
 
 class ContentDataSerializer(serializers.ModelSerializer):
+    good_count = serializers.SerializerMethodField()
+
     class Meta:
         model = ContentData
-        fields = ['id', 'content_url', 'title', 'description', 'image', 'created_at', 'content_type', 'good_count']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'content_url', 'title', 'description', 'image', 'created_at', 'content_type', 'good_count', 'status']
+        read_only_fields = ['id', 'created_at', 'status']
+
+    def get_good_count(self, obj):
+        # COUNTER_WRITE_BEHIND 時は未反映の増減を足す
+        return counters.effective(obj, 'good_count')
     
     def validate_content_url(self, value):
         if not value:
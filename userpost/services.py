@@ -0,0 +1,430 @@
+"""投稿・作品データをまとめて操作する処理（ビューから呼ばれる）"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import content_cache, counters, jobs, ogp_cache, signals, singleflight, versions
+from .dlsite_client import CircuitOpenError
+from .models import UserPost, ContentData, Good, Job, OgpCache
+from userlists.models import GootList, UserList
+from .utils import (
+    OgpFetchError, OgpInvalidUrl, OgpNotFound, _cache_fields,
+    dlsite_get_ogp_data, dlsite_get_ogp_data_many, revalidate_ogp_data,
+)
+from .work_url import extract_product_id, normalize_work_url
+
+RESULT_CREATED = 'created'
+RESULT_DUPLICATE = 'duplicate'
+RESULT_INVALID = 'invalid'
+RESULT_FETCH_FAILED = 'fetch_failed'
+
+
+def same_work(content_id, content_url):
+    """
+    同じ作品の投稿・Good に絞り込む条件
+    作品への参照（content）で照合し、参照を失った（content が NULL の）行だけ content_url で照合する
+    """
+    orphan = Q(content__isnull=True, content_url=content_url)
+    return Q(content_id=content_id) | orphan if content_id else orphan
+
+
+def relink_orphans(contents):
+    """
+    作品が削除されて参照を失った投稿・Good を、作り直された作品につなぎ直す
+    URLの表記ゆれがあっても作品IDで照合し、つなぎ直した Good の分だけ登録数を増やす
+    Args:
+        contents: 作成した ContentData のリスト
+    """
+    User = get_user_model()
+    user_ids = set()
+    for content_data in contents:
+        if not content_data.product_id:
+            continue
+        for model in (UserPost, Good):
+            # 参照を失った行だけの部分インデックスで候補を絞り、作品IDで確かめる
+            candidates = model.objects.filter(content__isnull=True, content_url__icontains=content_data.product_id)
+            rows = [
+                (pk, user_id) for pk, url, user_id in candidates.values_list('pk', 'content_url', 'user_id')
+                if extract_product_id(url or '') == content_data.product_id
+            ]
+            if not rows:
+                continue
+            model.objects.filter(pk__in=[pk for pk, _ in rows]).update(content=content_data)
+            if model is Good:
+                content_data.good_count = counters.adjust(ContentData, content_data.id, 'good_count', len(rows))
+            else:
+                user_ids.update(user_id for _, user_id in rows)
+    user_ids.discard(None)
+    if user_ids:
+        # 投稿に作品のタイトル・画像が表示されるようになる
+        versions.bump_many([versions.user(user_id) for user_id in user_ids])
+        if User.objects.filter(pk__in=user_ids, private=False).exists():
+            versions.bump(versions.PUBLIC_USERS)
+
+
+def get_or_fetch_content_data(content_url, content_type='未設定'):
+    """
+    作品URLのContentDataを返す。なければOGPを取得して作成する
+    （OGP_ASYNC_CREATE 時は取得待ちのContentDataを作ってジョブを登録する）
+
+    作品は作品IDで識別するので、表記の違うURLでも同じContentDataになる。
+    同じ作品を複数のプロセスが同時に処理しても、上流への取得とContentDataの作成は
+    リースを取った1プロセスだけが行い、他はその結果を待って使う。
+    作成結果を他のプロセスから見えるようにするため、トランザクションの外で呼ぶこと。
+    Raises:
+        OgpInvalidUrl: dlsiteの作品URLではない
+        OgpFetchError: OGPの取得失敗、または他のプロセスの取得を待ちきれなかった
+    """
+    product_id, content_url = normalize_work_url(content_url)
+    if product_id is None:
+        raise OgpInvalidUrl('Invalid URL')
+
+    def existing():
+        return ContentData.objects.filter(product_id=product_id).first()
+
+    key = f'content:{product_id}'
+    content_data, token = singleflight.wait_for(
+        existing, key,
+        lease_seconds=settings.SINGLE_FLIGHT_LEASE_SECONDS,
+        wait_seconds=settings.SINGLE_FLIGHT_WAIT_SECONDS,
+    )
+    if content_data is not None:
+        return content_data
+    if token is None:
+        raise OgpFetchError(f'timed out waiting for {content_url}')
+    try:
+        if settings.OGP_ASYNC_CREATE:
+            with transaction.atomic():
+                content_data = ContentData.objects.create(
+                    content_url=content_url,
+                    product_id=product_id,
+                    content_type=content_type,
+                    status=ContentData.STATUS_PENDING,
+                )
+                jobs.enqueue('fetch_ogp', content_id=content_data.id)
+                relink_orphans([content_data])
+            return content_data
+        ogp_data = dlsite_get_ogp_data(content_url)
+        if not ogp_data:
+            raise OgpFetchError(f'failed to fetch {content_url}')
+        with transaction.atomic():
+            content_data = ContentData.objects.create(
+                content_url=content_url,
+                product_id=product_id,
+                title=ogp_data.get('title', ''),
+                description=ogp_data.get('description', ''),
+                image=ogp_data.get('image', ''),
+                content_type=content_type,
+                last_fetched_at=timezone.now(),
+                last_fetch_status=ContentData.FETCH_OK,
+            )
+            relink_orphans([content_data])
+        return content_data
+    finally:
+        singleflight.release(key, token)
+
+
+def bulk_register_posts(user, username, urls, list_instance, content_type='未設定'):
+    """
+    複数の作品URLをまとめて登録する
+    既存のContentDataは1クエリで解決し、未登録の作品のOGPは並列に取得したうえで
+    投稿・Good・登録数の更新をバルク操作で行う（OGP_ASYNC_CREATE 時は取得をジョブに回す）
+    Returns:
+        入力順の結果リスト [{'content_url': ..., 'status': created/duplicate/invalid/fetch_failed, ...}]
+    """
+    results = [{'content_url': url, 'status': None} for url in urls]
+    # 作品IDごとに1件だけ処理する
+    work_urls = {}
+    for r in results:
+        product_id, canonical_url = normalize_work_url(r['content_url']) if isinstance(r['content_url'], str) else (None, None)
+        if product_id is None:
+            r['status'] = RESULT_INVALID
+        elif product_id in work_urls:
+            r['status'] = RESULT_DUPLICATE
+        else:
+            r['product_id'] = product_id
+            work_urls[product_id] = canonical_url
+
+    # 投稿と Good の外部キーの参照先になるので、キャッシュではなく DB から読む（1クエリ）
+    contents = content_cache.get_many(work_urls, exact=True)
+    # 既存の作品は投稿・Goodと同じ content_url 表記にそろえる
+    for product_id, cd in contents.items():
+        work_urls[product_id] = cd.content_url
+    already_posted = set(
+        UserPost.objects.filter(user=user, content_url__in=work_urls.values()).values_list('content_url', flat=True)
+    )
+    candidates = [pid for pid, url in work_urls.items() if url not in already_posted]
+    missing = [pid for pid in candidates if pid not in contents]
+
+    # 通信はトランザクションの外で行う
+    failed = set()
+    ogp_results = {}
+    if not settings.OGP_ASYNC_CREATE:
+        fetched = dlsite_get_ogp_data_many([work_urls[pid] for pid in missing])
+        for pid in missing:
+            ogp_results[pid] = fetched.get(work_urls[pid])
+            if not ogp_results[pid]:
+                failed.add(pid)
+
+    with transaction.atomic():
+        new_contents = []
+        now = timezone.now()
+        for pid in missing:
+            if pid in failed:
+                continue
+            ogp_data = ogp_results.get(pid) or {}
+            new_contents.append(ContentData(
+                content_url=work_urls[pid],
+                product_id=pid,
+                title=ogp_data.get('title', '')[:200],
+                description=ogp_data.get('description', ''),
+                image=ogp_data.get('image', ''),
+                content_type=content_type,
+                status=ContentData.STATUS_PENDING if settings.OGP_ASYNC_CREATE else ContentData.STATUS_READY,
+                last_fetched_at=None if settings.OGP_ASYNC_CREATE else now,
+                last_fetch_status='' if settings.OGP_ASYNC_CREATE else ContentData.FETCH_OK,
+            ))
+        # 同時に同じ作品が登録された場合に備えて衝突は無視し、作成後に読み直す
+        ContentData.objects.bulk_create(new_contents, ignore_conflicts=True)
+        if new_contents:
+            for cd in ContentData.objects.filter(product_id__in=[cd.product_id for cd in new_contents]):
+                contents[cd.product_id] = cd
+                work_urls[cd.product_id] = cd.content_url
+            # 同時に作られた作品でも、つなぎ直しは参照を失った行だけが対象なので二重にはならない
+            relink_orphans([contents[cd.product_id] for cd in new_contents])
+        if settings.OGP_ASYNC_CREATE:
+            Job.objects.bulk_create([
+                Job(kind='fetch_ogp', payload={'content_id': contents[cd.product_id].id})
+                for cd in new_contents if contents[cd.product_id].status == ContentData.STATUS_PENDING
+            ])
+
+        to_create = [pid for pid in candidates if pid not in failed]
+        posts = UserPost.objects.bulk_create([
+            UserPost(
+                user=user,
+                username_legacy=username,
+                content_url=work_urls[pid],
+                content=contents[pid],
+                list=list_instance,
+            ) for pid in to_create
+        ])
+        post_ids = {pid: p.id for pid, p in zip(to_create, posts)}
+
+        # 既にGoodがある作品は二重に数えない
+        has_good = set(
+            Good.objects.filter(username_legacy=username, content_url__in=[work_urls[pid] for pid in to_create])
+            .values_list('content_url', flat=True)
+        )
+        good_pids = [pid for pid in to_create if work_urls[pid] not in has_good]
+        Good.objects.bulk_create([
+            Good(user=user, username_legacy=username, content_url=work_urls[pid], content=contents[pid])
+            for pid in good_pids
+        ])
+        counters.adjust_many(ContentData, [contents[pid].id for pid in good_pids], 'good_count', 1)
+        # bulk_create はシグナルを送らないので、公開ユーザー一覧などの無効化はここで行う
+        if posts:
+            versions.bump_many([versions.user(user.id), versions.userlist(list_instance.id) if list_instance else None])
+            if not user.private:
+                versions.bump(versions.PUBLIC_USERS)
+
+    for r in results:
+        if r['status'] is not None:
+            continue
+        pid = r['product_id']
+        if work_urls[pid] in already_posted:
+            r['status'] = RESULT_DUPLICATE
+        elif pid in failed:
+            r['status'] = RESULT_FETCH_FAILED
+        else:
+            r['status'] = RESULT_CREATED
+            r['post_id'] = post_ids[pid]
+            r['content_id'] = contents[pid].id
+            r['content_status'] = contents[pid].status
+    return results
+
+
+def refresh_content_data(content_data):
+    """
+    作品ページを条件付きGETで取得し直し、ContentDataを更新する
+    保存済みの ETag/Last-Modified を送り、304 なら取得日時だけを更新する。
+    成功・失敗にかかわらず last_fetched_at を更新するので、中断しても次回は続きから処理される。
+    Returns:
+        ContentData.FETCH_OK / FETCH_NOT_MODIFIED / FETCH_NOT_FOUND / FETCH_ERROR
+    Raises:
+        CircuitOpenError: 上流が落ちているため送信しなかった（呼び出し側で処理を打ち切る）
+    """
+    fields = {'last_fetched_at': timezone.now()}
+    try:
+        result = revalidate_ogp_data(
+            content_data.content_url,
+            etag=content_data.etag,
+            last_modified=content_data.last_modified,
+        )
+    except (OgpNotFound, OgpInvalidUrl):
+        # サブクラスを先に捕まえる（OgpFetchError の節に吸われないように）
+        fields['last_fetch_status'] = ContentData.FETCH_NOT_FOUND
+    except OgpFetchError as e:
+        if isinstance(e.__cause__, CircuitOpenError):
+            raise e.__cause__
+        fields['last_fetch_status'] = ContentData.FETCH_ERROR
+    else:
+        if result['not_modified']:
+            fields['last_fetch_status'] = ContentData.FETCH_NOT_MODIFIED
+        else:
+            ogp_data = result['ogp_data']
+            fields.update(
+                last_fetch_status=ContentData.FETCH_OK,
+                etag=result['etag'][:255],
+                last_modified=result['last_modified'][:64],
+                status=ContentData.STATUS_READY,
+            )
+            # 一部だけ取れた場合に既存の値を消さないよう、空の項目は更新しない
+            if ogp_data.get('title'):
+                fields['title'] = ogp_data['title'][:200]
+            if ogp_data.get('description'):
+                fields['description'] = ogp_data['description']
+            if ogp_data.get('image'):
+                fields['image'] = ogp_data['image']
+            ogp_cache.store(content_data.content_url, OgpCache.STATUS_OK, _cache_fields(ogp_data))
+    ContentData.objects.filter(pk=content_data.pk).update(**fields)
+    content_cache.invalidate(content_data.product_id)
+    if fields['last_fetch_status'] == ContentData.FETCH_OK:
+        versions.bump(versions.PUBLIC_USERS)
+    return fields['last_fetch_status']
+
+
+def delete_goods(goods):
+    """
+    Good をまとめて削除し、作品の登録数を減らす（登録数が 0 になった作品も削除する）
+    Args:
+        goods: 削除する Good のクエリセット
+    Returns:
+        削除した Good の件数
+    """
+    with transaction.atomic():
+        deltas = {}
+        unlinked = {}
+        for content_id, content_url, n in goods.values_list('content_id', 'content_url').annotate(n=Count('id')).order_by():
+            if content_id is not None:
+                deltas[content_id] = deltas.get(content_id, 0) - n
+            else:
+                product_id = extract_product_id(content_url or '')
+                if product_id:
+                    unlinked[product_id] = unlinked.get(product_id, 0) - n
+        if unlinked:
+            # content 未設定の古い Good は作品IDで作品を引く
+            for content_id, product_id in ContentData.objects.filter(product_id__in=unlinked).values_list('id', 'product_id'):
+                deltas[content_id] = deltas.get(content_id, 0) + unlinked[product_id]
+        deleted, _ = goods.delete()
+        counters.adjust_each(ContentData, deltas, 'good_count')
+        if deltas and not counters.is_buffered(ContentData, 'good_count'):
+            # 追記方式では flush() が削除する
+            ContentData.objects.filter(pk__in=deltas, good_count__lte=0).delete()
+    return deleted
+
+
+def delete_posts(posts):
+    """
+    投稿と、その投稿で登録された Good をまとめて削除し、作品の登録数を減らす
+    1件ずつ削除する場合と違い、発行する文の数は投稿の件数に依存しない
+    （Good の集計・削除、作品ごとの減算、登録数 0 の作品の削除、投稿の削除）
+    Args:
+        posts: 削除する UserPost のクエリセット
+    Returns:
+        削除した投稿の件数
+    """
+    with transaction.atomic():
+        # 投稿と同じ作品で、同じユーザー（または旧ユーザー名）の Good
+        # 作品で照合し、作品の参照を失った投稿だけ作品URLで照合する
+        delete_goods(Good.objects.filter(Exists(
+            posts.filter(
+                Q(content_id=OuterRef('content_id'))
+                | Q(content__isnull=True, content_url=OuterRef('content_url'))
+            )
+            .filter(Q(user_id=OuterRef('user_id')) | Q(username_legacy=OuterRef('username_legacy')))
+        )))
+
+        owners = set(posts.values_list('user_id', 'list_id').distinct())
+        user_ids = {user_id for user_id, _ in owners if user_id}
+        with signals.muted():
+            deleted, _ = posts.delete()
+        if deleted:
+            versions.bump_many(
+                [versions.user(user_id) for user_id in user_ids]
+                + [versions.userlist(list_id) for _, list_id in owners if list_id]
+            )
+            if get_user_model().objects.filter(pk__in=user_ids, private=False).exists():
+                versions.bump(versions.PUBLIC_USERS)
+    return deleted
+
+
+def guest_rows(user_ids):
+    """
+    ゲストユーザーが持つ行のクエリセット（投稿・Good は u-{guest_id} の旧ユーザー名の行も含む）
+    Returns:
+        {'posts', 'goods', 'goots', 'lists', 'users'} をキーにした dict
+        goots はゲストのお気に入りと、ゲストのリストへの他のユーザーのお気に入り
+    """
+    users = get_user_model().objects.filter(pk__in=user_ids, guest_id__isnull=False)
+    names = [f"u-{guest_id}" for guest_id in users.values_list('guest_id', flat=True)]
+    owned = Q(user_id__in=user_ids) | Q(user__isnull=True, username_legacy__in=names)
+    return {
+        'posts': UserPost.objects.filter(owned),
+        'goods': Good.objects.filter(owned),
+        'goots': GootList.objects.filter(Q(user_id__in=user_ids) | Q(userlist__owner_id__in=user_ids)),
+        'lists': UserList.objects.filter(owner_id__in=user_ids),
+        'users': users,
+    }
+
+
+def delete_guests(user_ids, chunk_size=200):
+    """
+    ゲストユーザーとその投稿・Good・リスト・お気に入りを削除する
+    投稿と Good は chunk_size 件ずつ別トランザクションで削除し、長い行ロックを避ける
+    作品の登録数とリストのお気に入り数は削除した分だけ減らす
+    Args:
+        user_ids: 削除するゲストユーザーのID（guest_id のないユーザーは無視する）
+    Returns:
+        {モデルのラベル: 削除した行数}
+    """
+    rows = guest_rows(user_ids)
+    user_ids = list(rows['users'].values_list('pk', flat=True))
+    removed = {}
+
+    def in_chunks(qs, delete):
+        total = 0
+        while True:
+            ids = list(qs.values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                return total
+            total += delete(qs.model.objects.filter(pk__in=ids))
+
+    # Good を先に消す（投稿の Good もゲストのものなので、delete_posts では残りを消すだけになる）
+    removed[Good._meta.label] = in_chunks(rows['goods'], delete_goods)
+    removed[UserPost._meta.label] = in_chunks(rows['posts'], delete_posts)
+
+    with transaction.atomic():
+        goots = rows['goots']
+        # ゲストのリストはこのあと消えるので、お気に入り数を減らすのは他のユーザーのリストだけ
+        deltas = dict(
+            goots.exclude(userlist__owner_id__in=user_ids)
+            .values_list('userlist_id').annotate(n=-Count('id')).order_by()
+        )
+        touched = set(goots.values_list('userlist__owner_id', 'user_id').distinct())
+        public = get_user_model().objects.filter(pk__in=user_ids, private=False).exists()
+        counters.adjust_each(UserList, deltas, 'goot_count')
+        with signals.muted():
+            for qs in (goots, rows['lists'], rows['users']):
+                _, per_model = qs.delete()
+                for label, n in per_model.items():
+                    removed[label] = removed.get(label, 0) + n
+        # 削除したユーザー以外で、リストの内容や閲覧者のお気に入りが変わったもの
+        versions.bump_many(
+            [versions.userlist(list_id) for list_id in deltas]
+            + [versions.user(pk) for pair in touched for pk in pair if pk not in user_ids]
+        )
+        if public:
+            versions.bump(versions.PUBLIC_USERS)
+    return removed
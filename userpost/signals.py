@@ -0,0 +1,120 @@
+"""
+公開ユーザー一覧のスナップショットと、ユーザー・リストごとのバージョンを上げるシグナル
+（バージョンは条件付きGETの ETag やレスポンスキャッシュのキーに使う）
+"""
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from userlists.models import GootList, UserList
+
+from . import content_cache, versions
+from .models import ContentData, UserPost
+
+User = get_user_model()
+
+# 公開ユーザー一覧の表示に関係する列
+USER_FIELDS = {'username', 'private'}
+USERLIST_FIELDS = {'is_public', 'owner'}
+
+
+_state = threading.local()
+
+
+@contextmanager
+def muted():
+    """
+    投稿・リスト・お気に入り・ユーザーをまとめて削除する間、1件ごとのバージョン更新を止める
+    呼び出し側が最後に1回だけ bump する
+    """
+    previous = getattr(_state, 'muted', False)
+    _state.muted = True
+    try:
+        yield
+    finally:
+        _state.muted = previous
+
+
+def _is_muted():
+    return getattr(_state, 'muted', False)
+
+
+def _is_public(user_id):
+    return user_id is not None and User.objects.filter(pk=user_id, private=False).exists()
+
+
+def _touches(update_fields, fields):
+    return update_fields is None or bool(set(update_fields) & fields)
+
+
+@receiver([post_save, post_delete], sender=UserPost)
+def userpost_changed(sender, instance, **kwargs):
+    if _is_muted():
+        return
+    versions.bump_many([
+        versions.user(instance.user_id) if instance.user_id else None,
+        versions.userlist(instance.list_id) if instance.list_id else None,
+    ])
+    if _is_public(instance.user_id):
+        versions.bump(versions.PUBLIC_USERS)
+
+
+@receiver(post_save, sender=UserList)
+def userlist_saved(sender, instance, created, update_fields=None, **kwargs):
+    versions.bump_many([versions.userlist(instance.id), versions.user(instance.owner_id)])
+    # 作成直後のリストには投稿がない
+    if not created and _touches(update_fields, USERLIST_FIELDS) and _is_public(instance.owner_id):
+        versions.bump(versions.PUBLIC_USERS)
+
+
+@receiver(post_delete, sender=UserList)
+def userlist_deleted(sender, instance, **kwargs):
+    if _is_muted():
+        return
+    versions.bump_many([versions.userlist(instance.id), versions.user(instance.owner_id)])
+    if _is_public(instance.owner_id):
+        versions.bump(versions.PUBLIC_USERS)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # ログイン時の last_login 更新などでは無効化しない
+    if not created and _touches(update_fields, USER_FIELDS):
+        versions.bump_many([versions.PUBLIC_USERS, versions.user(instance.id)])
+
+
+@receiver([post_save, post_delete], sender=GootList)
+def gootlist_changed(sender, instance, **kwargs):
+    # お気に入り数・閲覧者の is_goot・非公開リストの閲覧可否が変わる
+    if _is_muted():
+        return
+    owner_id = UserList.objects.filter(pk=instance.userlist_id).values_list('owner_id', flat=True).first()
+    versions.bump_many([
+        versions.userlist(instance.userlist_id),
+        versions.user(owner_id) if owner_id else None,
+        versions.user(instance.user_id),
+    ])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    if _is_muted():
+        return
+    if not instance.private:
+        versions.bump(versions.PUBLIC_USERS)
+
+
+@receiver(post_delete, sender=ContentData)
+def content_deleted(sender, instance, **kwargs):
+    content_cache.invalidate(instance.product_id)
+
+
+@receiver(post_save, sender=ContentData)
+def content_saved(sender, instance, created, **kwargs):
+    content_cache.invalidate(instance.product_id)
+    # 新しい作品は投稿の作成時に無効化される
+    if not created:
+        versions.bump(versions.PUBLIC_USERS)
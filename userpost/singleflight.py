@@ -0,0 +1,65 @@
+"""
+ワーカープロセスをまたいだ single-flight
+
+FetchLease のユニーク制約でリースを取り合い、取れたプロセスだけが上流へ取得に行く。
+リースは期限付きなので、保持したままプロセスが落ちても期限後に他のプロセスが引き継げる。
+"""
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import FetchLease
+
+
+def acquire(key: str, seconds: float):
+    """リースを取得できればトークンを、他が保持中なら None を返す"""
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=seconds)
+    try:
+        with transaction.atomic():
+            FetchLease.objects.create(key=key, token=token, expires_at=expires_at)
+        return token
+    except IntegrityError:
+        # 期限切れのリースは引き継ぐ
+        taken = FetchLease.objects.filter(key=key, expires_at__lte=now).update(token=token, expires_at=expires_at)
+        return token if taken else None
+
+
+def release(key: str, token: str):
+    FetchLease.objects.filter(key=key, token=token).delete()
+
+
+def wait_for(check, key: str, lease_seconds: float, wait_seconds: float, poll_interval: float = 0.1):
+    """
+    check() が値を返すまで待ち、誰も処理していなければ自分がリースを取って処理する
+    Args:
+        check: 結果があれば返し、なければ None を返す関数
+        key: リースのキー
+        lease_seconds: リースの有効期間
+        wait_seconds: 他のプロセスの結果を待つ最大時間
+    Returns:
+        (result, token)
+        result が None でなければ他のプロセス（または既存データ）の結果。
+        token が None でなければ自分がリースを保持しているので、処理後に release(key, token) を呼ぶこと。
+        両方 None の場合は待ち時間切れ。
+    """
+    deadline = time.monotonic() + wait_seconds
+    while True:
+        result = check()
+        if result is not None:
+            return result, None
+        token = acquire(key, lease_seconds)
+        if token:
+            # 取得の直前に他のプロセスが終えている場合がある
+            result = check()
+            if result is not None:
+                release(key, token)
+                return result, None
+            return None, token
+        if time.monotonic() >= deadline:
+            return None, None
+        time.sleep(poll_interval)
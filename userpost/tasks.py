@@ -0,0 +1,77 @@
+"""バックグラウンドジョブの処理関数（userpost.jobs に登録される）"""
+from django.conf import settings
+from django.utils import timezone
+
+from userlists.models import UserList
+
+from . import content_cache, ogp_cache, versions
+from .jobs import handler
+from .models import ContentData, OgpCache, UserPost
+from .services import delete_posts
+from .utils import OgpInvalidUrl, OgpNotFound, _cache_fields, fetch_ogp_data
+
+
+def mark_fetch_failed(content_id, fetch_status=ContentData.FETCH_ERROR):
+    """取得待ちのContentDataを failed にする（fetch_ogp の再試行を使い切ったときにも呼ばれる）"""
+    content_data = ContentData.objects.filter(id=content_id, status=ContentData.STATUS_PENDING).first()
+    if content_data is None:
+        return
+    ContentData.objects.filter(id=content_id).update(
+        status=ContentData.STATUS_FAILED,
+        last_fetched_at=timezone.now(),
+        last_fetch_status=fetch_status,
+    )
+    content_cache.invalidate(content_data.product_id)
+
+
+@handler('fetch_ogp', on_failure=mark_fetch_failed)
+def fetch_ogp(content_id):
+    """
+    取得待ちのContentDataにOGPデータを反映し、ready/failed に更新する
+    作品がない・対象外のURLならすぐに failed にする。タイムアウト・5xx・サーキットオープンなどは
+    例外を送出してジョブキューに再試行させ、再試行を使い切ったら mark_fetch_failed で failed にする
+    """
+    content_data = ContentData.objects.filter(id=content_id, status=ContentData.STATUS_PENDING).first()
+    if content_data is None:
+        return
+    url = content_data.content_url
+    cached = ogp_cache.lookup(url)
+    if cached is not None and cached.status == OgpCache.STATUS_OK:
+        ogp_data = cached.data
+    else:
+        try:
+            ogp_data = fetch_ogp_data(url)
+        except OgpNotFound as e:
+            ogp_cache.store(url, e.status)
+            mark_fetch_failed(content_id, ContentData.FETCH_NOT_FOUND)
+            return
+        except OgpInvalidUrl as e:
+            ogp_cache.store(url, e.status)
+            mark_fetch_failed(content_id)
+            return
+        ogp_cache.store(url, OgpCache.STATUS_OK, _cache_fields(ogp_data))
+    ContentData.objects.filter(id=content_id).update(
+        title=ogp_data.get('title', '')[:200],
+        description=ogp_data.get('description', ''),
+        image=ogp_data.get('image', ''),
+        status=ContentData.STATUS_READY,
+        last_fetched_at=timezone.now(),
+        last_fetch_status=ContentData.FETCH_OK,
+    )
+    content_cache.invalidate(content_data.product_id)
+    # 取得待ちの間に作られた投稿のタイトル・画像が変わる
+    versions.bump(versions.PUBLIC_USERS)
+
+
+@handler('delete_list')
+def delete_list(list_id):
+    """削除中のリストの投稿をチャンクごとに別トランザクションで削除し、最後にリスト本体を削除する"""
+    if not UserList.objects.filter(id=list_id, deleting=True).exists():
+        return
+    while True:
+        ids = list(UserPost.objects.filter(list_id=list_id).values_list('id', flat=True)[:settings.LIST_DELETE_CHUNK_SIZE])
+        if not ids:
+            break
+        delete_posts(UserPost.objects.filter(id__in=ids))
+    for userlist in UserList.objects.filter(id=list_id, deleting=True):
+        userlist.delete()
@@ -1,40 +1,91 @@
 from django.test import TestCase
+from django.contrib.auth import get_user_model
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from unittest.mock import patch, MagicMock
-from .models import UserPost, ContentData
-from .utils import dlsite_get_ogp_data
+from .models import UserPost, ContentData, Good, OgpCache, Job, FetchLease, CounterDelta
+from django.test import override_settings, TransactionTestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.models import F
+from django.core.cache import cache
+from django.core.management import call_command
+from io import StringIO
+from datetime import timedelta
+import time
+from django.utils import timezone
+from .utils import dlsite_get_ogp_data, fetch_ogp_data, revalidate_ogp_data, OgpNotFound, OgpFetchError, OgpInvalidUrl
+from .ogp_parser import extract_ogp, iter_bytes
+from .work_url import normalize_work_url
+from .management.commands.bench_ogp_parser import parse_with_soup
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import uuid
+from . import dlsite_client
+from .dlsite_replay import ReplayServer
+from django.conf import settings
+from .dlsite_client import CircuitBreaker, CircuitOpenError, DlsiteClient
+from . import ogp_cache, jobs, counters, content_cache
 import requests
 from rest_framework.test import APIRequestFactory
 from userpost.views import UserPostViewSet
 
 # Create your tests here.
 class TestDLsiteOGPData(TestCase):
+    def setUp(self):
+        # dlsite.com の代わりに保存済みページを返すリプレイサーバーを使う
+        self.replay = ReplayServer().start()
+        self.override = override_settings(DLSITE_ORIGIN_OVERRIDE=self.replay.origin)
+        self.override.enable()
+        dlsite_client.reset_client()
+
+    def tearDown(self):
+        self.override.disable()
+        dlsite_client.reset_client()
+        self.replay.stop()
+
     def test_valid_dlsite_url(self):
         """正常なDLSiteのURLでOGPデータが取得できることをテスト"""
         url = 'https://www.dlsite.com/maniax/work/=/product_id/RJ01473335.html'
         ogp_data = dlsite_get_ogp_data(url)
-        print(ogp_data)
         
         # 戻り値がNoneでないことを確認
         self.assertIsNotNone(ogp_data)
         
         # 必要なキーが存在することを確認
-        expected_keys = ['title', 'description', 'image_url', 'url']
+        expected_keys = ['title', 'description', 'image', 'url']
         for key in expected_keys:
             self.assertIn(key, ogp_data)
+        self.assertTrue(ogp_data['title'].startswith('癒やしの耳かきボイス&添い寝'))
             
         # URLが正しく保存されていることを確認
         self.assertEqual(ogp_data['url'], url)
 
+    def test_conditional_get_and_errors(self):
+        """リプレイサーバーの 304・404・503 をテスト"""
+        url = 'https://www.dlsite.com/maniax/work/=/product_id/RJ01230861.html'
+        first = revalidate_ogp_data(url)
+        self.assertFalse(first['not_modified'])
+        self.assertTrue(first['etag'])
+        second = revalidate_ogp_data(url, etag=first['etag'])
+        self.assertTrue(second['not_modified'])
+
+        with self.assertRaises(OgpNotFound):
+            fetch_ogp_data('https://www.dlsite.com/maniax/work/=/product_id/RJ09999999.html')
+        self.replay.error_rate = 1.0
+        with self.assertRaises(OgpFetchError):
+            fetch_ogp_data(url)
+        self.assertEqual(self.replay.counts['errors'], settings.DLSITE_HTTP_MAX_RETRIES + 1)
+
     def test_invalid_domain(self):
         """DLSite以外のドメインの場合はNoneが返されることをテスト"""
         url = 'https://example.com/some/path'
         ogp_data = dlsite_get_ogp_data(url)
         self.assertIsNone(ogp_data)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_network_error(self, mock_get):
         """ネットワークエラー時にNoneが返されることをテスト"""
         mock_get.side_effect = requests.exceptions.RequestException()
@@ -42,7 +93,7 @@ class TestDLsiteOGPData(TestCase):
         ogp_data = dlsite_get_ogp_data(url)
         self.assertIsNone(ogp_data)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_timeout_error(self, mock_get):
         """タイムアウト時にNoneが返されることをテスト"""
         mock_get.side_effect = requests.exceptions.Timeout()
@@ -56,6 +107,221 @@ class TestDLsiteOGPData(TestCase):
         ogp_data = dlsite_get_ogp_data(url)
         self.assertIsNone(ogp_data)
 
+class TestOgpCache(TestCase):
+    url = 'https://www.dlsite.com/maniax/work/=/product_id/RJ01473335.html'
+
+    def setUp(self):
+        ogp_cache.reset_stats()
+
+    @patch('userpost.utils.fetch_ogp_data')
+    def test_hit_skips_upstream(self, mock_fetch):
+        """2回目以降はキャッシュから返り、クエリ違いのURLも同じキーになることをテスト"""
+        mock_fetch.return_value = {'title': 'T', 'description': 'D', 'image': 'I', 'url': self.url}
+        self.assertEqual(dlsite_get_ogp_data(self.url)['title'], 'T')
+        other = self.url + '?locale=ja_JP'
+        self.assertEqual(dlsite_get_ogp_data(other), {'title': 'T', 'description': 'D', 'image': 'I', 'url': other})
+        self.assertEqual(mock_fetch.call_count, 1)
+        self.assertEqual(ogp_cache.stats()['process']['hit'], 1)
+
+    @patch('userpost.utils.fetch_ogp_data')
+    def test_negative_cache(self, mock_fetch):
+        """404はネガティブキャッシュされ、期限切れ後に再取得されることをテスト"""
+        mock_fetch.side_effect = OgpNotFound('404')
+        self.assertIsNone(dlsite_get_ogp_data(self.url))
+        self.assertIsNone(dlsite_get_ogp_data(self.url))
+        self.assertEqual(mock_fetch.call_count, 1)
+
+        OgpCache.objects.update(expires_at=timezone.now())
+        self.assertIsNone(dlsite_get_ogp_data(self.url))
+        self.assertEqual(mock_fetch.call_count, 2)
+        stats = ogp_cache.stats()
+        self.assertEqual(stats['process'], {'hit': 0, 'negative_hit': 1, 'miss': 1, 'stale': 1})
+        self.assertEqual(stats['total']['fetches'], 2)
+
+    @override_settings(OGP_CACHE_HIT_FLUSH_EVERY=3)
+    def test_hits_are_written_in_batches(self):
+        """ヒットのたびには書き込まず、まとめて hit_count に反映することをテスト"""
+        ogp_cache.store(self.url, OgpCache.STATUS_OK, {'title': 'T', 'description': '', 'image': ''})
+        with CaptureQueriesContext(connection) as queries:
+            ogp_cache.lookup(self.url)
+            ogp_cache.lookup_many([self.url])
+        self.assertFalse(any(q['sql'].startswith('UPDATE') for q in queries.captured_queries))
+        self.assertEqual(OgpCache.objects.get().hit_count, 0)
+        ogp_cache.lookup(self.url)
+        self.assertEqual(OgpCache.objects.get().hit_count, 3)
+        ogp_cache.lookup(self.url)
+        self.assertEqual(ogp_cache.stats()['total']['hits'], 4)
+
+    @patch('requests.Session.get')
+    def test_invalid_domain_cached(self, mock_get):
+        """DLSite以外のURLは上流に問い合わせずinvalidとして記録されることをテスト"""
+        self.assertIsNone(dlsite_get_ogp_data('https://example.com/some/path'))
+        mock_get.assert_not_called()
+        self.assertEqual(OgpCache.objects.get().status, OgpCache.STATUS_INVALID)
+
+class TestOgpHeadParser(TestCase):
+    pages_dir = Path(__file__).resolve().parent / 'testdata' / 'dlsite'
+
+    def test_matches_beautifulsoup(self):
+        """保存済みページでBeautifulSoupと同じ値を、ページ全体を読まずに返すことをテスト"""
+        for path in self.pages_dir.glob('*.html'):
+            data = path.read_bytes()
+            expected, _ = parse_with_soup(data)
+            # マルチバイト文字がチャンク境界をまたぐように細かく分割する
+            values, bytes_read = extract_ogp(iter_bytes(data, chunk_size=7))
+            self.assertEqual(values, expected, path.name)
+            self.assertLess(bytes_read, len(data))
+
+    def test_entities_and_missing_content(self):
+        html = '<html><head><meta property="og:title" content="A &amp; B"><meta property="og:image"></head>'.encode()
+        values, _ = extract_ogp([html])
+        self.assertEqual(values, {'title': 'A & B', 'image': ''})
+
+    def test_byte_cap(self):
+        html = b'<html><head>' + b'<link rel="x">' * 1000 + b'<meta property="og:title" content="late"></head>'
+        values, bytes_read = extract_ogp(iter_bytes(html, chunk_size=100), max_bytes=1000)
+        self.assertEqual(values, {})
+        self.assertEqual(bytes_read, 1000)
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """server.responses に積んだ (status, body) を順に返すdlsiteの代役"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.client_ports.append(self.client_address[1])
+        status_code, body = self.server.responses.pop(0) if self.server.responses else (200, b'<head></head>')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDlsiteClient(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+        self.server.responses = []
+        self.server.client_ports = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/maniax/work/=/product_id/RJ01473335.html'
+        self.now = 0.0
+        self.breaker = CircuitBreaker(failure_threshold=2, cooldown=30, clock=lambda: self.now)
+        self.client = DlsiteClient(backoff=0, max_retries=2, timeout=2, breaker=self.breaker)
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive_reuses_connection(self):
+        page = b'<head><meta property="og:title" content="T"></head>' + b'<body>' + b'x' * 4000 + b'</body>'
+        self.server.responses = [(200, page)] * 3
+        for _ in range(3):
+            # OGP の取得と同じく、</head> までで読むのをやめる
+            with self.client.get(self.url, stream=True) as response:
+                values, _ = extract_ogp(response.iter_content(chunk_size=1024), encoding=response.encoding)
+            self.assertEqual(values['title'], 'T')
+        self.assertEqual(len(set(self.server.client_ports)), 1)
+        self.assertEqual(self.client.stats()['in_flight'], 0)
+
+    def test_large_remainder_is_not_drained(self):
+        # 読み残しのある接続はクライアントが切るので、サーバー側の書き込みエラーは無視する
+        self.server.handle_error = lambda request, client_address: None
+        self.server.responses = [(200, b'<head></head>' + b'x' * 100000)] * 2
+        for _ in range(2):
+            with self.client.get(self.url, stream=True) as response:
+                next(response.iter_content(chunk_size=1024))
+        self.assertEqual(len(set(self.server.client_ports)), 2)
+
+    def test_retries_5xx(self):
+        self.server.responses = [(500, b''), (503, b''), (200, b'ok')]
+        with self.client.get(self.url) as response:
+            self.assertEqual(response.text, 'ok')
+        self.assertEqual(self.client.stats()['retries'], 2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_circuit_breaker(self):
+        """失敗が続くと開いて即座に失敗し、クールダウン後の試行成功で閉じることをテスト"""
+        self.client.max_retries = 0
+        self.server.responses = [(500, b''), (500, b'')]
+        for _ in range(2):
+            with self.client.get(self.url) as response:
+                self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            with self.client.get(self.url):
+                pass
+        self.assertEqual(len(self.server.client_ports), 2)
+
+        self.now += 30
+        self.assertEqual(self.client.stats()['breaker']['state'], CircuitBreaker.HALF_OPEN)
+        with self.client.get(self.url) as response:
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_failure_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_other_request_errors_end_half_open_trial(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+        with patch.object(self.client.session, 'get', side_effect=requests.exceptions.TooManyRedirects('loop')):
+            with self.assertRaises(requests.exceptions.TooManyRedirects):
+                with self.client.get(self.url):
+                    pass
+        # 試行の失敗で開き直し、クールダウン後に次の試行を通す
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.now += 30
+        with self.client.get(self.url) as response:
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+class TestWorkUrl(APITestCase):
+    def test_normalize_variants(self):
+        """フロア違い・クエリ・末尾スラッシュ・アフィリエイトリンクが同じ作品IDになることをテスト"""
+        canonical = 'https://www.dlsite.com/maniax/work/=/product_id/RJ01473335.html'
+        for url in [
+            canonical,
+            canonical + '?locale=ja_JP#top',
+            'https://www.dlsite.com/maniax/work/=/product_id/rj01473335.html/',
+            'https://dlaf.jp/maniax/dlaf/=/t/s/link/work/aid/orenodojinme_ta/id/RJ01473335.html',
+        ]:
+            self.assertEqual(normalize_work_url(url), ('RJ01473335', canonical), url)
+        self.assertEqual(
+            normalize_work_url('https://www.dlsite.com/home/work/=/product_id/RJ01473335.html')[0], 'RJ01473335'
+        )
+        self.assertEqual(normalize_work_url('https://dlsite.com/work/=/product_id/VJ012345.html'),
+                         ('VJ012345', 'https://www.dlsite.com/pro/work/=/product_id/VJ012345.html'))
+        self.assertEqual(normalize_work_url('https://example.com/RJ01473335.html'), (None, None))
+        self.assertEqual(normalize_work_url('https://www.dlsite.com/maniax/'), (None, None))
+
+    @patch('userpost.services.dlsite_get_ogp_data')
+    def test_create_with_variant_url_reuses_work(self, mock_ogp):
+        ContentData.objects.create(
+            content_url='https://www.dlsite.com/maniax/work/=/product_id/RJ01473335.html', title='既存',
+        )
+        url = 'https://dlaf.jp/maniax/dlaf/=/t/s/link/work/aid/x/id/RJ01473335.html'
+        response = self.client.post(reverse('userpost-list'), {'content_url': url}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        mock_ogp.assert_not_called()
+        content = ContentData.objects.get()
+        self.assertEqual(content.product_id, 'RJ01473335')
+        self.assertEqual(content.good_count, 1)
+        self.assertEqual(UserPost.objects.get().content_url, content.content_url)
+
+        response = self.client.post(reverse('userpost-list'), {'content_url': content.content_url + '?x=1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 class TestUserPostCreate(APITestCase):
     """UserPostのcreateメソッドのテスト"""
     
@@ -68,7 +334,7 @@ class TestUserPostCreate(APITestCase):
             'content_url': 'https://www.dlsite.com/maniax/work/=/product_id/RJ01230861.html'
         }
     
-    @patch('userpost.views.dlsite_get_ogp_data')
+    @patch('userpost.services.dlsite_get_ogp_data')
     def test_create_post_with_existing_content_data(self, mock_ogp):
         """既存のContentDataがある場合の投稿作成テスト"""
         # 既存のContentDataを作成
@@ -100,7 +366,7 @@ class TestUserPostCreate(APITestCase):
         # OGP取得が呼ばれていないことを確認
         mock_ogp.assert_not_called()
     
-    @patch('userpost.views.dlsite_get_ogp_data')
+    @patch('userpost.services.dlsite_get_ogp_data')
     def test_create_post_with_new_content_data(self, mock_ogp):
         """新しいContentDataを作成する場合の投稿作成テスト"""
         # OGPデータをモック
@@ -129,7 +395,7 @@ class TestUserPostCreate(APITestCase):
         # OGP取得が呼ばれたことを確認
         mock_ogp.assert_called_once_with(self.valid_data['content_url'])
     
-    @patch('userpost.views.dlsite_get_ogp_data')
+    @patch('userpost.services.dlsite_get_ogp_data')
     def test_create_post_ogp_failure(self, mock_ogp):
         """OGP取得に失敗した場合のテスト"""
         # OGP取得を失敗させる
@@ -157,6 +423,909 @@ class TestUserPostCreate(APITestCase):
         # バリデーションエラーが返されることを確認
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+class TestContentForeignKey(APITestCase):
+    """UserPost/Good から ContentData への外部キーのテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    @patch('userpost.services.dlsite_get_ogp_data')
+    def test_create_sets_fk(self, mock_ogp):
+        mock_ogp.return_value = {'title': 'T', 'description': 'D', 'image': 'https://img/x.jpg'}
+        response = self.client.post(reverse('userpost-list'), {'content_url': self.base + 'RJ01230861.html'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        content = ContentData.objects.get()
+        self.assertEqual(response.data['data']['content_id'], content.id)
+        self.assertEqual(UserPost.objects.get().content, content)
+        self.assertEqual(Good.objects.get().content, content)
+
+    @patch('userpost.services.dlsite_get_ogp_data')
+    def test_recreated_content_relinks_orphans(self, mock_ogp):
+        mock_ogp.return_value = {'title': 'T', 'description': 'D', 'image': 'https://img/x.jpg'}
+        User = get_user_model()
+        first, second = User.objects.create(username='first'), User.objects.create(username='second')
+        url = self.base + 'RJ01230861.html'
+        self.client.force_authenticate(first)
+        self.client.post(reverse('userpost-list'), {'content_url': url}, format='json')
+        # 作品だけが削除され、投稿と Good は参照を失う
+        ContentData.objects.all().delete()
+        self.assertIsNone(UserPost.objects.get().content)
+
+        self.client.force_authenticate(second)
+        response = self.client.post(reverse('userpost-list'), {'content_url': url + '?x=1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        content = ContentData.objects.get()
+        self.assertEqual(set(UserPost.objects.values_list('content', flat=True)), {content.id})
+        self.assertEqual(set(Good.objects.values_list('content', flat=True)), {content.id})
+        self.assertEqual(content.good_count, 2)
+
+    def test_destroy_matches_goods_by_content(self):
+        user = get_user_model().objects.create(username='fk')
+        content = ContentData.objects.create(content_url=self.base + 'RJ01230861.html', good_count=2)
+        post = UserPost.objects.create(user=user, username_legacy='fk', content_url=content.content_url, content=content)
+        # 表記の違うURLで記録された Good も同じ作品として扱う
+        Good.objects.create(user=user, username_legacy='fk', content_url='https://dlsite.com/maniax/work/=/product_id/RJ01230861', content=content)
+        self.client.force_authenticate(user)
+        response = self.client.delete(reverse('userpost-detail', args=[post.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Good.objects.exists())
+        content.refresh_from_db()
+        self.assertEqual(content.good_count, 1)
+
+class TestPublicUsers(APITestCase):
+    """公開ユーザー一覧のクエリ数とスナップショットのテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def setUp(self):
+        cache.clear()
+        self.client.cookies['guest_id'] = str(uuid.uuid4())
+        self.serial = 0
+
+    def seed(self, users, posts):
+        User = get_user_model()
+        created = []
+        for _ in range(users):
+            self.serial += 1
+            user = User.objects.create(username=f'public{self.serial}')
+            for j in range(posts):
+                cd = ContentData.objects.create(content_url=self.base + f'RJ{self.serial:04d}{j:04d}.html', title=f'作品{self.serial}-{j}')
+                UserPost.objects.create(user=user, username_legacy=user.username, content_url=cd.content_url, content=cd)
+            created.append(user)
+        return created
+
+    def fetch(self):
+        return self.client.get(reverse('public-users-list'))
+
+    def test_query_count_is_constant(self):
+        self.seed(users=2, posts=3)
+        # バージョン1回 + ユーザー一覧1回 + 全ユーザーの投稿1回（作品は JOIN で取得する）
+        with self.assertNumQueries(3):
+            response = self.fetch()
+        self.assertEqual(response.data[0]['posts'][0]['title'], '作品1-2')
+
+        self.seed(users=10, posts=25)
+        with self.assertNumQueries(3):
+            response = self.fetch()
+        self.assertEqual(len(response.data), 12)
+        self.assertEqual([len(u['posts']) for u in response.data], [3, 3] + [20] * 10)
+
+    def test_snapshot_is_rebuilt_on_change(self):
+        user, = self.seed(users=1, posts=1)
+        self.fetch()
+        with self.assertNumQueries(1):
+            self.fetch()
+
+        # 非公開リストへの移動で一覧から消える
+        from userlists.models import UserList
+        hidden = UserList.objects.create(owner=user, name='非公開', is_public=False)
+        post = UserPost.objects.get(user=user)
+        post.list = hidden
+        post.save(update_fields=['list'])
+        self.assertEqual(self.fetch().data[0]['posts'], [])
+
+        hidden.is_public = True
+        hidden.save(update_fields=['is_public'])
+        self.assertEqual(len(self.fetch().data[0]['posts']), 1)
+
+        user.private = True
+        user.save(update_fields=['private'])
+        self.assertEqual(self.fetch().data, [])
+
+class TestKeysetPagination(APITestCase):
+    """投稿・作品一覧のキーセットページネーションのテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def setUp(self):
+        self.client.cookies['guest_id'] = str(uuid.uuid4())
+        self.user = get_user_model().objects.create(username='keyset')
+        same_time = timezone.now()
+        self.posts = []
+        for i in range(7):
+            post = UserPost.objects.create(user=self.user, username_legacy='keyset', content_url=self.base + f'RJ{i:08d}.html')
+            self.posts.append(post)
+        # 同じ作成日時の行があっても id で順序が決まる
+        UserPost.objects.filter(id__in=[p.id for p in self.posts[2:5]]).update(created_at=same_time)
+
+    def walk(self, url, **params):
+        pages = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            pages.append([row['id'] for row in response.data['results']])
+            if not response.data['next']:
+                return pages, response
+            response = self.client.get(response.data['next'])
+
+    def test_pages_cover_all_rows_once(self):
+        pages, last = self.walk(reverse('userpost-list'), username='keyset', page_size=3)
+        expected = [
+            p.id for p in sorted(UserPost.objects.all(), key=lambda p: (p.created_at, p.id), reverse=True)
+        ]
+        self.assertEqual([len(p) for p in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+        # previous で前のページに戻れる
+        back = self.client.get(last.data['previous'])
+        self.assertEqual([row['id'] for row in back.data['results']], pages[1])
+
+    def test_deep_page_query_count(self):
+        response = self.client.get(reverse('userpost-list'), {'page_size': 2})
+        for _ in range(2):
+            response = self.client.get(response.data['next'])
+        # ページの深さに関係なく、投稿の取得は1クエリ（COUNT(*) は発行しない）
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.data['next'])
+        self.assertFalse(any('COUNT(' in q['sql'].upper() for q in queries.captured_queries))
+        self.assertEqual(sum('FROM "userpost_userpost"' in q['sql'] for q in queries.captured_queries), 1)
+
+    def test_page_size_cap_and_invalid_cursor(self):
+        with self.settings(API_MAX_PAGE_SIZE=5):
+            response = self.client.get(reverse('userpost-list'), {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 5)
+        response = self.client.get(reverse('content-list'), {'cursor': 'broken'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class TestExpandContent(APITestCase):
+    """?expand=content で作品情報を埋め込むテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def setUp(self):
+        self.client.cookies['guest_id'] = str(uuid.uuid4())
+        self.user = get_user_model().objects.create(username='expand')
+
+    def add_posts(self, start, n):
+        for i in range(start, start + n):
+            url = self.base + f'RJ{i:08d}.html'
+            content = ContentData.objects.create(content_url=url, title=f'作品{i}', image=f'https://img/{i}.jpg', good_count=1)
+            UserPost.objects.create(user=self.user, username_legacy='expand', content_url=url, content=content)
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('userpost-list'), {'username': 'expand', 'expand': 'content'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(queries.captured_queries)
+
+    def test_expand_inlines_content(self):
+        self.add_posts(0, 2)
+        response = self.client.get(reverse('userpost-list'), {'username': 'expand'})
+        self.assertNotIn('content', response.data['results'][0])
+
+        response, _ = self.list_queries()
+        row = response.data['results'][0]
+        self.assertEqual(row['content']['title'], '作品1')
+        self.assertEqual(row['content']['image'], 'https://img/1.jpg')
+        self.assertEqual(row['content']['good_count'], 1)
+
+        post = UserPost.objects.get(content__title='作品0')
+        response = self.client.get(reverse('userpost-detail', args=[post.id]), {'expand': 'content'})
+        self.assertEqual(response.data['content']['id'], post.content_id)
+
+    def test_query_count_does_not_grow_with_page(self):
+        self.add_posts(0, 2)
+        _, few = self.list_queries()
+        self.add_posts(2, 8)
+        _, many = self.list_queries()
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 3)
+
+    @override_settings(COUNTER_WRITE_BEHIND=True)
+    def test_pending_counts_fetched_per_page(self):
+        self.add_posts(0, 5)
+        for content in ContentData.objects.all():
+            counters.adjust_good_count(content.id, 2)
+        response, count = self.list_queries()
+        self.assertEqual({row['content']['good_count'] for row in response.data['results']}, {3})
+        # 未反映分は1ページにつき1クエリで取得する
+        self.assertLessEqual(count, 4)
+
+
+class TestConditionalGet(APITestCase):
+    """ETag / Last-Modified による 304 のテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def setUp(self):
+        from userlists.models import UserList
+        self.client.cookies['guest_id'] = str(uuid.uuid4())
+        self.user = get_user_model().objects.create(username='etag')
+        self.userlist = UserList.objects.create(owner=self.user, name='条件付き')
+        self.add_post(0)
+
+    def add_post(self, i):
+        UserPost.objects.create(user=self.user, username_legacy='etag', content_url=self.base + f'RJ{i:08d}.html', list=self.userlist)
+
+    def assert_revalidates(self, url, params, change):
+        first = self.client.get(url, params)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        etag = first['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(second['ETag'], etag)
+        # 304 のときは一覧を取得しない
+        self.assertFalse(any('"userpost_userpost"' in q['sql'] for q in queries.captured_queries))
+        self.assertEqual(self.client.get(url, params, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+        change()
+        third = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(third.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(third['ETag'], etag)
+
+    def test_posts_by_username_and_list(self):
+        self.assert_revalidates(reverse('userpost-list'), {'username': 'etag'}, lambda: self.add_post(1))
+        self.assert_revalidates(reverse('userpost-list'), {'list_id': self.userlist.id}, lambda: self.add_post(2))
+        # 正規形でない list_id でも同じリストのバージョンで検証する
+        self.assert_revalidates(reverse('userpost-list'), {'list_id': f'0{self.userlist.id}'}, lambda: self.add_post(4))
+
+    def test_lists(self):
+        from userlists.models import GootList
+        other = get_user_model().objects.create(username='etag_other')
+        self.assert_revalidates(
+            reverse('userlist-by-user'), {'username': 'etag'},
+            lambda: GootList.objects.create(user=other, userlist=self.userlist),
+        )
+        self.client.force_authenticate(self.user)
+        self.assert_revalidates(
+            reverse('userlist-retrieve-public', args=[self.userlist.id]), {},
+            lambda: self.userlist.save(update_fields=['name']),
+        )
+
+        def rename():
+            self.user.username = 'etag_renamed'
+            self.user.save(update_fields=['username'])
+        self.assert_revalidates(reverse('userlist-retrieve-public', args=[self.userlist.id]), {}, rename)
+
+    def test_public_users(self):
+        self.assert_revalidates(reverse('public-users-list'), {}, lambda: self.add_post(3))
+
+
+class TestResponseCache(APITestCase):
+    """バージョン付きレスポンスキャッシュのテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def setUp(self):
+        from userlists.models import UserList
+        cache.clear()
+        self.client.cookies['guest_id'] = str(uuid.uuid4())
+        User = get_user_model()
+        self.owner = User.objects.create(username='cache_owner')
+        self.viewer = User.objects.create(username='cache_viewer')
+        self.userlist = UserList.objects.create(owner=self.owner, name='キャッシュ', is_public=False)
+        UserPost.objects.create(user=self.owner, username_legacy='cache_owner', content_url=self.base + 'RJ00000001.html', list=self.userlist)
+
+    def get_posts(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('userpost-list'), {'list_id': self.userlist.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        reads = sum('FROM "userpost_userpost"' in q['sql'] for q in queries.captured_queries)
+        return [r['id'] for r in response.data['results']], reads
+
+    def test_hit_and_invalidation(self):
+        self.client.force_authenticate(self.owner)
+        first, reads = self.get_posts()
+        self.assertEqual((len(first), reads), (1, 1))
+        # 2回目は投稿を読まずにキャッシュから返す
+        self.assertEqual(self.get_posts(), (first, 0))
+
+        UserPost.objects.create(user=self.owner, username_legacy='cache_owner', content_url=self.base + 'RJ00000002.html', list=self.userlist)
+        ids, reads = self.get_posts()
+        self.assertEqual((len(ids), reads), (2, 1))
+
+    def test_visibility_scopes(self):
+        from userlists.models import GootList
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(len(self.get_posts()[0]), 1)
+
+        # 非公開リストの投稿はオーナーのキャッシュを共有しない
+        self.client.force_authenticate(self.viewer)
+        self.assertEqual(self.get_posts()[0], [])
+        self.client.force_authenticate(None)
+        self.assertEqual(self.get_posts()[0], [])
+
+        GootList.objects.create(user=self.viewer, userlist=self.userlist)
+        self.client.force_authenticate(self.viewer)
+        self.assertEqual(len(self.get_posts()[0]), 1)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.get_posts()[0], [])
+
+
+@override_settings(OGP_ASYNC_CREATE=True)
+class TestUserPostCreateAsync(APITestCase):
+    """OGP取得をジョブキューに回す非同期作成モードのテスト"""
+    content_url = 'https://www.dlsite.com/maniax/work/=/product_id/RJ01230861.html'
+
+    @patch('userpost.tasks.fetch_ogp_data')
+    @patch('userpost.services.dlsite_get_ogp_data')
+    def test_returns_202_and_worker_fills_ogp(self, mock_view_ogp, mock_task_ogp):
+        mock_task_ogp.return_value = {'title': 'OGPタイトル', 'description': 'OGP説明', 'image': 'https://example.com/i.jpg'}
+        response = self.client.post(reverse('userpost-list'), {'content_url': self.content_url}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['content']['status'], ContentData.STATUS_PENDING)
+        mock_view_ogp.assert_not_called()
+        self.assertEqual(UserPost.objects.count(), 1)
+
+        self.assertEqual(jobs.run_pending(), 1)
+        content = self.client.get(reverse('content-detail', args=[response.data['content']['id']])).data
+        self.assertEqual(content['status'], ContentData.STATUS_READY)
+        self.assertEqual(content['title'], 'OGPタイトル')
+        self.assertEqual(content['good_count'], 1)
+        self.assertEqual(Job.objects.get().status, Job.STATUS_DONE)
+
+    @patch('userpost.tasks.fetch_ogp_data', side_effect=OgpNotFound('404'))
+    def test_not_found_marks_failed(self, mock_task_ogp):
+        response = self.client.post(reverse('userpost-list'), {'content_url': self.content_url}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        jobs.run_pending()
+        content = ContentData.objects.get()
+        self.assertEqual((content.status, content.last_fetch_status), (ContentData.STATUS_FAILED, ContentData.FETCH_NOT_FOUND))
+        self.assertEqual(Job.objects.get().status, Job.STATUS_DONE)
+
+    @patch('userpost.tasks.fetch_ogp_data', side_effect=OgpFetchError('timeout'))
+    def test_transient_failure_is_retried(self, mock_task_ogp):
+        self.client.post(reverse('userpost-list'), {'content_url': self.content_url}, format='json')
+        for attempt in range(1, jobs.MAX_ATTEMPTS + 1):
+            Job.objects.update(run_after=timezone.now())
+            self.assertEqual(jobs.run_pending(), 1)
+            job, content = Job.objects.get(), ContentData.objects.get()
+            if attempt < jobs.MAX_ATTEMPTS:
+                # 再試行待ちの間は取得待ちのまま
+                self.assertEqual((job.status, content.status), (Job.STATUS_QUEUED, ContentData.STATUS_PENDING))
+        self.assertEqual((job.status, content.status), (Job.STATUS_FAILED, ContentData.STATUS_FAILED))
+        self.assertEqual(mock_task_ogp.call_count, jobs.MAX_ATTEMPTS)
+
+    def test_invalid_host_rejected_synchronously(self):
+        response = self.client.post(reverse('userpost-list'), {'content_url': 'https://example.com/x'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Job.objects.count(), 0)
+
+class TestUserPostBulkCreate(APITestCase):
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def fake_fetch(self, url):
+        if 'RJ00000404' in url:
+            raise OgpNotFound('404')
+        return {'title': url[-15:], 'description': '', 'image': '', 'url': url}
+
+    @patch('userpost.utils.fetch_ogp_data')
+    def test_bulk_create(self, mock_fetch):
+        mock_fetch.side_effect = self.fake_fetch
+        existing = ContentData.objects.create(content_url=self.base + 'RJ00000001.html', title='既存', good_count=2)
+        urls = [self.base + f'RJ0000000{i}.html' for i in range(1, 6)]
+        payload = {'urls': urls + [urls[1], 'https://example.com/x', self.base + 'RJ00000404.html']}
+
+        response = self.client.post(reverse('userpost-bulk-create'), payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['status'] for r in response.data['results']],
+                         ['created'] * 5 + ['duplicate', 'invalid', 'fetch_failed'])
+        self.assertEqual(response.data['summary'], {'created': 5, 'duplicate': 1, 'invalid': 1, 'fetch_failed': 1})
+        self.assertEqual(mock_fetch.call_count, 5)
+        self.assertEqual(UserPost.objects.count(), 5)
+        self.assertEqual(ContentData.objects.count(), 5)
+        existing.refresh_from_db()
+        self.assertEqual(existing.good_count, 3)
+        self.assertEqual(ContentData.objects.get(content_url=urls[4]).good_count, 1)
+
+        # 2回目は既存の投稿として扱われる
+        response = self.client.post(reverse('userpost-bulk-create'), {'urls': urls[:2]}, format='json')
+        self.assertEqual(response.data['summary'], {'duplicate': 2})
+
+    def test_limit(self):
+        with self.settings(BULK_IMPORT_MAX_URLS=2):
+            response = self.client.post(reverse('userpost-bulk-create'), {'urls': ['a', 'b', 'c']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class TestUserPostBulkDeleteMove(APITestCase):
+    """bulk_delete / bulk_move のテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create(username='bulk')
+        self.other = User.objects.create(username='bulk_other')
+        self.client.cookies['guest_id'] = str(uuid.uuid4())
+        self.client.force_authenticate(self.user)
+
+    def add_posts(self, user, start, n):
+        posts = []
+        for i in range(start, start + n):
+            url = self.base + f'RJ{i:08d}.html'
+            content, _ = ContentData.objects.get_or_create(product_id=f'RJ{i:08d}', defaults={'content_url': url})
+            ContentData.objects.filter(pk=content.pk).update(good_count=F('good_count') + 1)
+            Good.objects.create(user=user, username_legacy=user.username, content_url=url, content=content)
+            posts.append(UserPost.objects.create(user=user, username_legacy=user.username, content_url=url, content=content))
+        return posts
+
+    def test_bulk_delete(self):
+        mine = self.add_posts(self.user, 0, 3)
+        theirs = self.add_posts(self.other, 0, 1)
+        ids = [p.id for p in mine] + [theirs[0].id, 999999]
+        response = self.client.post(reverse('userpost-bulk-delete'), {'ids': ids}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['status'] for r in response.data['results']], ['deleted'] * 3 + ['forbidden', 'not_found'])
+        self.assertEqual(list(UserPost.objects.values_list('id', flat=True)), [theirs[0].id])
+        # 他のユーザーも登録している作品だけが残る
+        self.assertEqual(list(ContentData.objects.values_list('product_id', 'good_count')), [('RJ00000000', 1)])
+
+    def test_bulk_statements_do_not_grow(self):
+        counts = []
+        for start, n in [(0, 2), (10, 20)]:
+            ids = [p.id for p in self.add_posts(self.user, start, n)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('userpost-bulk-delete'), {'ids': ids}, format='json')
+            self.assertEqual(response.data['summary'], {'deleted': n})
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_bulk_move(self):
+        from userlists.models import UserList
+        target = UserList.objects.create(owner=self.user, name='移動先')
+        foreign = UserList.objects.create(owner=self.other, name='他人')
+        mine = self.add_posts(self.user, 0, 2)
+        theirs = self.add_posts(self.other, 5, 1)
+        ids = [p.id for p in mine + theirs]
+
+        response = self.client.post(reverse('userpost-bulk-move'), {'ids': ids, 'list_id': foreign.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('userpost-bulk-move'), {'ids': ids, 'list_id': target.id}, format='json')
+        self.assertEqual(response.data['summary'], {'moved': 2, 'forbidden': 1})
+        self.assertEqual(sum(q['sql'].startswith('UPDATE "userpost_userpost"') for q in queries.captured_queries), 1)
+        self.assertEqual(set(target.userposts.values_list('id', flat=True)), {p.id for p in mine})
+
+        response = self.client.post(reverse('userpost-bulk-move'), {'ids': 'x', 'list_id': target.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_guest_move_list(self):
+        from accounts.utils import get_or_create_guest_user
+        from userlists.models import UserList
+        guest_id = str(uuid.uuid4())
+        guest, _ = get_or_create_guest_user(guest_id)
+        target = UserList.objects.create(owner=guest, name='移動先')
+        post = UserPost.objects.create(user=guest, username_legacy=f'u-{guest_id}', content_url=self.base + 'RJ00000000.html')
+        self.client.force_authenticate(None)
+        self.client.cookies['guest_id'] = guest_id
+        response = self.client.post(reverse('userpost-move-list', args=[post.id]), {'list_id': target.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        post.refresh_from_db()
+        self.assertEqual(post.list, target)
+
+    def test_bulk_move_into_private_list_changes_public_users(self):
+        from userlists.models import UserList
+        cache.clear()
+        private = UserList.objects.create(owner=self.user, name='非公開', is_public=False)
+        post, = self.add_posts(self.user, 0, 1)
+        UserPost.objects.filter(pk=post.pk).update(list=UserList.objects.get(owner=self.user, name='Home'))
+        before = self.client.get(reverse('public-users-list'))
+        self.assertEqual(len(before.data[0]['posts']), 1)
+
+        self.client.post(reverse('userpost-bulk-move'), {'ids': [post.id], 'list_id': private.id}, format='json')
+        after = self.client.get(reverse('public-users-list'), HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        self.assertEqual(after.data[0]['posts'], [])
+
+class TestRefreshContentData(TestCase):
+    """refresh_content_data コマンドのテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def setUp(self):
+        old = timezone.now() - timedelta(days=60)
+        self.popular = ContentData.objects.create(
+            content_url=self.base + 'RJ00000001.html', title='旧', image='https://img/1', good_count=10,
+            last_fetched_at=old, etag='"v1"',
+        )
+        self.never = ContentData.objects.create(content_url=self.base + 'RJ00000002.html', title='部分', good_count=1)
+        self.fresh = ContentData.objects.create(
+            content_url=self.base + 'RJ00000003.html', title='新', good_count=50, last_fetched_at=timezone.now(),
+        )
+
+    def refresh(self, **options):
+        out = StringIO()
+        call_command('refresh_content_data', rpm=0, stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    @patch('userpost.services.revalidate_ogp_data')
+    def test_priority_and_conditional_get(self, mock_fetch):
+        def fake(url, etag='', last_modified=''):
+            if etag == '"v1"':
+                return {'not_modified': True, 'ogp_data': None, 'etag': etag, 'last_modified': ''}
+            data = {'title': '完全版', 'description': '説明', 'image': '', 'url': url}
+            return {'not_modified': False, 'ogp_data': data, 'etag': '"v2"', 'last_modified': 'Sat, 17 Oct 2026 00:00:00 GMT'}
+        mock_fetch.side_effect = fake
+
+        output = self.refresh()
+
+        # 登録数の多い順に処理され、新しく取得したものは対象外
+        self.assertEqual([c.args[0] for c in mock_fetch.call_args_list],
+                         [self.popular.content_url, self.never.content_url])
+        self.assertIn('not_modified=1 ok=1', output)
+        self.popular.refresh_from_db()
+        self.assertEqual(self.popular.title, '旧')
+        self.assertEqual(self.popular.last_fetch_status, ContentData.FETCH_NOT_MODIFIED)
+        self.assertGreater(self.popular.last_fetched_at, timezone.now() - timedelta(minutes=1))
+        self.never.refresh_from_db()
+        self.assertEqual((self.never.title, self.never.description), ('完全版', '説明'))
+        self.assertEqual(self.never.etag, '"v2"')
+        self.assertEqual(self.never.last_fetch_status, ContentData.FETCH_OK)
+        # キャッシュには表示用の項目だけを保存する
+        self.assertEqual(ogp_cache.lookup(self.never.content_url).data,
+                         {'title': '完全版', 'description': '説明', 'image': ''})
+
+        # 2回目は対象がない（中断後の再実行も処理済みの行は飛ばす）
+        mock_fetch.reset_mock()
+        self.refresh()
+        mock_fetch.assert_not_called()
+
+    @patch('userpost.services.revalidate_ogp_data')
+    def test_limit_and_circuit_open(self, mock_fetch):
+        mock_fetch.side_effect = OgpNotFound('404')
+        self.refresh(limit=1)
+        self.popular.refresh_from_db()
+        self.assertEqual(self.popular.last_fetch_status, ContentData.FETCH_NOT_FOUND)
+        self.assertEqual(mock_fetch.call_count, 1)
+
+        def circuit_open(*args, **kwargs):
+            try:
+                raise CircuitOpenError('open')
+            except CircuitOpenError as e:
+                raise OgpFetchError('open') from e
+        mock_fetch.side_effect = circuit_open
+        self.refresh()
+        self.never.refresh_from_db()
+        self.assertIsNone(self.never.last_fetched_at)
+
+    @patch('userpost.services.revalidate_ogp_data')
+    def test_invalid_url_is_not_found(self, mock_fetch):
+        mock_fetch.side_effect = OgpInvalidUrl('invalid')
+        self.refresh(limit=1)
+        self.popular.refresh_from_db()
+        self.assertEqual(self.popular.last_fetch_status, ContentData.FETCH_NOT_FOUND)
+
+class TestCounters(TransactionTestCase):
+    """登録数の加減算と reconcile_counters のテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def test_parallel_adjust_loses_no_updates(self):
+        content = ContentData.objects.create(content_url=self.base + 'RJ01230861.html', good_count=0)
+        n = 8
+        barrier = threading.Barrier(n)
+
+        def bump():
+            try:
+                barrier.wait()
+                for _ in range(5):
+                    counters.adjust_good_count(content.id, 1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=bump) for _ in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        content.refresh_from_db()
+        self.assertEqual(content.good_count, n * 5)
+
+    def test_decrement_to_zero_deletes_content(self):
+        content = ContentData.objects.create(content_url=self.base + 'RJ01230861.html', good_count=2)
+        self.assertEqual(counters.adjust_good_count(content.id, -1), 1)
+        self.assertEqual(counters.adjust_good_count(content.id, -5), 0)
+        self.assertFalse(ContentData.objects.filter(id=content.id).exists())
+        self.assertIsNone(counters.adjust_good_count(content.id, 1))
+
+    def test_reconcile_counters(self):
+        from userlists.models import UserList, GootList
+        User = get_user_model()
+        users = [User.objects.create(username=f'counter{i}') for i in range(3)]
+        drifted = ContentData.objects.create(content_url=self.base + 'RJ00000001.html', good_count=7)
+        exact = ContentData.objects.create(content_url=self.base + 'RJ00000002.html', good_count=1)
+        for u in users:
+            Good.objects.create(user=u, username_legacy=u.username, content_url=drifted.content_url, content=drifted)
+        Good.objects.create(user=users[0], username_legacy='counter0', content_url=exact.content_url, content=exact)
+        userlist = UserList.objects.create(owner=users[0], name='集計', goot_count=0)
+        GootList.objects.create(user=users[1], userlist=userlist)
+
+        out = StringIO()
+        call_command('reconcile_counters', chunk_size=1, stdout=out)
+
+        drifted.refresh_from_db()
+        exact.refresh_from_db()
+        userlist.refresh_from_db()
+        self.assertEqual((drifted.good_count, exact.good_count, userlist.goot_count), (3, 1, 1))
+        self.assertIn('userpost.ContentData.good_count: checked=2 fixed=1 drift=4 net=-4', out.getvalue())
+        self.assertIn('fixed=1 drift=1 net=+1', out.getvalue())
+
+@override_settings(COUNTER_WRITE_BEHIND=True)
+class TestCounterWriteBehind(APITestCase):
+    """登録数の追記方式（write-behind）のテスト"""
+    content_url = 'https://www.dlsite.com/maniax/work/=/product_id/RJ01230861.html'
+
+    def test_deltas_are_read_and_flushed(self):
+        content = ContentData.objects.create(content_url=self.content_url, title='T', good_count=1)
+        for _ in range(2):
+            client = APIClient()
+            client.cookies['guest_id'] = str(uuid.uuid4())
+            response = client.post(reverse('content-good', args=[content.id]), {'content_url': self.content_url}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['good_count'], 3)
+        # 本体の行はまだ更新されず、読み取りでは未反映分が足される
+        content.refresh_from_db()
+        self.assertEqual(content.good_count, 1)
+        self.assertEqual(CounterDelta.objects.count(), 2)
+        self.assertEqual(self.client.get(reverse('content-detail', args=[content.id])).data['good_count'], 3)
+        self.assertEqual(self.client.get(reverse('content-list')).data['results'][0]['good_count'], 3)
+
+        self.assertEqual(counters.flush(), 2)
+        content.refresh_from_db()
+        self.assertEqual(content.good_count, 3)
+        self.assertEqual(CounterDelta.objects.count(), 0)
+
+        # 0 になった作品は反映時に削除される
+        counters.adjust_good_count(content.id, -3)
+        self.assertTrue(ContentData.objects.filter(id=content.id).exists())
+        counters.flush()
+        self.assertFalse(ContentData.objects.filter(id=content.id).exists())
+
+class TestContentCache(TransactionTestCase):
+    """作品データの2段キャッシュのテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def setUp(self):
+        cache.clear()
+        content_cache.clear_local()
+        for i in range(3):
+            ContentData.objects.create(content_url=self.base + f'RJ0000000{i}.html', title=f'作品{i}', good_count=1)
+
+    def tearDown(self):
+        cache.clear()
+        content_cache.clear_local()
+
+    def test_tiers_and_invalidation(self):
+        ids = ['RJ00000000', 'RJ00000001', 'RJ00000002', 'RJ09999999']
+        with self.assertNumQueries(1):
+            found = content_cache.get_many(ids)
+        self.assertEqual(sorted(found), ids[:3])
+        before = content_cache.stats()
+        # 2回目はDBに行かず LRU から返す
+        with self.assertNumQueries(0):
+            self.assertEqual(content_cache.get_for_url(self.base + 'RJ00000001.html?x=1').title, '作品1')
+        # 他のワーカー（LRU が空）は共有キャッシュから返す
+        content_cache.clear_local()
+        with self.assertNumQueries(0):
+            content_cache.get('RJ00000002')
+        after = content_cache.stats()
+        self.assertEqual(after['local_hit'] - before['local_hit'], 1)
+        self.assertEqual(after['shared_hit'] - before['shared_hit'], 1)
+
+        # 保存・削除で無効化される
+        content = ContentData.objects.get(product_id='RJ00000001')
+        content.title = '変更後'
+        content.save()
+        self.assertEqual(content_cache.get('RJ00000001').title, '変更後')
+        ContentData.objects.filter(product_id='RJ00000002').delete()
+        self.assertIsNone(content_cache.get('RJ00000002'))
+
+    def test_exact_and_copies(self):
+        cached = content_cache.get('RJ00000000')
+        cached.good_count = 99
+        ContentData.objects.filter(product_id='RJ00000000').update(good_count=5)
+        # 登録数は少し古くてもよい。正確な値は exact=True で読む
+        self.assertEqual(content_cache.get('RJ00000000').good_count, 1)
+        self.assertEqual(content_cache.get('RJ00000000', exact=True).good_count, 5)
+
+    def test_not_cached_inside_transaction(self):
+        from django.db import transaction
+        with transaction.atomic():
+            content_cache.get('RJ00000000')
+        with self.assertNumQueries(1):
+            content_cache.get('RJ00000000')
+
+    def test_invalidation_waits_for_commit(self):
+        from django.db import transaction
+        content_cache.get('RJ00000000')
+        with transaction.atomic():
+            content = ContentData.objects.get(product_id='RJ00000000')
+            content.title = '変更後'
+            content.save()
+            # コミット前に他のリクエストが読んでも、変更前の値がキャッシュに戻されないように残しておく
+            self.assertEqual(cache.get('content_data:RJ00000000').title, '作品0')
+        self.assertIsNone(cache.get('content_data:RJ00000000'))
+        self.assertEqual(content_cache.get('RJ00000000').title, '変更後')
+
+    @patch('userpost.services.dlsite_get_ogp_data')
+    def test_create_with_deleted_cached_content(self, mock_ogp):
+        mock_ogp.return_value = {'title': '再取得', 'description': '', 'image': ''}
+        stale = content_cache.get('RJ00000000')
+        ContentData.objects.filter(product_id='RJ00000000').delete()
+        # 他のワーカーで削除され、このワーカーの LRU には残っている
+        content_cache._local_set('RJ00000000', stale)
+
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create(username='stale'))
+        response = client.post(reverse('userpost-list'), {'content_url': stale.content_url}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        content = ContentData.objects.get(product_id='RJ00000000')
+        self.assertEqual((content.title, content.good_count), ('再取得', 1))
+        self.assertEqual(UserPost.objects.get().content, content)
+        self.assertEqual(Good.objects.get().content, content)
+
+
+class TestSingleFlightCreate(TransactionTestCase):
+    """同じURLを同時に登録しても上流取得とContentData作成が1回になることのテスト"""
+    content_url = 'https://www.dlsite.com/maniax/work/=/product_id/RJ01230861.html'
+
+    def tearDown(self):
+        # テーブルの消去はシグナルを送らないので、作品キャッシュも消す
+        cache.clear()
+        content_cache.clear_local()
+
+    @override_settings(SINGLE_FLIGHT_WAIT_SECONDS=10)
+    @patch('userpost.utils.fetch_ogp_data')
+    def test_parallel_creates(self, mock_fetch):
+        def slow_fetch(url):
+            time.sleep(0.3)
+            return {'title': 'T', 'description': 'D', 'image': 'I', 'url': url}
+        mock_fetch.side_effect = slow_fetch
+        n = 6
+        barrier = threading.Barrier(n)
+        statuses = []
+
+        def register():
+            try:
+                client = APIClient()
+                barrier.wait()
+                response = client.post(reverse('userpost-list'), {'content_url': self.content_url}, format='json')
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=register) for _ in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(statuses, [status.HTTP_201_CREATED] * n)
+        self.assertEqual(mock_fetch.call_count, 1)
+        self.assertEqual(ContentData.objects.count(), 1)
+        self.assertEqual(UserPost.objects.count(), n)
+        self.assertEqual(ContentData.objects.get().good_count, n)
+        self.assertEqual(FetchLease.objects.count(), 0)
+
+class TestHotQueryIndexes(TestCase):
+    """よく使う検索がインデックスを使うことを EXPLAIN で確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        from userlists.models import UserList, GootList
+        User = get_user_model()
+        users = [User.objects.create(username=f'index{i}') for i in range(20)]
+        lists = [UserList.objects.create(owner=u, name='索引') for u in users]
+        UserPost.objects.bulk_create([
+            UserPost(user=u, list=lists[i], username_legacy=u.username,
+                     content_url=f'https://www.dlsite.com/maniax/work/=/product_id/RJ{i:04d}{j:04d}.html')
+            for i, u in enumerate(users) for j in range(25)
+        ])
+        Good.objects.bulk_create([
+            Good(user=p.user, username_legacy=p.username_legacy, content_url=p.content_url)
+            for p in UserPost.objects.all()
+        ])
+        GootList.objects.bulk_create([GootList(user=users[0], userlist=lst) for lst in lists[1:]])
+        cls.user, cls.userlist = users[3], lists[3]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, *index_names):
+        if connection.vendor == 'postgresql':
+            # 少量のデータでは順次走査が選ばれるため、インデックスが使えるかだけを見る
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names), plan)
+
+    def test_hot_queries_use_indexes(self):
+        from userlists.models import UserList, GootList
+        url = UserPost.objects.filter(user=self.user).first().content_url
+        self.assertUsesIndex(
+            UserPost.objects.filter(user__username=self.user.username).order_by('-created_at'),
+            'userpost_user_created_idx',
+        )
+        self.assertUsesIndex(
+            UserPost.objects.filter(list_id=self.userlist.id).order_by('-created_at'),
+            'userpost_list_created_idx',
+        )
+        self.assertUsesIndex(UserPost.objects.filter(user=self.user, content_url=url), 'userpost_user_url_idx')
+        self.assertUsesIndex(Good.objects.filter(user=self.user, content_url=url), 'good_user_url_idx')
+        self.assertUsesIndex(
+            UserList.objects.filter(owner=self.user).order_by('-updated_at'),
+            'userlist_owner_updated_idx',
+        )
+        self.assertUsesIndex(
+            GootList.objects.filter(user=self.user, userlist=self.userlist),
+            # SQLite では一意制約がテーブル制約として作られ、自動インデックス名になる
+            'uniq_user_list_goot', 'sqlite_autoindex_userlists_gootlist',
+        )
+
+class TestPurgeGuests(TestCase):
+    """放置されたゲストユーザーの削除（purge_guests）のテスト"""
+    base = 'https://www.dlsite.com/maniax/work/=/product_id/'
+
+    def purge(self, **options):
+        out = StringIO()
+        call_command('purge_guests', days=30, chunk_size=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_purge_keeps_counts_consistent(self):
+        from accounts.utils import get_or_create_guest_user
+        from userlists.models import UserList, GootList
+        User = get_user_model()
+        member = User.objects.create(username='member')
+        old, _ = get_or_create_guest_user(str(uuid.uuid4()))
+        recent, _ = get_or_create_guest_user(str(uuid.uuid4()))
+        content = ContentData.objects.create(content_url=self.base + 'RJ01230861.html', good_count=2)
+        only_old = ContentData.objects.create(content_url=self.base + 'RJ01230862.html', good_count=1)
+        for user in (old, member):
+            UserPost.objects.create(user=user, username_legacy=str(user), content_url=content.content_url, content=content)
+            Good.objects.create(user=user, username_legacy=str(user), content_url=content.content_url, content=content)
+        Good.objects.create(user=old, content_url=only_old.content_url, content=only_old)
+        UserPost.objects.create(user=recent, content_url=content.content_url)
+        member_list = UserList.objects.get(owner=member)
+        old_list = UserList.objects.get(owner=old)
+        GootList.objects.create(user=old, userlist=member_list)
+        GootList.objects.create(user=member, userlist=old_list)
+        UserList.objects.filter(pk=member_list.pk).update(goot_count=1)
+
+        # 古いゲストの行だけ、最後の操作を60日前にする
+        past = timezone.now() - timedelta(days=60)
+        User.objects.filter(pk=old.pk).update(updated_at=past)
+        User.objects.filter(pk=recent.pk).update(updated_at=past)
+        for model, fk in [(UserPost, 'user'), (Good, 'user'), (GootList, 'user')]:
+            model.objects.filter(**{fk: old}).update(created_at=past)
+        UserList.objects.filter(owner=old).update(updated_at=past)
+
+        dry = self.purge(dry_run=True)
+        self.assertIn('[dry-run] userpost.Good: removed=2', dry)
+        self.assertTrue(User.objects.filter(pk=old.pk).exists())
+
+        out = self.purge()
+        self.assertFalse(User.objects.filter(pk=old.pk).exists())
+        self.assertTrue(User.objects.filter(pk=recent.pk).exists())
+        self.assertFalse(UserList.objects.filter(pk=old_list.pk).exists())
+        self.assertEqual(GootList.objects.count(), 0)
+        content.refresh_from_db()
+        member_list.refresh_from_db()
+        self.assertEqual((content.good_count, member_list.goot_count), (1, 0))
+        # 登録数が 0 になった作品は削除される
+        self.assertFalse(ContentData.objects.filter(pk=only_old.pk).exists())
+        for line in [
+            'accounts.User: removed=1', 'userpost.UserPost: removed=1', 'userpost.Good: removed=2',
+            'userlists.UserList: removed=1', 'userlists.GootList: removed=2',
+        ]:
+            self.assertIn(line, out)
+        self.assertNotIn('removed', self.purge())
+
 class TestUserPostCreateDirect(APITestCase):
     def test_create_direct(self):
         factory = APIRequestFactory()
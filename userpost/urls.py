@@ -10,5 +10,6 @@ router.register(r'public_users', views.PublicUsersView, basename='public-users')
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path('api/metrics/', views.MetricsView.as_view(), name='metrics'),
     path('api/', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,11 +1,100 @@
 import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse
-from rest_framework.exceptions import ValidationError
+from django.conf import settings
+
+from . import ogp_cache
+from .dlsite_client import get_client
+from .models import OgpCache
+from .ogp_parser import CHUNK_SIZE, extract_ogp
+
+
+class OgpFetchError(Exception):
+    """OGP取得失敗（キャッシュに保存するステータスを持つ）"""
+    status = OgpCache.STATUS_ERROR
+
+
+class OgpInvalidUrl(OgpFetchError):
+    status = OgpCache.STATUS_INVALID
+
+
+class OgpNotFound(OgpFetchError):
+    status = OgpCache.STATUS_NOT_FOUND
+
+
+def is_dlsite_url(url:str) -> bool:
+    """OGP取得対象（DLSiteの作品ページ）のURLかどうか"""
+    return urlparse(url or '').netloc == 'www.dlsite.com'
+
+
+def fetch_ogp_data(url:str):
+    """
+    DLSiteからOGPデータを取得する（キャッシュを使わない）
+    Args:
+        url: DLSiteのURL
+    Returns:
+        ogp_data: dlsite_get_ogp_data と同じ形式
+    Raises:
+        OgpInvalidUrl: DLSite以外のURL
+        OgpNotFound: 作品ページが存在しない（404/410）
+        OgpFetchError: タイムアウトなどその他の取得失敗
+    """
+    return revalidate_ogp_data(url)['ogp_data']
+
+
+def revalidate_ogp_data(url:str, etag:str='', last_modified:str=''):
+    """
+    保存済みのバリデータ（ETag/Last-Modified）付きの条件付きGETでOGPデータを取得する
+    Returns:
+        {
+            'not_modified': 304が返ったか（True の場合 ogp_data は None）,
+            'ogp_data': fetch_ogp_data と同じ形式,
+            'etag': レスポンスのETag,
+            'last_modified': レスポンスのLast-Modified,
+        }
+    Raises:
+        fetch_ogp_data と同じ
+    """
+    ogp_data = {
+        'title': '',
+        'description': '',
+        'image': '',
+        'url': url
+    }
+    if not is_dlsite_url(url):
+        raise OgpInvalidUrl('Invalid URL')
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    try:
+        # <head> 内のOGPだけが必要なので </head> で解析をやめる（残りはクライアントが上限まで読み捨て、接続を再利用する）
+        with get_client().get(url, headers=headers, stream=True) as response:
+            validators = {
+                'etag': response.headers.get('ETag', ''),
+                'last_modified': response.headers.get('Last-Modified', ''),
+            }
+            if response.status_code == 304:
+                return {'not_modified': True, 'ogp_data': None, **validators}
+            if response.status_code in (404, 410):
+                raise OgpNotFound(f'{response.status_code} {url}')
+            response.raise_for_status()
+            values, _ = extract_ogp(
+                response.iter_content(chunk_size=CHUNK_SIZE),
+                encoding=response.encoding,
+                max_bytes=settings.OGP_MAX_HEAD_BYTES,
+            )
+    except requests.exceptions.RequestException as e:
+        raise OgpFetchError(str(e)) from e
+
+    ogp_data.update(values)
+    return {'not_modified': False, 'ogp_data': ogp_data, **validators}
+
 
 def dlsite_get_ogp_data(url:str):
     """
-    DLSiteのOGPデータを取得する
+    DLSiteのOGPデータを取得する（OGPキャッシュ経由）
     Args:
         url: DLSiteのURL
     Returns:
@@ -16,32 +105,69 @@ def dlsite_get_ogp_data(url:str):
             'image': 画像URL,
             'url': URL
         }
+        取得に失敗した場合（失敗がキャッシュされている場合を含む）は None
     """
     #https://dlaf.jp/maniax/dlaf/=/t/s/link/work/aid/orenodojinme_ta/id/RJ01473335.html
     #https://dlaf.jp/maniax/dlaf/=/t/s/link/work/aid/orenodojinme_ta/id/RJ01472676.html
     try:
-        ogp_data = {
-            'title': '',
-            'description': '',
-            'image': '',
-            'url': url
-        }
-        parsed_url = urlparse(url)
-        if parsed_url.netloc != 'www.dlsite.com':
-            raise ValidationError('Invalid URL')
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-        }
-        response = requests.get(url, headers=headers, timeout=5)
-        response.raise_for_status()
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-        meta_tags = soup.find_all('meta')
-        for tag in meta_tags:
-            if tag.get('property') in ['og:title', 'og:description', 'og:image']:
-                property_name = tag.get('property').replace('og:', '')
-                ogp_data[property_name] = tag.get('content', '')
+        cached = ogp_cache.lookup(url)
+        if cached is not None:
+            if cached.status != OgpCache.STATUS_OK:
+                return None
+            return {**cached.data, 'url': url}
+        try:
+            ogp_data = fetch_ogp_data(url)
+        except OgpFetchError as e:
+            ogp_cache.store(url, e.status)
+            raise
+        ogp_cache.store(url, OgpCache.STATUS_OK, _cache_fields(ogp_data))
         return ogp_data
     except Exception as e:
         print(e)
-        return None
\ No newline at end of file
+        return None
+
+
+def _cache_fields(ogp_data):
+    return {k: ogp_data[k] for k in ('title', 'description', 'image')}
+
+
+def dlsite_get_ogp_data_many(urls, max_workers=None):
+    """
+    複数URLのOGPデータをまとめて取得する
+    キャッシュは1クエリで参照し、キャッシュにないURLだけをスレッドプールで並列に取得する
+    （DBアクセスは呼び出し元のスレッドでのみ行う）
+    Args:
+        urls: DLSiteのURLのリスト
+        max_workers: 同時取得数（省略時は settings.OGP_BULK_FETCH_WORKERS）
+    Returns:
+        {url: ogp_data または None}
+    """
+    results = {}
+    cached = ogp_cache.lookup_many(urls)
+    misses = []
+    for url in dict.fromkeys(urls):
+        entry = cached.get(url)
+        if entry is None:
+            misses.append(url)
+        elif entry.status == OgpCache.STATUS_OK:
+            results[url] = {**entry.data, 'url': url}
+        else:
+            results[url] = None
+    if not misses:
+        return results
+    with ThreadPoolExecutor(max_workers=max_workers or settings.OGP_BULK_FETCH_WORKERS) as pool:
+        futures = {pool.submit(fetch_ogp_data, url): url for url in misses}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                ogp_data = future.result()
+            except OgpFetchError as e:
+                ogp_cache.store(url, e.status)
+                results[url] = None
+            except Exception as e:
+                print(e)
+                results[url] = None
+            else:
+                ogp_cache.store(url, OgpCache.STATUS_OK, _cache_fields(ogp_data))
+                results[url] = ogp_data
+    return results
@@ -0,0 +1,61 @@
+"""
+リソースのバージョン番号（キャッシュの無効化・条件付きGET用）
+
+データが変わったら bump() でバージョンを上げ、キャッシュキーにバージョンを含めることで
+古いスナップショットを参照しないようにする。バージョンはDBにあるので全ワーカーで共有される。
+ユーザーごと（user:{id}）・リストごと（list:{id}）のバージョンは userpost.signals が上げる。
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ResourceVersion
+
+PUBLIC_USERS = 'public_users'
+
+
+def user(user_id) -> str:
+    """ユーザーの投稿・リスト一覧のバージョン名"""
+    return f'user:{user_id}'
+
+
+def userlist(list_id) -> str:
+    """リスト（本体・投稿・お気に入り）のバージョン名"""
+    return f'list:{list_id}'
+
+
+def get(name: str) -> int:
+    """現在のバージョン（未作成なら 0）"""
+    return ResourceVersion.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+
+def get_many(names):
+    """
+    複数のバージョンを1クエリで取得する
+    Returns:
+        {name: (version, updated_at)}（未作成の名前は含まない）
+    """
+    rows = ResourceVersion.objects.filter(name__in=list(names)).values_list('name', 'version', 'updated_at')
+    return {name: (version, updated_at) for name, version, updated_at in rows}
+
+
+def bump(name: str):
+    """バージョンを1つ上げる"""
+    if ResourceVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            ResourceVersion.objects.create(name=name, version=1)
+    except IntegrityError:
+        ResourceVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=timezone.now())
+
+
+def bump_many(names):
+    """複数のバージョンを上げる（既存の行は1本の UPDATE でまとめて上げる）"""
+    names = {name for name in names if name}
+    if not names:
+        return
+    ResourceVersion.objects.filter(name__in=names).update(version=F('version') + 1, updated_at=timezone.now())
+    existing = set(ResourceVersion.objects.filter(name__in=names).values_list('name', flat=True))
+    for name in names - existing:
+        bump(name)
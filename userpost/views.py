@@ -2,27 +2,39 @@ from django.shortcuts import render
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.db import transaction
+from django.conf import settings
 import json
 from .models import UserPost, ContentData, Good
 from django.contrib.auth import get_user_model
-from .serializers import UserPostSerializer, UserPostCreateSerializer, ContentDataSerializer, ContentDataCreateSerializer
+from .serializers import UserPostSerializer, UserPostCreateSerializer, ContentDataSerializer, ContentDataCreateSerializer, expanded
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from .utils import dlsite_get_ogp_data
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.views import APIView
+from .utils import OgpFetchError, OgpInvalidUrl
+from .work_url import extract_product_id, normalize_work_url
+from . import ogp_cache
+from .dlsite_client import get_client
+from .services import bulk_register_posts, delete_posts, get_or_fetch_content_data, same_work
+from . import counters, versions
+from . import conditional, content_cache
+from .conditional import Validators, list_scope
+from .counters import adjust_good_count
 from userlists.models import UserList
 from rest_framework.exceptions import ValidationError
 from userlists.models import UserList
-from django.db.models import Q
-from accounts.utils import get_or_create_guest_user
+from django.core.cache import cache
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from accounts.utils import get_actor
 
 # Create your views here.
 def index(request):
     return HttpResponse("Hello, world.")
 
 class UserPostViewSet(viewsets.ModelViewSet):
-    queryset = UserPost.objects.all().order_by('-created_at')
+    queryset = UserPost.objects.select_related('user', 'list', 'content').order_by('-created_at')
     serializer_class = UserPostSerializer
 
     def get_permissions(self):
@@ -34,7 +46,7 @@ class UserPostViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permission_classes]
 
     def get_queryset(self):
-        queryset = UserPost.objects.all().order_by('-created_at')
+        queryset = UserPost.objects.select_related('user', 'list', 'content').order_by('-created_at')
         username = self.request.query_params.get('username') or self.request.query_params.get('user_id')
         list_id = self.request.query_params.get('list_id')
         if username:
@@ -62,27 +74,54 @@ class UserPostViewSet(viewsets.ModelViewSet):
             return UserPostCreateSerializer
         return UserPostSerializer
 
+    def list(self, request, *args, **kwargs):
+        validators = self._validators(request)
+        if validators is None:
+            return super().list(request, *args, **kwargs)
+        # 投稿者・リストのバージョンが変わっていなければ一覧を取得せずに 304 を返す
+        if validators.not_modified():
+            return validators.not_modified()
+        return validators.cached(lambda: super(UserPostViewSet, self).list(request, *args, **kwargs))
+
+    def _validators(self, request):
+        """?username= / ?list_id= で絞った一覧の検証子（作品を埋め込む場合や絞り込みなしは対象外）"""
+        if expanded(request, 'content'):
+            return None
+        names = []
+        username = request.query_params.get('username') or request.query_params.get('user_id')
+        if username:
+            user_id = get_user_model().objects.filter(username=username).values_list('id', flat=True).first()
+            if user_id is None:
+                return None
+            names.append(versions.user(user_id))
+        # 投稿には閲覧者ごとの項目がないので、閲覧者で変わるのは非公開リストを見られるかどうかだけ
+        scope = 'all'
+        list_id = request.query_params.get('list_id')
+        if list_id:
+            try:
+                list_id = int(list_id)
+            except ValueError:
+                return None
+            owner_id = UserList.objects.filter(pk=list_id).values_list('owner_id', flat=True).first()
+            if owner_id is None:
+                return None
+            names.append(versions.userlist(list_id))
+            scope = list_scope(request, owner_id, list_id)
+        return Validators(request, names, scope=scope) if names else None
+
+    def get_serializer(self, *args, **kwargs):
+        if args and self.action in ('list', 'retrieve') and expanded(self.request, 'content'):
+            # 埋め込む作品の登録数の未反映分（write-behind 時）をページ単位でまとめて取得する
+            posts = args[0] if isinstance(args[0], (list, tuple)) else [args[0]]
+            counters.attach_pending([p.content for p in posts], 'good_count')
+        return super().get_serializer(*args, **kwargs)
+
     def create(self, request, *args, **kwargs):
         data = request.data.copy()
         
         # 認証済みユーザーまたはゲストユーザーを取得
-        user = None
-        username = None
-        
-        if request.user.is_authenticated:
-            user = request.user
-            username = request.user.username
-        else:
-            # ゲストユーザーの場合、guest_idからUserを取得または作成
-            guest_id = getattr(request, 'guest_id', None)
-            if guest_id:
-                user, _ = get_or_create_guest_user(guest_id)
-                # username_legacy には空文字ではなくゲストIDベースの識別子を保存
-                username = f"u-{guest_id}"
-            else:
-                return Response({
-                    'error': '認証が必要です'
-                }, status=status.HTTP_401_UNAUTHORIZED)
+        # username_legacy には空文字ではなくゲストIDベースの識別子を保存
+        user, username = get_actor(request)
         
         if not user:
             return Response({
@@ -91,78 +130,105 @@ class UserPostViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(data=data, context={'request': request})
         if serializer.is_valid():
+            content_url = data.get('content_url')
+            if not content_url:
+                return Response({
+                    'error': 'URLが必要です'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            # 作品IDで識別し、既存の作品があればそのURL表記にそろえる
+            product_id, content_url = normalize_work_url(content_url)
+            if product_id is None:
+                return Response({
+                    'error': '無効なURLです'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            content_data = content_cache.get(product_id)
+            if content_data:
+                content_url = content_data.content_url
             existing_post = UserPost.objects.filter(
                 user=user,
-                content_url=data.get('content_url')
+                content_url=content_url
             ).first()
             if existing_post:
                 return Response({
                     'error': 'このURLはすでに登録されています'
                 }, status=status.HTTP_400_BAD_REQUEST)
-            content_url = data.get('content_url')
-            if not content_url:
-                return Response({
-                    'error': 'URLが必要です'
-                }, status=status.HTTP_400_BAD_REQUEST)
-            try:
-                with transaction.atomic():
-                    content_data = ContentData.objects.filter(content_url=content_url).first()
-                    if not content_data:
+            if not content_data:
+                # OGP取得は投稿のトランザクションの外で行う（同じ作品の同時登録では取得は1回だけ）
+                try:
+                    content_data = get_or_fetch_content_data(content_url, data.get('content_type', '未設定'))
+                except OgpInvalidUrl:
+                    return Response({
+                        'error': '無効なURLです'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                except OgpFetchError:
+                    return Response({
+                        'error': 'OGPデータの取得に失敗しました'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                content_url = content_data.content_url
+            # キャッシュから得た作品は他のワーカーで削除されていることがある。その場合は作り直して1回だけやり直す
+            for attempt in range(2):
+                try:
+                    with transaction.atomic():
+                        # Determine list to assign
+                        list_instance = getattr(serializer, '_list_instance', None)
+                        if list_instance is None:
+                            # default to Home list
+                            list_instance, _ = UserList.objects.get_or_create(owner=user, name='Home', defaults={'description': 'ホーム', 'is_public': True})
+                        instance = UserPost.objects.create(
+                            username_legacy=(username or (request.user.username if request.user.is_authenticated else 'guest')),
+                            user=user,
+                            description=serializer.validated_data.get('description'),
+                            content_url=content_url,
+                            content=content_data,
+                            list=list_instance
+                        )
+
                         try:
-                            ogp_data = dlsite_get_ogp_data(content_url)
-                        except ValidationError:
-                            return Response({
-                                'error': '無効なURLです'
-                            }, status=status.HTTP_400_BAD_REQUEST)
-                        if ogp_data:
-                            data_cd = {
-                                'content_url': content_url,
-                                'title': ogp_data.get('title', ''),
-                                'description': ogp_data.get('description', ''),
-                                'image': ogp_data.get('image', ''),
-                                'content_type': data.get('content_type', '未設定')
-                            }
-                            content_data = ContentData.objects.create(**data_cd)
-                        else:
+                            Good.objects.create(
+                                user=user,
+                                username_legacy=(username or (request.user.username if request.user.is_authenticated else 'guest')),
+                                content_url=content_url,
+                                content=content_data,
+                            )
+                        except Exception as e:
+                            print(f"作品登録数の記録に失敗しました: {e}")
                             return Response({
-                                'error': 'OGPデータの取得に失敗しました'
+                                'error': f"作品登録数の記録に失敗しました: {e}"
                             }, status=status.HTTP_400_BAD_REQUEST)
-                    # Determine list to assign
-                    list_instance = getattr(serializer, '_list_instance', None)
-                    if list_instance is None:
-                        # default to Home list
-                        list_instance, _ = UserList.objects.get_or_create(owner=user, name='Home', defaults={'description': 'ホーム', 'is_public': True})
-                    instance = UserPost.objects.create(
-                        username_legacy=(username or (request.user.username if request.user.is_authenticated else 'guest')),
-                        user=user,
-                        description=serializer.validated_data.get('description'),
-                        content_url=content_url,
-                        list=list_instance
-                    )
+                        # 登録数の UPDATE で行ロックを取るので、コミットまで作品は削除されない
+                        content_data.good_count = adjust_good_count(content_data.id, 1)
+                        if content_data.good_count is None:
+                            # 作品が削除されていた。投稿と Good を取り消す
+                            raise ContentData.DoesNotExist(content_data.product_id)
 
+                        if content_data.status == ContentData.STATUS_PENDING:
+                            # OGP取得完了は contents/{id}/ の status で確認する
+                            return Response({
+                                'success': '投稿を受け付けました',
+                                'data': UserPostSerializer(instance).data,
+                                'content': {'id': content_data.id, 'status': content_data.status},
+                            }, status=status.HTTP_202_ACCEPTED)
+                        return Response({
+                            'success': '投稿を完了',
+                            'data': UserPostSerializer(instance).data
+                        }, status=status.HTTP_201_CREATED)
+                except ContentData.DoesNotExist:
+                    if attempt:
+                        return Response({
+                                'error': '投稿に失敗しました'
+                        }, status=status.HTTP_400_BAD_REQUEST)
                     try:
-                        Good.objects.create(
-                            user=user,
-                            username_legacy=(username or (request.user.username if request.user.is_authenticated else 'guest')),
-                            content_url=content_url
-                        )
-                        content_data.good_count += 1
-                        content_data.save()
-                    except Exception as e:
-                        print(f"作品登録数の記録に失敗しました: {e}")
+                        content_data = get_or_fetch_content_data(content_url, data.get('content_type', '未設定'))
+                    except (OgpInvalidUrl, OgpFetchError):
                         return Response({
-                            'error': f"作品登録数の記録に失敗しました: {e}"
+                            'error': 'OGPデータの取得に失敗しました'
                         }, status=status.HTTP_400_BAD_REQUEST)
-
+                    content_url = content_data.content_url
+                except Exception as e:
+                    print(e)
                     return Response({
-                        'success': '投稿を完了',
-                        'data': UserPostSerializer(instance).data
-                    }, status=status.HTTP_201_CREATED)
-            except Exception as e:
-                print(e)
-                return Response({
-                        'error': '投稿に失敗しました'
-                }, status=status.HTTP_400_BAD_REQUEST)
+                            'error': '投稿に失敗しました'
+                    }, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def destroy(self, request, *args, **kwargs):
@@ -170,15 +236,7 @@ class UserPostViewSet(viewsets.ModelViewSet):
             userpost = self.get_object()
 
             # 操作主体のユーザー（認証 or ゲスト）を取得
-            actor = request.user if getattr(request.user, 'is_authenticated', False) else None
-            actor_name = None
-            if actor is None:
-                guest_id = getattr(request, 'guest_id', None)
-                if guest_id:
-                    actor, _ = get_or_create_guest_user(guest_id)
-                    actor_name = f"u-{guest_id}"
-            else:
-                actor_name = getattr(actor, 'username', None)
+            actor, actor_name = get_actor(request)
 
             # 権限チェック
             if (userpost.user and actor != userpost.user) or (not userpost.user and actor_name != userpost.username_legacy):
@@ -188,36 +246,61 @@ class UserPostViewSet(viewsets.ModelViewSet):
             username = userpost.username_legacy
 
             with transaction.atomic():
-                good_objects = Good.objects.filter(user=actor, content_url=content_url)
+                content_data = userpost.content or ContentData.objects.for_url(content_url).first()
+                work = same_work(content_data.id if content_data else None, content_url)
+                good_objects = Good.objects.filter(work, user=actor)
                 if not good_objects.exists():
-                    good_objects = Good.objects.filter(username_legacy=username, content_url=content_url)
-
-                content_data = ContentData.objects.filter(content_url=content_url).first()
-                if content_data and good_objects.exists():
-                    content_data.good_count -= good_objects.count()
-                    if content_data.good_count <= 0:
-                        content_data.delete()
-                        content_data = None
-                    else:
-                        content_data.save()
-
-                good_objects.delete()
+                    good_objects = Good.objects.filter(work, username_legacy=username)
+
+                deleted, _ = good_objects.delete()
                 self.perform_destroy(userpost)
+                if content_data and deleted:
+                    adjust_good_count(content_data.id, -deleted)
 
             return Response({'success': '投稿を削除しました'}, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({'error': '削除に失敗しました'}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'], permission_classes=[AllowAny])
+    def bulk_create(self, request, *args, **kwargs):
+        """複数の作品URLをまとめて登録する。URLごとに created/duplicate/invalid/fetch_failed を返す"""
+        user, username = get_actor(request)
+        if not user:
+            return Response({'error': '認証が必要です'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        urls = request.data.get('urls')
+        if not isinstance(urls, list) or not urls:
+            return Response({'error': 'urlsにURLのリストを指定してください'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(urls) > settings.BULK_IMPORT_MAX_URLS:
+            return Response({
+                'error': f'一度に登録できるのは{settings.BULK_IMPORT_MAX_URLS}件までです'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        list_id = request.data.get('list_id')
+        if list_id is not None:
+            try:
+                list_instance = UserList.objects.get(id=int(list_id), owner=user)
+            except (UserList.DoesNotExist, TypeError, ValueError):
+                return Response({'error': '指定されたリストが見つからないか、権限がありません'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            list_instance, _ = UserList.objects.get_or_create(owner=user, name='Home', defaults={'description': 'ホーム', 'is_public': True})
+
+        try:
+            results = bulk_register_posts(user, username, urls, list_instance, request.data.get('content_type', '未設定'))
+        except Exception as e:
+            print(e)
+            return Response({'error': '一括登録に失敗しました'}, status=status.HTTP_400_BAD_REQUEST)
+        summary = {}
+        for r in results:
+            summary[r['status']] = summary.get(r['status'], 0) + 1
+        return Response({'results': results, 'summary': summary}, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], permission_classes=[AllowAny])
     def move_list(self, request, *args, **kwargs):
         try:
             userpost = self.get_object()
             # 操作主体のユーザー（認証 or ゲスト）を取得
-            actor = request.user if getattr(request.user, 'is_authenticated', False) else None
-            if actor is None:
-                guest_id = getattr(request, 'guest_id', None)
-                if guest_id:
-                    actor, _ = get_or_create_guest_user(guest_id)
+            actor, _ = get_actor(request)
             # 権限チェック
             if (userpost.user and actor != userpost.user) or (not userpost.user and (not actor or actor.guest_id is None)):
                 return Response({'error': 'この投稿を編集する権限がありません'}, status=status.HTTP_400_BAD_REQUEST)
@@ -225,19 +308,120 @@ class UserPostViewSet(viewsets.ModelViewSet):
             if list_id is None:
                 return Response({'error': 'list_idが必要です'}, status=status.HTTP_400_BAD_REQUEST)
             try:
-                target_list = UserList.objects.get(id=int(list_id), owner=request.user)
+                target_list = UserList.objects.get(id=int(list_id), owner=actor, deleting=False)
             except UserList.DoesNotExist:
                 return Response({'error': '指定されたリストが見つからないか、権限がありません'}, status=status.HTTP_400_BAD_REQUEST)
+            if userpost.list_id:
+                # 移動元のリストはシグナルでは分からない
+                versions.bump(versions.userlist(userpost.list_id))
             userpost.list = target_list
             userpost.save(update_fields=['list'])
             return Response({'success': True, 'data': UserPostSerializer(userpost).data}, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({'error': 'リスト変更に失敗しました'}, status=status.HTTP_400_BAD_REQUEST)
 
+    def _authorize_bulk(self, request):
+        """
+        ids の投稿を1クエリで取得し、操作できるものとできないものに分ける
+        Returns:
+            (actor, 操作できる投稿IDのリスト, 投稿IDごとの結果) またはエラーの Response
+        """
+        actor, actor_name = get_actor(request)
+        if actor is None:
+            return Response({'error': '認証が必要です'}, status=status.HTTP_401_UNAUTHORIZED)
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            return Response({'error': 'idsに投稿IDのリストを指定してください'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > settings.BULK_IMPORT_MAX_URLS:
+            return Response({
+                'error': f'一度に操作できるのは{settings.BULK_IMPORT_MAX_URLS}件までです'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids = list(dict.fromkeys(int(i) for i in ids))
+        except (TypeError, ValueError):
+            return Response({'error': 'idsには数値を指定してください'}, status=status.HTTP_400_BAD_REQUEST)
+
+        owners = {
+            pk: (user_id, username)
+            for pk, user_id, username in UserPost.objects.filter(id__in=ids).values_list('id', 'user_id', 'username_legacy')
+        }
+        # 結果はリクエストの順に返す（操作できる投稿は呼び出し側で埋める）
+        allowed, results = [], dict.fromkeys(ids)
+        for pk in ids:
+            if pk not in owners:
+                results[pk] = 'not_found'
+                continue
+            user_id, username = owners[pk]
+            # destroy と同じ条件: 投稿者本人、または旧データはユーザー名が一致すること
+            if (user_id is not None and user_id != actor.id) or (user_id is None and username != actor_name):
+                results[pk] = 'forbidden'
+                continue
+            allowed.append(pk)
+        return actor, allowed, results
+
+    @staticmethod
+    def _bulk_response(results):
+        summary = {}
+        for r in results.values():
+            summary[r] = summary.get(r, 0) + 1
+        return Response({
+            'results': [{'id': pk, 'status': r} for pk, r in results.items()],
+            'summary': summary,
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], permission_classes=[AllowAny])
+    def bulk_delete(self, request, *args, **kwargs):
+        """複数の投稿をまとめて削除する。IDごとに deleted/not_found/forbidden を返す"""
+        authorized = self._authorize_bulk(request)
+        if isinstance(authorized, Response):
+            return authorized
+        _, allowed, results = authorized
+        if allowed:
+            try:
+                delete_posts(UserPost.objects.filter(id__in=allowed))
+            except Exception:
+                return Response({'error': '削除に失敗しました'}, status=status.HTTP_400_BAD_REQUEST)
+        for pk in allowed:
+            results[pk] = 'deleted'
+        return self._bulk_response(results)
+
+    @action(detail=False, methods=['post'], permission_classes=[AllowAny])
+    def bulk_move(self, request, *args, **kwargs):
+        """複数の投稿をまとめて別のリストへ移動する。IDごとに moved/not_found/forbidden を返す"""
+        authorized = self._authorize_bulk(request)
+        if isinstance(authorized, Response):
+            return authorized
+        actor, allowed, results = authorized
+        list_id = request.data.get('list_id')
+        if list_id is None:
+            return Response({'error': 'list_idが必要です'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            target_list = UserList.objects.get(id=int(list_id), owner=actor, deleting=False)
+        except (UserList.DoesNotExist, TypeError, ValueError):
+            return Response({'error': '指定されたリストが見つからないか、権限がありません'}, status=status.HTTP_400_BAD_REQUEST)
+        if allowed:
+            moved = UserPost.objects.filter(id__in=allowed)
+            # update() はシグナルを送らないので、移動元・移動先のリストと投稿者のバージョンをここで上げる
+            sources = set(moved.values_list('list_id', flat=True))
+            moved.update(list=target_list)
+            versions.bump_many(
+                [versions.userlist(list_id) for list_id in sources | {target_list.id} if list_id]
+                + [versions.user(actor.id)]
+            )
+            # 公開ユーザー一覧は公開リストの投稿だけを表示するので、移動で内容が変わる
+            if not actor.private:
+                versions.bump(versions.PUBLIC_USERS)
+        for pk in allowed:
+            results[pk] = 'moved'
+        return self._bulk_response(results)
+
 class ContentDataViewSet(viewsets.ModelViewSet):
     queryset = ContentData.objects.all().order_by('-created_at')
     serializer_class = ContentDataSerializer
 
+    def get_queryset(self):
+        return counters.with_pending(super().get_queryset(), 'good_count')
+
     def get_serializer_class(self):
         if self.action == 'create':
             return ContentDataCreateSerializer
@@ -250,96 +434,119 @@ class ContentDataViewSet(viewsets.ModelViewSet):
                 'error': 'URLが必要です'
             }, status=status.HTTP_400_BAD_REQUEST)
         content_type = request.data.get('content_type', '未設定')
-        ogp_data = dlsite_get_ogp_data(content_url)
-        if not ogp_data:
+        try:
+            content_data = get_or_fetch_content_data(content_url, content_type)
+        except OgpFetchError:
             return Response({
                 'error': 'OGPデータの取得に失敗しました'
             }, status=status.HTTP_400_BAD_REQUEST)
-        data = {
-            'content_url': content_url,
-            'title': ogp_data.get('title', ''),
-            'description': ogp_data.get('description', ''),
-            'image': ogp_data.get('image', ''),
-            'content_type': content_type
-        }
-        serializer = self.get_serializer(data=data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response({
-                'success': 'データを保存',
-                'data': serializer.data
-            }, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'success': 'データを保存',
+            'data': self.get_serializer(content_data).data
+        }, status=status.HTTP_201_CREATED)
     
     @action(detail=True, methods=['post'], permission_classes=[AllowAny])
     def good(self, request, *args, **kwargs):
         #Goodの処理として作ったけど、これは作品の登録数の管理として使用する
         content_data = self.get_object()
         # 操作主体（認証 or ゲスト）
-        actor = request.user if getattr(request.user, 'is_authenticated', False) else None
-        actor_name = getattr(actor, 'username', None) if actor else None
-        if actor is None:
-            guest_id = getattr(request, 'guest_id', None)
-            if guest_id:
-                actor, _ = get_or_create_guest_user(guest_id)
-                actor_name = f"u-{guest_id}"
+        actor, actor_name = get_actor(request)
         content_url = request.data.get('content_url')
         if not content_url:
             return Response({'error': 'content_urlが必要です'}, status=status.HTTP_400_BAD_REQUEST)
+        # 表記ゆれのあるURLでも、作品の正規URLでGoodを記録する
+        if content_data.product_id and extract_product_id(content_url) != content_data.product_id:
+            return Response({'error': 'content_urlが作品と一致しません'}, status=status.HTTP_400_BAD_REQUEST)
+        content_url = content_data.content_url
 
-        existing_good = Good.objects.filter(user=actor, content_url=content_url).first()
+        existing_good = Good.objects.filter(same_work(content_data.id, content_url), user=actor).first()
         if existing_good:
-            existing_good.delete()
-            content_data.good_count -= 1
+            deleted, _ = Good.objects.filter(pk=existing_good.pk).delete()
+            if deleted:
+                content_data.good_count = adjust_good_count(content_data.id, -deleted) or 0
             is_good = False
             if content_data.good_count <= 0:
-                content_data.delete()
-                return Response({'id': content_data.id if hasattr(content_data, 'id') else None, 'is_good': is_good, 'good_count': 0}, status=status.HTTP_200_OK)
+                return Response({'id': content_data.id, 'is_good': is_good, 'good_count': 0}, status=status.HTTP_200_OK)
         else:
             try:
                 Good.objects.create(
                     user=actor,
                     username_legacy=(actor_name or 'guest'),
-                    content_url=content_url
+                    content_url=content_url,
+                    content=content_data,
                 )
-                content_data.good_count += 1
+                content_data.good_count = adjust_good_count(content_data.id, 1)
                 is_good = True
             except Exception as e:
                 print(f"作品登録数の記録に失敗しました: {e}")
                 return Response({'error': f"作品登録数の記録に失敗しました: {e}"}, status=status.HTTP_400_BAD_REQUEST)
-        content_data.save()
         response_data = ContentDataSerializer(content_data).data
+        # adjust_good_count の戻り値は未反映の増減を含んだ値
+        response_data['good_count'] = content_data.good_count
         response_data['is_good'] = is_good
         return Response(response_data, status=status.HTTP_200_OK)
 
 
 class PublicUsersView(viewsets.ViewSet):
     permission_classes = [AllowAny]
+    USER_LIMIT = 100
+    POSTS_PER_USER = 20
 
     def list(self, request):
         """List users with private=False and their recent posts."""
+        # 公開ユーザーの投稿・リスト公開設定が変わるとバージョンが上がる（userpost.signals）
+        validators = Validators(request, [versions.PUBLIC_USERS], scope='all')
+        if validators.not_modified():
+            return validators.not_modified()
+        key = f'public_users:v{validators.versions[versions.PUBLIC_USERS]}'
+        result = cache.get(key)
+        if result is None:
+            result = self.build()
+            cache.set(key, result, settings.PUBLIC_USERS_CACHE_TTL)
+        return validators.apply(Response(result))
+
+    def build(self):
+        """ユーザー1クエリ + 投稿1クエリ（ユーザーごとの新着 POSTS_PER_USER 件をウィンドウ関数で絞り、作品を JOIN）"""
         User = get_user_model()
-        users = User.objects.filter(private=False).order_by('id')[:100]
-        result = []
-        for u in users:
-            posts = (
-                UserPost.objects
-                .filter(user=u)
-                .filter(Q(list__isnull=True) | Q(list__is_public=True))
-                .order_by('-created_at')[:20]
+        users = list(User.objects.filter(private=False).order_by('id').values('id', 'username')[:self.USER_LIMIT])
+        posts = (
+            UserPost.objects
+            .filter(user_id__in=[u['id'] for u in users])
+            .filter(Q(list__isnull=True) | Q(list__is_public=True))
+            .annotate(rank=Window(
+                RowNumber(),
+                partition_by=F('user_id'),
+                order_by=[F('created_at').desc(), F('id').desc()],
+            ))
+            .filter(rank__lte=self.POSTS_PER_USER)
+            .order_by('user_id', 'rank')
+            .values(
+                'id', 'user_id', 'content_url', 'description', 'created_at',
+                'content__title', 'content__image', 'content__content_type',
             )
-            result.append({
-                'username': u.username,
-                'posts': [
-                    {
-                        'id': p.id,
-                        'content_url': p.content_url,
-                        'description': p.description,
-                        'title': (ContentData.objects.filter(content_url=p.content_url).values_list('title', flat=True).first() or ''),
-                        'image': (ContentData.objects.filter(content_url=p.content_url).values_list('image', flat=True).first() or ''),
-                        'content_type': (ContentData.objects.filter(content_url=p.content_url).values_list('content_type', flat=True).first() or ''),
-                        'created_at': p.created_at.isoformat(),
-                    } for p in posts
-                ]
+        )
+        posts_by_user = {u['id']: [] for u in users}
+        for p in posts:
+            posts_by_user[p['user_id']].append({
+                'id': p['id'],
+                'content_url': p['content_url'],
+                'description': p['description'],
+                'title': p['content__title'] or '',
+                'image': p['content__image'] or '',
+                'content_type': p['content__content_type'] or '',
+                'created_at': p['created_at'].isoformat(),
             })
-        return Response(result)
\ No newline at end of file
+        return [{'username': u['username'], 'posts': posts_by_user[u['id']]} for u in users]
+
+
+class MetricsView(APIView):
+    """OGPキャッシュとdlsiteクライアントの状態（管理者のみ。値は応答したワーカープロセスのもの）"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'ogp_cache': ogp_cache.stats(),
+            'dlsite_client': get_client().stats(),
+            'response_cache': conditional.stats(),
+            'content_cache': content_cache.stats(),
+        })
@@ -0,0 +1,43 @@
+"""
+dlsite作品URLの正規化
+
+maniax/home などのフロア違い、クエリ文字列、末尾スラッシュ、dlaf.jp のアフィリエイトリンクなど
+同じ作品を指すURLを、作品ID（RJ01473335 など）と正規URLにまとめる。
+"""
+import re
+from urllib.parse import urlparse
+
+WORK_HOSTS = {'www.dlsite.com', 'dlsite.com', 'dlaf.jp'}
+PRODUCT_ID_RE = re.compile(r'(?<![A-Za-z0-9])([RBV][JE]\d{6,8})(?![0-9])', re.IGNORECASE)
+FLOORS = {
+    'home', 'maniax', 'books', 'pro', 'soft', 'girls', 'girls-pro', 'girls-drama',
+    'bl', 'bl-pro', 'bl-drama', 'comic', 'eng', 'ecchi-eng', 'aix', 'gay',
+}
+DEFAULT_FLOORS = {'R': 'maniax', 'B': 'books', 'V': 'pro'}
+
+
+def extract_product_id(url):
+    """URLから作品IDを取り出す（dlsite/dlaf以外のURLや作品IDがない場合は None）"""
+    try:
+        parsed = urlparse((url or '').strip())
+    except ValueError:
+        return None
+    if parsed.netloc.lower() not in WORK_HOSTS:
+        return None
+    match = PRODUCT_ID_RE.search(parsed.path)
+    return match.group(1).upper() if match else None
+
+
+def normalize_work_url(url):
+    """
+    作品URLを正規化する
+    Returns:
+        (product_id, canonical_url)。作品URLでなければ (None, None)
+        canonical_url は https://www.dlsite.com/{フロア}/work/=/product_id/{作品ID}.html
+    """
+    product_id = extract_product_id(url)
+    if product_id is None:
+        return None, None
+    segments = [s for s in urlparse(url.strip()).path.split('/') if s]
+    floor = segments[0].lower() if segments and segments[0].lower() in FLOORS else DEFAULT_FLOORS[product_id[0]]
+    return product_id, f'https://www.dlsite.com/{floor}/work/=/product_id/{product_id}.html'